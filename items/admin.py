@@ -1,5 +1,16 @@
-from django.contrib import admin
-from .models import Category, Item
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from . import bulk, stats
+from .forms import ItemImportForm
+from .models import Category, Item, ItemMatch, UserItemStats
+
+# Per-row import errors shown in the admin; the rest are summarized
+IMPORT_ERRORS_SHOWN = 20
 
 
 @admin.register(Category)
@@ -16,3 +27,79 @@ class ItemAdmin(admin.ModelAdmin):
     list_editable = ['status']
     date_hierarchy = 'date_posted'
     readonly_fields = ['date_posted']
+    actions = ['export_csv', 'export_jsonl']
+    change_list_template = 'admin/items/item/change_list.html'
+
+    # Admin edits bypass the views that maintain UserItemStats; drop the
+    # affected summaries so they are recounted on the next dashboard visit.
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        user_ids = [obj.posted_by_id]
+        if change and 'posted_by' in form.changed_data:
+            user_ids.append(form.initial['posted_by'])
+        stats.invalidate(user_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        stats.invalidate([obj.posted_by_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = list(queryset.values_list('posted_by_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        stats.invalidate(user_ids)
+
+    @admin.action(description='Export selected items as CSV')
+    def export_csv(self, request, queryset):
+        return bulk.export_response(request, queryset, 'csv')
+
+    @admin.action(description='Export selected items as JSON Lines')
+    def export_jsonl(self, request, queryset):
+        return bulk.export_response(request, queryset, 'jsonl')
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='items_item_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = ItemImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            fmt = form.cleaned_data['format'] or bulk.guess_format(upload.name)
+            # Batches from the admin are small enough to match right away
+            importer = bulk.Importer(owner=request.user, match=True)
+            try:
+                result = importer.run(bulk.decode_lines(upload), fmt)
+            except bulk.MalformedFile as e:
+                self.message_user(request, f'{e}. Nothing after it was imported.', messages.ERROR)
+                result = importer.result
+            self.message_user(
+                request, f'Imported {result.created} item(s); {result.failed} row(s) failed.',
+                messages.SUCCESS if not result.failed else messages.WARNING,
+            )
+            for number, error in result.errors[:IMPORT_ERRORS_SHOWN]:
+                self.message_user(request, f'Row {number}: {error}', messages.ERROR)
+            if result.failed > IMPORT_ERRORS_SHOWN:
+                self.message_user(request, f'... and {result.failed - IMPORT_ERRORS_SHOWN} more.', messages.ERROR)
+            return redirect('admin:items_item_changelist')
+        return TemplateResponse(request, 'admin/items/item/import.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import items',
+            'form': form,
+        })
+
+
+@admin.register(UserItemStats)
+class UserItemStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'total', 'lost', 'found', 'returned']
+    search_fields = ['user__username']
+    readonly_fields = ['user', 'total', 'lost', 'found', 'returned']
+
+
+@admin.register(ItemMatch)
+class ItemMatchAdmin(admin.ModelAdmin):
+    list_display = ['lost', 'found', 'score', 'created_at']
+    raw_id_fields = ['lost', 'found']
@@ -0,0 +1,333 @@
+"""
+Benchmark harness for the hot HTTP views and the chat socket.
+
+Used by `python manage.py benchmark`. Everything runs against a throwaway
+test database seeded with a deterministic synthetic dataset (categories
+from fixtures/categories.json, then users, items, conversations and
+messages), so results are comparable between runs and machines that use
+the same options.
+
+HTTP scenarios drive Django's test client from a pool of threads, each
+logged in as a different user. The chat scenario opens one
+WebsocketCommunicator per conversation on ChatConsumer and measures the
+send -> broadcast round trip. Each scenario reports p50/p95/p99 latency,
+throughput and the average number of SQL queries per request; queries are
+counted on every connection, the chat DB executor's included.
+"""
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from messaging.models import Conversation
+from messaging.routing import websocket_urlpatterns
+
+from . import search
+from .models import Category, Item
+
+WORDS = (
+    'wallet phone keys bag laptop charger bottle jacket umbrella card watch ring earbuds '
+    'glasses book notebook calculator hoodie scarf hat black blue red green silver gold '
+    'leather small large cracked samsung apple dell nike adidas student id library gym '
+    'cafeteria hostel lab auditorium parking canteen block bench shelf locker'
+).split()
+LOCATIONS = ['Main Library', 'Gym', 'Cafeteria', 'Hostel A', 'CS Lab', 'Auditorium', 'Parking Lot']
+
+
+@dataclass
+class Result:
+    name: str
+    requests: int
+    errors: int
+    p50: float
+    p95: float
+    p99: float
+    throughput: float
+    queries: float
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class QueryCounter:
+    """Counts queries on every database connection, whichever thread opened it."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self.install(connection)
+
+    def start(self):
+        connection_created.connect(self._on_connection_created)
+        for connection in connections.all(initialized_only=True):
+            self.install(connection)
+
+    def take(self):
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile: the smallest sample at or above ``pct`` percent of them."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    # round() would take 2.5 down to 2, putting p50 of five samples on the second
+    index = min(len(ordered) - 1, max(0, math.ceil(pct * len(ordered) / 100) - 1))
+    return ordered[index]
+
+
+def summarize(name, latencies, errors, elapsed, queries):
+    count = len(latencies)
+    return Result(
+        name=name,
+        requests=count,
+        errors=errors,
+        p50=round(percentile(latencies, 50) * 1000, 2),
+        p95=round(percentile(latencies, 95) * 1000, 2),
+        p99=round(percentile(latencies, 99) * 1000, 2),
+        throughput=round(count / elapsed, 1) if elapsed else 0.0,
+        queries=round(queries / count, 2) if count else 0.0,
+    )
+
+
+def seed(users=50, items=2000, conversations=200, messages=20, seed=1):
+    """Create the synthetic dataset. Returns the users and conversations to drive."""
+    rng = random.Random(seed)
+    if not Category.objects.exists():
+        call_command('loaddata', settings.BASE_DIR / 'fixtures' / 'categories.json', verbosity=0)
+    categories = list(Category.objects.values_list('pk', flat=True))
+
+    password = make_password('benchmark')
+    User.objects.bulk_create([
+        User(username=f'bench{i}', email=f'bench{i}@example.com', password=password)
+        for i in range(users)
+    ])
+    people = list(User.objects.filter(username__startswith='bench').order_by('pk'))
+
+    Item.objects.bulk_create([
+        Item(
+            title=' '.join(rng.sample(WORDS, 3)),
+            description=' '.join(rng.sample(WORDS, 12)),
+            location=rng.choice(LOCATIONS),
+            status=rng.choice(['Lost', 'Lost', 'Found', 'Found', 'Returned']),
+            category_id=rng.choice(categories + [None]),
+            posted_by=rng.choice(people),
+        )
+        for _ in range(items)
+    ], batch_size=1000)
+    # bulk_create skips the post_save signals that maintain the index
+    search.rebuild_index()
+
+    item_rows = list(Item.objects.values_list('pk', 'posted_by_id'))
+    pairs = set()
+    convs = []
+    while len(convs) < min(conversations, len(item_rows) * (users - 1)):
+        item_id, owner_id = rng.choice(item_rows)
+        other = rng.choice(people)
+        if other.pk == owner_id or (item_id, other.pk) in pairs:
+            continue
+        pairs.add((item_id, other.pk))
+        conv = Conversation(item_id=item_id, participant1=other, participant2_id=owner_id)
+        conv.set_canonical_pair()
+        convs.append(conv)
+    Conversation.objects.bulk_create(convs, batch_size=1000)
+    convs = list(Conversation.objects.select_related('participant1', 'participant2'))
+
+    for start in range(0, len(convs), 50):
+        entries = []
+        for conv in convs[start:start + 50]:
+            for n in range(messages):
+                sender = conv.participant1 if n % 2 == 0 else conv.participant2
+                entries.append((conv, sender, ' '.join(rng.sample(WORDS, 6))))
+        Conversation.objects.add_messages(entries)
+    return people, list(Conversation.objects.select_related('participant1', 'participant2').order_by('pk'))
+
+
+class Harness:
+    def __init__(self, people, conversations, concurrency=8, requests=200, rng_seed=1):
+        self.people = people
+        self.conversations = conversations
+        self.concurrency = concurrency
+        self.requests = requests
+        self.rng = random.Random(rng_seed)
+        self.counter = QueryCounter()
+        self.counter.start()
+        self._local = threading.local()
+        self._slot = 0
+        self._slot_lock = threading.Lock()
+        by_user = {}
+        for conv in conversations:
+            by_user.setdefault(conv.participant1_id, []).append(conv)
+            by_user.setdefault(conv.participant2_id, []).append(conv)
+        self.conversations_by_user = by_user
+        # Log workers in as people with conversations, so inbox and polling have work to do
+        self.people = [person for person in people if person.pk in by_user] or people
+
+    # ── HTTP ──────────────────────────────────────────────────────────────
+
+    def _client(self, anonymous):
+        """A logged-in (or anonymous) test client per worker thread."""
+        key = 'anon_client' if anonymous else 'client'
+        client = getattr(self._local, key, None)
+        if client is None:
+            client = Client(raise_request_exception=False)
+            if not anonymous:
+                with self._slot_lock:
+                    user = self.people[self._slot % len(self.people)]
+                    self._slot += 1
+                client.force_login(user)
+                self._local.user = user
+            setattr(self._local, key, client)
+        return client
+
+    def run_http(self, name, make_request, anonymous=False):
+        latencies, errors = [], 0
+        lock = threading.Lock()
+
+        def one(_):
+            nonlocal errors
+            client = self._client(anonymous)
+            method, path, data = make_request(getattr(self._local, 'user', None))
+            started = time.perf_counter()
+            if method == 'POST':
+                response = client.post(path, data, content_type='application/json')
+            else:
+                response = client.get(path)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    errors += 1
+
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            # Log every worker in (and warm its connection) before measuring
+            list(pool.map(lambda _: self._client(anonymous), range(self.concurrency)))
+            self.counter.take()
+            started = time.perf_counter()
+            list(pool.map(one, range(self.requests)))
+            wall = time.perf_counter() - started
+        return summarize(name, latencies, errors, wall, self.counter.take())
+
+    def _conversation_for(self, user):
+        return self.rng.choice(self.conversations_by_user[user.pk])
+
+    def http_scenarios(self):
+        rng = self.rng
+        statuses = ['', 'Lost', 'Found']
+
+        def own_poll(user):
+            conv = self._conversation_for(user)
+            return 'GET', f'/inbox/chat/{conv.pk}/poll/?after={(conv.last_message_id or 0) - 5}', None
+
+        def own_post(user):
+            conv = self._conversation_for(user)
+            return 'POST', f'/inbox/chat/{conv.pk}/poll/', json.dumps({'message': rng.choice(WORDS)})
+
+        return [
+            ('home (anonymous)', lambda u: ('GET', '/', None), True),
+            ('home', lambda u: ('GET', '/', None), False),
+            ('home ?status', lambda u: ('GET', f'/?status={rng.choice(statuses[1:])}', None), False),
+            ('search', lambda u: ('GET', f'/search/?q={rng.choice(WORDS)}', None), False),
+            ('search ?status', lambda u: ('GET', f'/search/?status={rng.choice(statuses)}', None), False),
+            ('dashboard', lambda u: ('GET', '/dashboard/', None), False),
+            ('inbox', lambda u: ('GET', '/inbox/', None), False),
+            ('poll_messages GET', own_poll, False),
+            ('poll_messages POST', own_post, False),
+        ]
+
+    # ── WebSocket ─────────────────────────────────────────────────────────
+
+    def run_chat(self, name='ChatConsumer send->echo', messages_per_socket=None):
+        sockets = min(self.concurrency, len(self.conversations))
+        per_socket = messages_per_socket or max(1, self.requests // sockets)
+        convs = self.conversations[:sockets]
+        self.counter.take()
+        started = time.perf_counter()
+        latencies, errors = asyncio.run(self._chat(convs, per_socket))
+        wall = time.perf_counter() - started
+        return summarize(name, latencies, errors, wall, self.counter.take())
+
+    async def _chat(self, convs, per_socket):
+        application = URLRouter(websocket_urlpatterns)
+        latencies, errors = [], 0
+
+        async def drive(conv):
+            nonlocal errors
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{conv.pk}/')
+            communicator.scope['user'] = conv.participant1
+            connected, _ = await communicator.connect()
+            if not connected:
+                errors += per_socket
+                return
+            try:
+                for n in range(per_socket):
+                    started = time.perf_counter()
+                    await communicator.send_to(text_data=json.dumps({'message': f'bench {n}'}))
+                    reply = json.loads(await communicator.receive_from(timeout=10))
+                    latencies.append(time.perf_counter() - started)
+                    if 'error' in reply:
+                        errors += 1
+            finally:
+                await communicator.disconnect()
+
+        await asyncio.gather(*(drive(conv) for conv in convs))
+        return latencies, errors
+
+    def run_all(self, only=None):
+        cache.clear()
+        results = []
+        for name, make_request, anonymous in self.http_scenarios():
+            if only and name not in only:
+                continue
+            results.append(self.run_http(name, make_request, anonymous))
+        if not only or 'ChatConsumer send->echo' in only:
+            results.append(self.run_chat())
+        return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Regressions against a saved baseline: p95 slower by more than
+    ``threshold`` (a fraction) or more queries per request than before.
+    """
+    previous = {row['name']: row for row in baseline.get('results', [])}
+    problems = []
+    for result in results:
+        before = previous.get(result.name)
+        if before is None:
+            continue
+        if before['p95'] and result.p95 > before['p95'] * (1 + threshold):
+            problems.append(f'{result.name}: p95 {result.p95}ms vs baseline {before["p95"]}ms')
+        if result.queries > before['queries'] + 0.5:
+            problems.append(f'{result.name}: {result.queries} queries/request vs baseline {before["queries"]}')
+        if result.errors > before['errors']:
+            problems.append(f'{result.name}: {result.errors} errors vs baseline {before["errors"]}')
+    return problems
@@ -0,0 +1,238 @@
+"""
+Bulk import and export of items as CSV or JSON Lines.
+
+Used by `manage.py import_items` / `export_items` and the Item admin.
+Imports are streamed: rows are read one at a time and saved chunk_size at a
+time, with one bulk_create per chunk in its own transaction, so memory stays
+flat whatever the file size. A row that fails validation is reported with
+its row number and skipped; the rest of its chunk is still saved. A file
+that cannot be read on (bad CSV quoting, bytes that are not UTF-8) stops the
+import with a MalformedFile naming the line; the rows before it are kept.
+
+bulk_create skips the Item signals, so each chunk also updates what they
+would have: the search index, the owners' dashboard counters, the feed
+cache version and the Lost/Found match index (or, with ``match=True``,
+full matching on the background matcher, which notifies owners).
+
+Columns: title, description, category (name, case-insensitive), status,
+location and owner (username, defaulting to the importing user). Exports
+add id and date_posted, which imports ignore, so an export can be fed
+straight back in.
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import caching, matching, search, stats
+from .models import Category, Item
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+COLUMNS = ['title', 'description', 'category', 'status', 'location', 'owner']
+EXPORT_COLUMNS = ['id', *COLUMNS, 'date_posted']
+CHUNK_SIZE = 1000
+# Errors kept for the report; any beyond this are only counted
+MAX_ERRORS = 1000
+
+
+def guess_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class MalformedFile(Exception):
+    """The file cannot be read past ``line``. Rows before it have been imported."""
+
+    def __init__(self, line, reason):
+        super().__init__(f'Line {line}: {reason}')
+        self.line = line
+
+
+def decode_lines(stream):
+    """The lines of the binary ``stream`` as text, failing on the first line that is not UTF-8."""
+    for number, line in enumerate(stream, 1):
+        try:
+            yield line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        except UnicodeDecodeError as e:
+            raise MalformedFile(number, f'not valid UTF-8 (byte {e.start + 1})') from None
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((row_number, message))
+
+
+def _error_text(error):
+    return '; '.join(f'{name}: {message}' for name, messages in error.message_dict.items() for message in messages)
+
+
+class Importer:
+    def __init__(self, owner=None, chunk_size=CHUNK_SIZE, match=False):
+        self.owner = owner
+        self.chunk_size = chunk_size
+        self.match = match
+        self.categories = {name.lower(): pk for pk, name in Category.objects.values_list('pk', 'name')}
+        self.result = ImportResult()
+        self.malformed = None
+
+    def run(self, lines, fmt):
+        """
+        Import every row of ``lines`` (a text stream, or decode_lines() over a
+        binary one). Returns an ImportResult, or raises MalformedFile once the
+        rows before the bad line are saved.
+        """
+        rows = self._rows(lines, fmt)
+        while chunk := list(islice(rows, self.chunk_size)):
+            self._save(chunk)
+        if self.malformed:
+            raise self.malformed
+        return self.result
+
+    def _rows(self, lines, fmt):
+        # Stops at an unreadable line so that run() still saves the rows before it
+        try:
+            yield from self._parse(lines, fmt)
+        except MalformedFile as e:
+            self.malformed = e
+
+    def _parse(self, stream, fmt):
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            try:
+                yield from enumerate(reader, 1)
+            except csv.Error as e:
+                raise MalformedFile(reader.reader.line_num, f'malformed CSV ({e})') from None
+            return
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                self.result.add_error(number, f'invalid JSON ({e})')
+                continue
+            if isinstance(row, dict):
+                yield number, row
+            else:
+                self.result.add_error(number, 'expected a JSON object')
+
+    def _save(self, chunk):
+        names = {str(row.get('owner') or '').strip() for _, row in chunk} - {''}
+        owners = dict(User.objects.filter(username__in=names).values_list('username', 'pk')) if names else {}
+        items = []
+        for number, row in chunk:
+            try:
+                items.append(self._build(row, owners))
+            except ValidationError as e:
+                self.result.add_error(number, _error_text(e))
+        if not items:
+            return
+
+        with transaction.atomic():
+            Item.objects.bulk_create(items)
+            search.index_new_items(items)
+            if self.match:
+                pks = [item.pk for item in items]
+                transaction.on_commit(lambda: [matching.matcher.submit(pk) for pk in pks])
+            else:
+                matching.index_new_items(items)
+            stats.invalidate({item.posted_by_id for item in items})
+        caching.bump_feed()
+        self.result.created += len(items)
+
+    def _build(self, row, owners):
+        def value(name):
+            return str(row.get(name) or '').strip()
+
+        errors = {}
+        category_id = None
+        if value('category'):
+            category_id = self.categories.get(value('category').lower())
+            if category_id is None:
+                errors['category'] = [f'unknown category "{value("category")}"']
+        if value('owner'):
+            owner_id = owners.get(value('owner'))
+            if owner_id is None:
+                errors['owner'] = [f'unknown user "{value("owner")}"']
+        elif self.owner is not None:
+            owner_id = self.owner.pk
+        else:
+            owner_id = None
+            errors['owner'] = ['no owner given and no default user']
+
+        item = Item(
+            title=value('title'),
+            description=value('description'),
+            status=value('status'),
+            location=value('location'),
+            category_id=category_id,
+            posted_by_id=owner_id,
+        )
+        try:
+            item.full_clean(exclude=['category', 'posted_by', 'image'], validate_unique=False)
+        except ValidationError as e:
+            errors = {**e.message_dict, **errors}
+        if errors:
+            raise ValidationError(errors)
+        if item.status == 'Returned':
+            item.closed_at = timezone.now()
+        return item
+
+
+class _Echo:
+    """File-like sink for csv.writer: writerow() returns the formatted line."""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(queryset, fmt, chunk_size=CHUNK_SIZE):
+    """Yield ``queryset``'s items as lines of CSV (with a header) or JSON Lines."""
+    rows = queryset.order_by('pk').values_list(
+        'pk', 'title', 'description', 'category__name', 'status', 'location',
+        'posted_by__username', 'date_posted',
+    ).iterator(chunk_size=chunk_size)
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_COLUMNS)
+        for *values, date_posted in rows:
+            yield writer.writerow([*values, date_posted.isoformat()])
+    else:
+        for *values, date_posted in rows:
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, [*values, date_posted.isoformat()]))) + '\n'
+
+
+def _chunks(lines, size=500):
+    while chunk := ''.join(islice(lines, size)):
+        yield chunk
+
+
+async def _achunks(lines, size=500):
+    # Under ASGI a sync iterator would be read into memory in one go before
+    # sending; pull it a chunk at a time on the sync thread instead.
+    chunks = _chunks(lines, size)
+    while chunk := await sync_to_async(next)(chunks, ''):
+        yield chunk
+
+
+def export_response(request, queryset, fmt):
+    lines = export_lines(queryset, fmt)
+    content = _achunks(lines) if isinstance(request, ASGIRequest) else _chunks(lines)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="items.{fmt}"'
+    return response
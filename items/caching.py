@@ -0,0 +1,165 @@
+"""
+Caching for the public item pages.
+
+Anonymous GETs of home, search_items and item_detail are cached as whole
+responses; item cards are cached as template fragments for everyone (the
+{% cache %} blocks in home.html and items/search_results.html). Keys
+embed version counters instead of being deleted one by one:
+
+* the feed version, bumped by any Item save/delete (home and search pages),
+* a per-item version, bumped when that item is saved or deleted (detail
+  page and its cards),
+* the category version, bumped by any Category save/delete (every page
+  shows category names or the category filter).
+
+The signals in items/signals.py do the bumping; stale entries simply stop
+being addressed and age out of the backend.
+
+A bump only reaches the workers that share the cache. With a per-process
+cache and several workers (see lostfound/cache.py) the others would keep
+serving stale pages, so page and card caching is switched off instead.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from lostfound import metrics
+from lostfound.cache import cache_is_shared
+
+from .models import Category
+
+FEED_VERSION_KEY = 'items:feed:version'
+CATEGORY_VERSION_KEY = 'items:categories:version'
+
+VIEW_TIMEOUT = getattr(settings, 'ITEMS_VIEW_CACHE_TIMEOUT', 300)
+CARD_TIMEOUT = 3600
+
+
+def enabled():
+    return cache_is_shared()
+
+
+def card_timeout():
+    """Lifetime for the {% cache %} card fragments; 0 stores nothing while caching is off."""
+    return CARD_TIMEOUT if enabled() else 0
+
+
+def _item_version_key(pk):
+    return f'items:item:{pk}:version'
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Never seen: anything cached so far was keyed under the implicit version 1.
+        cache.add(key, 2, None)
+
+
+def feed_version():
+    return _get_version(FEED_VERSION_KEY)
+
+
+def category_version():
+    return _get_version(CATEGORY_VERSION_KEY)
+
+
+def item_version(pk):
+    return _get_version(_item_version_key(pk))
+
+
+def bump_item(pk):
+    _bump(_item_version_key(pk))
+    _bump(FEED_VERSION_KEY)
+
+
+def bump_feed():
+    """New items only change the listings; their own versions start fresh."""
+    _bump(FEED_VERSION_KEY)
+
+
+def bump_categories():
+    _bump(CATEGORY_VERSION_KEY)
+
+
+def attach_versions(items):
+    """Set ``cache_version`` on each item for the {% cache %} card fragments, in one get_many."""
+    items = list(items)
+    if not enabled():
+        for item in items:
+            item.cache_version = 1
+        return items
+    keys = {_item_version_key(item.pk): item for item in items}
+    found = cache.get_many(keys)
+    for key, item in keys.items():
+        item.cache_version = found.get(key, 1)
+    return items
+
+
+def cached_categories():
+    if not enabled():
+        return list(Category.objects.all())
+    key = f'items:categories:{category_version()}'
+    categories = cache.get(key)
+    metrics.cache_lookup('categories', categories is not None)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(key, categories, VIEW_TIMEOUT)
+    return categories
+
+
+def is_anonymous_cacheable(request):
+    """
+    Whole-page caching is only safe for anonymous GETs with no session or
+    pending flash messages — anything else renders per-visitor content.
+    """
+    return (
+        request.method == 'GET'
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and 'messages' not in request.COOKIES
+        and not request.user.is_authenticated
+    )
+
+
+def cache_anonymous(version_func):
+    """
+    Cache a view's 200 responses for anonymous visitors, keyed by the full
+    path (so every filter, query and cursor gets its own entry) plus the
+    versions returned by ``version_func(request, *args, **kwargs)``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not enabled() or not is_anonymous_cacheable(request):
+                return view(request, *args, **kwargs)
+
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            versions = '.'.join(str(v) for v in version_func(request, *args, **kwargs))
+            key = f'items:view:{view.__name__}:{versions}:{path}'
+
+            response = cache.get(key)
+            metrics.cache_lookup('items_view', response is not None)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response, VIEW_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+
+def feed_versions(request, *args, **kwargs):
+    return feed_version(), category_version()
+
+
+def item_versions(request, pk):
+    return item_version(pk), category_version()
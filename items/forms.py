@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from . import bulk
 from .models import Item
 
 
@@ -17,15 +18,50 @@ class RegisterForm(UserCreationForm):
             field.widget.attrs['class'] = 'form-control'
 
 
+class CurrentImage:
+    """An item's photo in the shape ClearableFileInput expects for its initial value."""
+
+    def __init__(self, item):
+        self.url = item.image_url or '#'
+        self.name = 'Current photo (processing)' if item.image_pending else 'Current photo'
+
+    def __str__(self):
+        return self.name
+
+
 class ItemForm(forms.ModelForm):
+    # Not bound to Item.image: the view hands the upload to items/images.py
+    # instead of letting the model field push it to storage during save().
+    image = forms.ImageField(required=False, widget=forms.ClearableFileInput(attrs={'class': 'form-control'}))
+
+    field_order = ['title', 'description', 'image', 'category', 'status', 'location']
+
     class Meta:
         model = Item
-        fields = ['title', 'description', 'image', 'category', 'status', 'location']
+        fields = ['title', 'description', 'category', 'status', 'location']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Item title'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'Describe the item...'}),
-            'image': forms.ClearableFileInput(attrs={'class': 'form-control'}),
             'category': forms.Select(attrs={'class': 'form-select'}),
             'status': forms.Select(attrs={'class': 'form-select'}),
             'location': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Where was it lost/found?'}),
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Gives the widget its "Currently ... Clear" part when editing
+        if self.instance.has_image:
+            self.initial.setdefault('image', CurrentImage(self.instance))
+
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # No new upload: FileField hands back the initial value, which is not a file to stage
+        return None if image is self.initial.get('image') else image
+
+
+class ItemImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV or JSON Lines: title, description, category, status, location, owner.')
+    format = forms.ChoiceField(
+        choices=[('', 'From file extension')] + [(fmt, fmt.upper()) for fmt in bulk.FORMATS],
+        required=False,
+    )
@@ -0,0 +1,222 @@
+"""
+Background image pipeline for item photos.
+
+post_item and edit_item no longer upload to remote storage inside the
+request. accept_upload() writes the file to a local staging directory, marks
+the item's image as pending and, once the transaction commits, hands it to
+a small thread pool. The worker:
+
+* applies the EXIF orientation, then drops all metadata (GPS included) by
+  re-encoding,
+* renders each size in ITEMS_IMAGE_SIZES as a JPEG and a WebP variant,
+* saves the variants to the configured storage under ``items/<token>/``,
+* flips the item to ready (or failed) and bumps its cache version.
+
+The storage is any Django storage class named by ITEMS_IMAGE_STORAGE
+(Cloudinary in production, FileSystemStorage for local runs).
+
+Which worker owns a pending upload is recorded on the item itself: process()
+first claims it by setting ``image_claimed_at``, so with several web workers
+(or a process_pending_images run alongside them) each upload is rendered
+once. If a worker exits with items still pending, the staged files stay in
+the staging directory, which every worker must share, and once the claim is
+older than ITEMS_IMAGE_CLAIM_TIMEOUT ``manage.py process_pending_images``
+finishes them.
+"""
+import functools
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+
+from . import caching
+from .models import Item
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels
+DEFAULT_SIZES = {'full': 1600, 'thumb': 480}
+FORMATS = {'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+           'webp': ('WEBP', {'quality': 80, 'method': 4})}
+
+
+def sizes():
+    return getattr(settings, 'ITEMS_IMAGE_SIZES', DEFAULT_SIZES)
+
+
+def claim_timeout():
+    return getattr(settings, 'ITEMS_IMAGE_CLAIM_TIMEOUT', 600)
+
+
+@functools.cache
+def get_storage():
+    """The storage the variants are pushed to."""
+    path = getattr(settings, 'ITEMS_IMAGE_STORAGE', None)
+    return import_string(path)() if path else default_storage
+
+
+@functools.cache
+def get_staging():
+    location = getattr(settings, 'ITEMS_IMAGE_STAGING_DIR', os.path.join(settings.MEDIA_ROOT, 'staging'))
+    return FileSystemStorage(location=location)
+
+
+def variant_name(image_path, variant, ext):
+    return f'{image_path}/{variant}.{ext}'
+
+
+def variant_url(image_path, variant, ext):
+    return get_storage().url(variant_name(image_path, variant, ext))
+
+
+def staged_name(image_path):
+    return image_path.rsplit('/', 1)[-1]
+
+
+def render_variants(source):
+    """{(variant, ext): bytes} for an image file, with orientation applied and metadata dropped."""
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        rendered = {}
+        for variant, longest in sizes().items():
+            resized = img.copy()
+            resized.thumbnail((longest, longest), Image.LANCZOS)
+            for ext, (fmt, options) in FORMATS.items():
+                out = resized
+                if fmt == 'JPEG' and has_alpha:
+                    out = Image.new('RGB', resized.size, (255, 255, 255))
+                    out.paste(resized, mask=resized.getchannel('A'))
+                buf = BytesIO()
+                # No exif= argument: Pillow writes none of the source metadata.
+                out.save(buf, fmt, **options)
+                rendered[variant, ext] = buf.getvalue()
+        return rendered
+
+
+def delete_variants(image_path):
+    storage = get_storage()
+    for variant in sizes():
+        for ext in FORMATS:
+            name = variant_name(image_path, variant, ext)
+            try:
+                storage.delete(name)
+            except Exception:
+                logger.warning('Could not delete image variant %s', name, exc_info=True)
+
+
+def claim(item_id, image_path):
+    """Take a pending upload for this worker. False if it is gone or another worker holds it."""
+    now = timezone.now()
+    unclaimed = Q(image_claimed_at__isnull=True) | Q(image_claimed_at__lt=now - timedelta(seconds=claim_timeout()))
+    pending = Item.objects.filter(pk=item_id, image_path=image_path, image_status=Item.IMAGE_PENDING)
+    return bool(pending.filter(unclaimed).update(image_claimed_at=now))
+
+
+def process(item_id, image_path, old_path=''):
+    """
+    Render and push one staged upload. Runs on the pipeline's worker threads.
+    Returns None without doing anything when the upload is not ours to process.
+    """
+    staging = get_staging()
+    staged = staged_name(image_path)
+    if not claim(item_id, image_path):
+        pending = Item.objects.filter(pk=item_id, image_path=image_path, image_status=Item.IMAGE_PENDING)
+        if not pending.exists() and staging.exists(staged):
+            # Replaced or deleted before anyone started on it.
+            staging.delete(staged)
+        return None
+    try:
+        with staging.open(staged) as source:
+            rendered = render_variants(source)
+        storage = get_storage()
+        for (variant, ext), data in rendered.items():
+            storage.save(variant_name(image_path, variant, ext), ContentFile(data))
+    except Exception:
+        logger.exception('Image processing failed for item %s', item_id)
+        failed = Item.objects.filter(pk=item_id, image_path=image_path).update(
+            image_status=Item.IMAGE_FAILED, image_old_path='',
+        )
+        caching.bump_item(item_id)
+        if failed and old_path:
+            # The item no longer shows the photo this upload replaced either way
+            delete_variants(old_path)
+        return False
+    finally:
+        if staging.exists(staged):
+            staging.delete(staged)
+
+    updated = Item.objects.filter(pk=item_id, image_path=image_path).update(
+        image_status=Item.IMAGE_READY, image_old_path='',
+    )
+    caching.bump_item(item_id)
+    if not updated:
+        # Replaced or deleted while we were working.
+        delete_variants(image_path)
+    elif old_path:
+        delete_variants(old_path)
+    return bool(updated)
+
+
+class ImagePipeline:
+    def __init__(self, workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='item-images')
+
+    def submit(self, item_id, image_path, old_path=''):
+        return self._executor.submit(self._run, item_id, image_path, old_path)
+
+    def discard(self, image_path):
+        return self._executor.submit(delete_variants, image_path)
+
+    @staticmethod
+    def _run(*args):
+        close_old_connections()
+        try:
+            return process(*args)
+        finally:
+            close_old_connections()
+
+
+pipeline = ImagePipeline(workers=getattr(settings, 'ITEMS_IMAGE_WORKERS', 2))
+
+
+def accept_upload(item, upload):
+    """
+    Stage ``upload`` for ``item`` (already saved) and queue it for processing
+    once the surrounding transaction commits. Returns immediately.
+    """
+    # Replacing an upload that is still pending: the photo on display is the one it replaced
+    old_path = item.image_old_path if item.image_pending else item.image_path
+    token = uuid.uuid4().hex
+    get_staging().save(token, upload)
+    item.image_path = f'items/{token}'
+    item.image_status = Item.IMAGE_PENDING
+    item.image_claimed_at = None
+    item.image_old_path = old_path
+    item.image = None
+    item.save(update_fields=['image_path', 'image_status', 'image_claimed_at', 'image_old_path', 'image'])
+    transaction.on_commit(lambda: pipeline.submit(item.pk, item.image_path, old_path))
+
+
+def clear_image(item):
+    old_paths = [path for path in (item.image_path, item.image_old_path) if path]
+    item.image_path = ''
+    item.image_status = ''
+    item.image_old_path = ''
+    item.image = None
+    item.save(update_fields=['image_path', 'image_status', 'image_old_path', 'image'])
+    for old_path in old_paths:
+        transaction.on_commit(functools.partial(pipeline.discard, old_path))
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from items import benchmark
+from lostfound import database
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the hot views and the chat socket against a seeded throwaway database. '
+        'Exits non-zero when --baseline is given and a scenario regressed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--conversations', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=20, help='Messages per conversation.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--only', action='append', help='Run just this scenario (repeatable).')
+        parser.add_argument('--baseline', help='Compare against this baseline JSON file.')
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help='Allowed p95 slowdown against the baseline, as a fraction.')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file.')
+        parser.add_argument('--configured-layer', action='store_true',
+                            help='Use CHANNEL_LAYERS as configured instead of an in-memory layer.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Cannot read baseline: {exc}')
+
+        layer = {} if options['configured_layer'] else {
+            'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        }
+        with tempfile.TemporaryDirectory() as tmp, override_settings(**layer):
+            results = self.run(options, tmp)
+
+        self.report(results)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({'options': self.dataset(options), 'results': [r.as_dict() for r in results]}, f, indent=2)
+            self.stdout.write(f'Baseline written to {options["save_baseline"]}')
+
+        if baseline is not None:
+            if baseline.get('options') != self.dataset(options):
+                self.stdout.write(self.style.WARNING('Baseline was recorded with different options.'))
+            problems = benchmark.compare(results, baseline, options['threshold'])
+            if problems:
+                for problem in problems:
+                    self.stderr.write(self.style.ERROR(problem))
+                raise CommandError(f'{len(problems)} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    @staticmethod
+    def dataset(options):
+        keys = ('users', 'items', 'conversations', 'messages', 'seed', 'concurrency', 'requests')
+        return {key: options[key] for key in keys}
+
+    def run(self, options, tmp):
+        if connection.vendor == 'sqlite':
+            # A file rather than the shared in-memory test database, so that
+            # concurrent writers wait on the busy timeout instead of failing.
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'benchmark.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # Read aliases must see the test database too
+        mirrors = {alias: connections[alias].settings_dict['NAME'] for alias in database.read_aliases()}
+        for alias in mirrors:
+            connections[alias].close()
+            connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            self.stdout.write('Seeding...')
+            people, conversations = benchmark.seed(
+                users=options['users'], items=options['items'], conversations=options['conversations'],
+                messages=options['messages'], seed=options['seed'],
+            )
+            harness = benchmark.Harness(
+                people, conversations, concurrency=options['concurrency'],
+                requests=options['requests'], rng_seed=options['seed'],
+            )
+            return harness.run_all(only=options['only'])
+        finally:
+            for alias, name in mirrors.items():
+                connections[alias].close()
+                connections[alias].settings_dict['NAME'] = name
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def report(self, results):
+        header = f'{"scenario":<28}{"reqs":>6}{"err":>5}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>9}{"q/req":>7}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for r in results:
+            self.stdout.write(
+                f'{r.name:<28}{r.requests:>6}{r.errors:>5}{r.p50:>9}{r.p95:>9}{r.p99:>9}{r.throughput:>9}{r.queries:>7}'
+            )
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from items import bulk
+from items.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Export items as CSV or JSON Lines to a file or stdout, streaming them in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument('--format', choices=bulk.FORMATS, help='Default: from the file extension.')
+        parser.add_argument('--status', choices=[value for value, _ in Item.STATUS_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or bulk.guess_format(path)
+        items = Item.objects.all()
+        if options['status']:
+            items = items.filter(status=options['status'])
+        lines = bulk.export_lines(items, fmt, chunk_size=options['chunk_size'])
+        if path == '-':
+            sys.stdout.writelines(lines)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as stream:
+                stream.writelines(lines)
@@ -0,0 +1,52 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from items import bulk
+
+
+class Command(BaseCommand):
+    help = 'Import items from a CSV or JSON Lines file ("-" for stdin), streaming it in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=bulk.FORMATS, help='Default: from the file extension.')
+        parser.add_argument('--user', help='Username owning rows without an owner column.')
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE)
+        parser.add_argument(
+            '--match', action='store_true',
+            help='Run Lost/Found matching (and notify owners) for every imported item. '
+                 'Slow for large files; without it items are only added to the match index.',
+        )
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['user']:
+            owner = User.objects.filter(username=options['user']).first()
+            if owner is None:
+                raise CommandError(f'No user named "{options["user"]}".')
+        path = options['path']
+        fmt = options['format'] or bulk.guess_format(path)
+        importer = bulk.Importer(owner=owner, chunk_size=options['chunk_size'], match=options['match'])
+
+        try:
+            if path == '-':
+                result = importer.run(bulk.decode_lines(sys.stdin.buffer), fmt)
+            else:
+                with open(path, 'rb') as stream:
+                    result = importer.run(bulk.decode_lines(stream), fmt)
+        except bulk.MalformedFile as e:
+            self.report(importer.result)
+            raise CommandError(f'{e}. Nothing after it was imported.') from None
+        self.report(result)
+        if options['match'] and result.created:
+            # The matcher's worker thread is joined at exit
+            self.stdout.write('Waiting for matching to finish...')
+
+    def report(self, result):
+        for number, error in result.errors:
+            self.stderr.write(f'Row {number}: {error}')
+        if result.failed > len(result.errors):
+            self.stderr.write(f'... and {result.failed - len(result.errors)} more')
+        self.stdout.write(self.style.SUCCESS(f'Imported {result.created} item(s); {result.failed} row(s) failed.'))
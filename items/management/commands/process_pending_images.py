@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from items import images
+from items.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Finish image uploads left pending by a restarted worker process.'
+
+    def handle(self, *args, **options):
+        staging = images.get_staging()
+        done = failed = missing = busy = 0
+        pending = Item.objects.filter(image_status=Item.IMAGE_PENDING).values_list(
+            'pk', 'image_path', 'image_old_path',
+        )
+        for pk, image_path, old_path in pending.iterator():
+            if not staging.exists(images.staged_name(image_path)):
+                missing += 1
+                continue
+            result = images.process(pk, image_path, old_path)
+            if result is None:
+                # Claimed by a live worker, or replaced since the query ran.
+                busy += 1
+            elif result:
+                done += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {done} image(s); {failed} failed, {busy} in progress elsewhere, '
+            f'{missing} without a staged file.'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from items import matching
+from items.models import Item, MatchBucket
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Lost/Found MinHash index from the open items (no matches or notifications).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        items = Item.objects.filter(status__in=list(matching.OPPOSITE)).only(
+            'pk', 'title', 'description', 'location', 'status',
+        )
+        MatchBucket.objects.all().delete()
+        count, rows = 0, []
+        for item in items.iterator(chunk_size=chunk_size):
+            rows.extend(
+                MatchBucket(item=item, status=item.status, band=band, bucket=bucket)
+                for band, bucket in enumerate(matching.signature_buckets(matching.match_terms(item)))
+            )
+            count += 1
+            if len(rows) >= chunk_size * matching.BANDS:
+                with transaction.atomic():
+                    MatchBucket.objects.bulk_create(rows)
+                rows = []
+        MatchBucket.objects.bulk_create(rows)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} open item(s).'))
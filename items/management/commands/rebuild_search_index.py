@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from items import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the Item table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        if backend is None:
+            self.stdout.write(self.style.WARNING(
+                'This database has no full-text backend; search falls back to icontains.'
+            ))
+            return
+        count = search.rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} item(s).'))
@@ -0,0 +1,268 @@
+"""
+Automatic Lost <-> Found matching.
+
+Whenever an open item is saved, the matcher looks for items of the opposite
+status that describe the same object and records the best ``ITEMS_MATCH_TOP_K``
+as ItemMatch rows. Both owners are told about new pairs over their
+``user_{id}`` notification socket.
+
+Candidates come from a MinHash LSH index. Each open item's term set is
+reduced to a signature of BANDS * ROWS min-hashes, and each band is hashed
+into a MatchBucket row. Items whose term sets have Jaccard similarity J
+share at least one bucket with probability 1 - (1 - J**ROWS)**BANDS: about
+0.3 at J=0.15, 0.78 at J=0.3 and 0.99 at J=0.5. Finding candidates is
+therefore BANDS indexed lookups, whatever the number of open items. The
+ITEMS_MATCH_CANDIDATES items sharing the most buckets are re-scored by the
+exact Jaccard similarity of their term sets, boosted for a shared category
+or location.
+
+An item's buckets are rewritten whenever it is re-matched, which happens
+after every save that changes its text or status. It runs on a single
+background thread once the save commits, so it adds nothing to the request
+(or in the saving thread with ITEMS_MATCH_SYNC).
+`python manage.py rebuild_match_index` fills the index for existing items.
+"""
+import hashlib
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Q
+from messaging.notifications import push
+
+from . import search
+from .models import Item, ItemMatch, MatchBucket
+
+logger = logging.getLogger(__name__)
+
+OPPOSITE = {'Lost': 'Found', 'Found': 'Lost'}
+
+# Too common in lost-and-found posts to say anything about a match.
+STOPWORDS = frozenset('''
+    a an and are as at be but by for from has have i in is it its lost found my near
+    of on or our please so that the this to was were with left if any me someone
+'''.split())
+CATEGORY_BOOST = 1.5
+LOCATION_BOOST = 0.25
+
+# Changing these invalidates every stored bucket: run rebuild_match_index.
+BANDS = 16
+ROWS = 2
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240917)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(BANDS * ROWS)
+]
+
+
+def top_k():
+    return getattr(settings, 'ITEMS_MATCH_TOP_K', 5)
+
+
+def candidate_limit():
+    return getattr(settings, 'ITEMS_MATCH_CANDIDATES', 50)
+
+
+def min_score():
+    return getattr(settings, 'ITEMS_MATCH_MIN_SCORE', 0.15)
+
+
+def match_terms(item):
+    """Distinct non-stopword terms, title first."""
+    terms = {}
+    for text in (item.title, item.location, item.description):
+        for token in search.tokenize(text or ''):
+            if len(token) > 1 and token not in STOPWORDS:
+                terms.setdefault(token, None)
+    return list(terms)
+
+
+@lru_cache(maxsize=65536)
+def _term_minhashes(term):
+    """The term's value under every permutation; a set's signature is their column-wise minimum."""
+    h = int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest(), 'big')
+    return tuple((a * h + b) % _PRIME for a, b in _PERMUTATIONS)
+
+
+def signature_buckets(terms):
+    """The BANDS bucket values for a term set (empty for an empty set)."""
+    if not terms:
+        return []
+    signature = [min(column) for column in zip(*map(_term_minhashes, terms))]
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(b''.join(r.to_bytes(8, 'big') for r in rows), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))
+    return buckets
+
+
+def index_buckets(item, buckets):
+    """Replace ``item``'s rows in the LSH index; closed items get none."""
+    MatchBucket.objects.filter(item=item).delete()
+    if item.status in OPPOSITE:
+        MatchBucket.objects.bulk_create([
+            MatchBucket(item=item, status=item.status, band=band, bucket=bucket)
+            for band, bucket in enumerate(buckets)
+        ])
+
+
+def index_new_items(items):
+    """
+    Put freshly bulk-created items into the LSH index without matching them,
+    so later posts on the other side still find them.
+    """
+    rows = [
+        (item.pk, item.status, band, bucket)
+        for item in items if item.status in OPPOSITE
+        for band, bucket in enumerate(signature_buckets(match_terms(item)))
+    ]
+    # Plain executemany: building a MatchBucket per row costs more than the insert.
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {MatchBucket._meta.db_table} (item_id, status, band, bucket) VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+
+
+def candidate_ids(status, buckets):
+    """Ids of ``status`` items sharing a bucket, most shared bands first."""
+    if not buckets:
+        return []
+    lookup = Q()
+    for band, bucket in enumerate(buckets):
+        lookup |= Q(status=status, band=band, bucket=bucket)
+    rows = (
+        MatchBucket.objects.filter(lookup)
+        .values('item_id')
+        .annotate(bands=Count('pk'))
+        .order_by('-bands', '-item_id')[:candidate_limit()]
+    )
+    return [row['item_id'] for row in rows]
+
+
+def score_candidates(item, ids):
+    """``[(other_item, score)]`` for the candidate ``ids``, best first, owner's own items excluded."""
+    others = Item.objects.only(
+        'pk', 'title', 'description', 'category_id', 'location', 'posted_by_id',
+    ).in_bulk(ids)
+    terms = set(match_terms(item))
+    location = set(search.tokenize(item.location or '')) - STOPWORDS
+
+    scored = []
+    for pk in ids:
+        other = others.get(pk)
+        if other is None or other.posted_by_id == item.posted_by_id:
+            continue
+        other_terms = set(match_terms(other))
+        score = len(terms & other_terms) / len(terms | other_terms)
+        if item.category_id and other.category_id == item.category_id:
+            score *= CATEGORY_BOOST
+        shared = location & set(search.tokenize(other.location or ''))
+        score *= 1 + LOCATION_BOOST * min(len(shared), 2)
+        scored.append((other, score))
+    scored.sort(key=lambda pair: -pair[1])
+    return scored
+
+
+def update_matches(item_id):
+    """
+    Recompute ``item_id``'s matches. The top-k candidates by refreshed score
+    become its pairs: existing pairs among them keep their row with the new
+    score, the rest are dropped, and owners are notified about the
+    additions. Items that are no longer Lost or Found lose all their pairs.
+    """
+    item = Item.objects.filter(pk=item_id).only(
+        'pk', 'title', 'description', 'location', 'status', 'category_id', 'posted_by_id',
+    ).first()
+    if item is None:
+        return []
+    if item.status not in OPPOSITE:
+        with transaction.atomic():
+            MatchBucket.objects.filter(item=item).delete()
+            ItemMatch.objects.filter(Q(lost=item) | Q(found=item)).delete()
+        return []
+
+    side, other_side = ('lost', 'found') if item.status == 'Lost' else ('found', 'lost')
+    buckets = signature_buckets(match_terms(item))
+    candidates = [
+        (other, score)
+        for other, score in score_candidates(item, candidate_ids(OPPOSITE[item.status], buckets))
+        if score >= min_score()
+    ][:top_k()]
+    scores = {other.pk: score for other, score in candidates}
+
+    with transaction.atomic():
+        index_buckets(item, buckets)
+        # Pairs from before a Lost <-> Found flip have the item on the wrong side.
+        ItemMatch.objects.filter(**{other_side: item}).delete()
+        existing = {m.pk: getattr(m, f'{other_side}_id') for m in ItemMatch.objects.filter(**{side: item})}
+        stale = [pk for pk, other_id in existing.items() if other_id not in scores]
+        ItemMatch.objects.filter(pk__in=stale).delete()
+        kept = [ItemMatch(pk=pk, score=scores[other_id]) for pk, other_id in existing.items() if pk not in stale]
+        ItemMatch.objects.bulk_update(kept, ['score'])
+
+        have = set(existing.values())
+        new = [(other, score) for other, score in candidates if other.pk not in have]
+        ItemMatch.objects.bulk_create(
+            [ItemMatch(**{side: item, other_side: other, 'score': score}) for other, score in new],
+            ignore_conflicts=True,
+        )
+
+    if new:
+        transaction.on_commit(lambda: notify(item, [other for other, _ in new]))
+    return new
+
+
+def notify(item, others):
+    best = others[0]
+    push(item.posted_by_id, match_event(item, best, count=len(others)))
+    for other in others:
+        push(other.posted_by_id, match_event(other, item, count=1))
+
+
+def match_event(item, match, count):
+    return {
+        'type': 'item_match',
+        'item_id': item.pk,
+        'item_title': item.title,
+        'match_id': match.pk,
+        'match_title': match.title,
+        'count': count,
+    }
+
+
+def matches_for(item, limit=None):
+    """The items paired with ``item``, best first."""
+    if item.status not in OPPOSITE:
+        return []
+    side, other_side = ('lost', 'found') if item.status == 'Lost' else ('found', 'lost')
+    pairs = ItemMatch.objects.filter(**{side: item}).select_related(other_side).order_by('-score')
+    return [getattr(pair, other_side) for pair in pairs[:limit or top_k()]]
+
+
+class Matcher:
+    def __init__(self):
+        # One thread: runs for the same item never race each other.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='item-matching')
+
+    def submit(self, item_id):
+        if getattr(settings, 'ITEMS_MATCH_SYNC', False):
+            return update_matches(item_id)
+        return self._executor.submit(self._run, item_id)
+
+    @staticmethod
+    def _run(item_id):
+        close_old_connections()
+        try:
+            return update_matches(item_id)
+        except Exception:
+            logger.exception('Matching failed for item %s', item_id)
+        finally:
+            close_old_connections()
+
+
+matcher = Matcher()
@@ -0,0 +1,74 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS items_item_fts USING fts5(
+    title, description, location,
+    status UNINDEXED, category_id UNINDEXED,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+)
+"""
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE IF NOT EXISTS items_item_fts (
+        item_id bigint PRIMARY KEY REFERENCES items_item (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL,
+        status varchar(10) NOT NULL,
+        category_id bigint NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS items_item_fts_document_gin ON items_item_fts USING GIN (document)',
+]
+
+
+# Fills the new index with one INSERT ... SELECT. Spelled out here rather than taken
+# from items.search so later changes to that module don't alter this migration.
+SQLITE_FILL = [
+    'DELETE FROM items_item_fts',
+    """
+INSERT INTO items_item_fts (rowid, title, description, location, status, category_id)
+SELECT id, title, description, location, status, category_id FROM items_item
+""",
+]
+
+POSTGRES_FILL = [
+    'DELETE FROM items_item_fts',
+    """
+INSERT INTO items_item_fts (item_id, document, status, category_id)
+SELECT id,
+       setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+       setweight(to_tsvector('english', coalesce(description, '')), 'B') ||
+       setweight(to_tsvector('english', coalesce(location, '')), 'C'),
+       status, category_id
+FROM items_item
+""",
+]
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = [SQLITE_CREATE, *SQLITE_FILL]
+    elif vendor == 'postgresql':
+        statements = [*POSTGRES_CREATE, *POSTGRES_FILL]
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS items_item_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0002_alter_item_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0005_user_item_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_path',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='image_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='', max_length=10),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0006_item_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('found', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lost_matches', to='items.item')),
+                ('lost', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='found_matches', to='items.item')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['found', '-score'], name='item_match_found_idx')],
+                'constraints': [models.UniqueConstraint(fields=('lost', 'found'), name='item_match_pair_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MatchBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=10)),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_buckets', to='items.item')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'band', 'bucket'], name='match_bucket_lookup_idx')],
+            },
+        ),
+    ]
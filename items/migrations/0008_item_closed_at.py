@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:33
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_closed_at(apps, schema_editor):
+    # The real closing time was never stored; count already-returned items
+    # as closed from now, so nothing is archived before its grace period.
+    Item = apps.get_model('items', 'Item')
+    Item.objects.filter(status='Returned').update(closed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0007_item_matches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_closed_at, migrations.RunPython.noop),
+    ]
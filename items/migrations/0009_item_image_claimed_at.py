@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0008_item_closed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0009_item_image_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_old_path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 
 class Category(models.Model):
@@ -19,17 +20,139 @@ class Item(models.Model):
         ('Returned', 'Returned'),
     ]
 
+    IMAGE_PENDING = 'pending'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUS_CHOICES = [
+        (IMAGE_PENDING, 'Processing'),
+        (IMAGE_READY, 'Ready'),
+        (IMAGE_FAILED, 'Failed'),
+    ]
+
     title = models.CharField(max_length=200)
     description = models.TextField()
+    # Legacy direct Cloudinary uploads; new photos go through items/images.py
     image = CloudinaryField('image', blank=True, null=True)
+    image_path = models.CharField(max_length=100, blank=True, default='')
+    image_status = models.CharField(max_length=10, choices=IMAGE_STATUS_CHOICES, blank=True, default='')
+    # Set by the worker processing a pending upload, so no other worker or
+    # process_pending_images run picks it up while the claim is fresh
+    image_claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # The photo a pending upload replaces, whose variants are deleted once the
+    # upload is processed; stored so process_pending_images can do that too
+    image_old_path = models.CharField(max_length=100, blank=True, default='', editable=False)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Lost')
     location = models.CharField(max_length=200)
     date_posted = models.DateTimeField(auto_now_add=True)
     posted_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='items')
+    # When the item was marked Returned; messaging/archive.py ages chats from it
+    closed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-date_posted']
+        indexes = [
+            # Back the (date_posted, id) keyset pagination in items/pagination.py
+            models.Index(fields=['-date_posted', '-id'], name='item_feed_idx'),
+            models.Index(fields=['status', '-date_posted', '-id'], name='item_status_feed_idx'),
+            models.Index(fields=['category', '-date_posted', '-id'], name='item_category_feed_idx'),
+            models.Index(fields=['posted_by', '-date_posted', '-id'], name='item_owner_feed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.status})"
+
+    def save(self, *args, **kwargs):
+        closed = self.status == 'Returned'
+        if closed != bool(self.closed_at):
+            self.closed_at = timezone.now() if closed else None
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'closed_at'}
+        super().save(*args, **kwargs)
+
+    @property
+    def has_image(self):
+        return bool(self.image_path or self.image)
+
+    @property
+    def image_pending(self):
+        return self.image_status == self.IMAGE_PENDING
+
+    def _image_url(self, variant, ext):
+        from .images import variant_url
+        if self.image_path:
+            if self.image_status != self.IMAGE_READY:
+                return ''
+            return variant_url(self.image_path, variant, ext)
+        if not self.image:
+            return ''
+        if variant == 'full' and ext == 'jpg':
+            return self.image.url
+        # Legacy upload: let Cloudinary resize and transcode on the fly.
+        options = {'crop': 'limit', 'width': 480, 'height': 480} if variant == 'thumb' else {}
+        return self.image.build_url(format=ext, **options)
+
+    @property
+    def image_url(self):
+        return self._image_url('full', 'jpg')
+
+    @property
+    def image_webp_url(self):
+        return self._image_url('full', 'webp')
+
+    @property
+    def thumbnail_url(self):
+        return self._image_url('thumb', 'jpg')
+
+    @property
+    def thumbnail_webp_url(self):
+        return self._image_url('thumb', 'webp')
+
+
+class UserItemStats(models.Model):
+    """Per-user item counts for the dashboard, kept current by items/stats.py."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='item_stats')
+    total = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+    found = models.PositiveIntegerField(default=0)
+    returned = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "User item stats"
+
+    def __str__(self):
+        return f"{self.user} ({self.total} items)"
+
+
+class MatchBucket(models.Model):
+    """One MinHash LSH band of an open item's signature (see items/matching.py)."""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='match_buckets')
+    status = models.CharField(max_length=10)
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'band', 'bucket'], name='match_bucket_lookup_idx'),
+        ]
+
+
+class ItemMatch(models.Model):
+    """A Lost/Found pair that items/matching.py thinks may be the same object."""
+    lost = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='found_matches')
+    found = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='lost_matches')
+    score = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['lost', 'found'], name='item_match_pair_uniq'),
+        ]
+        indexes = [
+            # The unique constraint already covers lookups by lost item.
+            models.Index(fields=['found', '-score'], name='item_match_found_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.lost_id} <-> {self.found_id} ({self.score:.2f})"
@@ -0,0 +1,141 @@
+"""
+Keyset (cursor) pagination over the (date_posted, id) ordering used by Item.
+
+Each page is a range scan on one of the composite indexes declared in
+Item.Meta instead of an OFFSET scan, so the cost of page N does not grow
+with N. Cursors are opaque URL-safe tokens; a tampered or stale token just
+restarts from the first page.
+"""
+import base64
+import json
+from urllib.parse import urlencode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 20
+
+
+def encode_cursor(obj, direction):
+    payload = json.dumps({'d': obj.date_posted.isoformat(), 'i': obj.pk, 'r': direction == 'prev'})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (date_posted, id, is_prev) for a cursor token, or None if it is invalid."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        date_posted = parse_datetime(data['d'])
+        pk = int(data['i'])
+    except (ValueError, TypeError, KeyError):
+        return None
+    if date_posted is None:
+        return None
+    return date_posted, pk, bool(data.get('r'))
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor, prev_cursor, params):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self._params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _query(self, cursor):
+        params = {k: v for k, v in self._params.items() if v and k != 'cursor'}
+        params['cursor'] = cursor
+        return '?' + urlencode(params)
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor) if self.has_next else ''
+
+    @property
+    def prev_query(self):
+        return self._query(self.prev_cursor) if self.has_previous else ''
+
+
+def after_cursor(date_posted, pk):
+    """
+    Rows strictly older than (date_posted, pk). The redundant ``date_posted <=``
+    bound lets the planner start an index range scan at the cursor instead of
+    walking the index from the top.
+    """
+    return Q(date_posted__lte=date_posted) & (
+        Q(date_posted__lt=date_posted) | Q(date_posted=date_posted, id__lt=pk)
+    )
+
+
+def before_cursor(date_posted, pk):
+    """Rows strictly newer than (date_posted, pk); the mirror of after_cursor()."""
+    return Q(date_posted__gte=date_posted) & (
+        Q(date_posted__gt=date_posted) | Q(date_posted=date_posted, id__gt=pk)
+    )
+
+
+def paginate(queryset, request, page_size=DEFAULT_PAGE_SIZE, param='cursor'):
+    """
+    Return a CursorPage of ``queryset`` ordered newest first by (date_posted, id),
+    positioned by the ``cursor`` query parameter of ``request``.
+    """
+    cursor = decode_cursor(request.GET.get(param, ''))
+    params = request.GET.dict()
+
+    if cursor is None:
+        rows = list(queryset.order_by('-date_posted', '-id')[:page_size + 1])
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        return CursorPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1], 'next') if more else None,
+            prev_cursor=None,
+            params=params,
+        )
+
+    date_posted, pk, is_prev = cursor
+    if is_prev:
+        # Walk backwards towards newer rows, then flip back into display order.
+        rows = list(queryset.filter(
+            before_cursor(date_posted, pk)
+        ).order_by('date_posted', 'id')[:page_size + 1])
+        more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        return CursorPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1], 'next') if rows else None,
+            prev_cursor=encode_cursor(rows[0], 'prev') if more else None,
+            params=params,
+        )
+
+    rows = list(queryset.filter(
+        after_cursor(date_posted, pk)
+    ).order_by('-date_posted', '-id')[:page_size + 1])
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    return CursorPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], 'next') if more else None,
+        prev_cursor=encode_cursor(rows[0], 'prev') if rows else None,
+        params=params,
+    )
@@ -0,0 +1,232 @@
+"""
+Full-text search index for items.
+
+SQLite uses an FTS5 virtual table ranked with bm25(); PostgreSQL uses a side
+table holding a weighted tsvector behind a GIN index, ranked with ts_rank_cd().
+Both store status and category alongside the document so filters are applied
+inside the index query instead of against the whole Item table.
+
+The index is kept in sync by the signals in items/signals.py and can be
+rebuilt from scratch with `python manage.py rebuild_search_index`.
+"""
+import re
+from dataclasses import dataclass
+
+from django.db import connection, connections, router, transaction
+from django.db.models import Q
+
+from .models import Item
+
+FTS_TABLE = 'items_item_fts'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+@dataclass
+class SearchResult:
+    ids: list
+    total: int
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+def _row(item):
+    return [item.pk, item.title, item.description, item.location, item.status, item.category_id]
+
+
+class SQLiteBackend:
+    # bm25() column weights: title, description, location
+    WEIGHTS = (10.0, 4.0, 2.0)
+
+    def build_match(self, query, prefix):
+        terms = []
+        for token in tokenize(query):
+            term = f'"{token}"'
+            terms.append(term + '*' if prefix else term)
+        return ' '.join(terms)
+
+    INSERT_SQL = (
+        f'INSERT INTO {FTS_TABLE} (rowid, title, description, location, status, category_id) '
+        'VALUES (%s, %s, %s, %s, %s, %s)'
+    )
+
+    def index(self, cursor, item):
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [item.pk])
+        cursor.execute(self.INSERT_SQL, _row(item))
+
+    def insert_many(self, cursor, items):
+        """Index items known not to be in the index yet."""
+        cursor.executemany(self.INSERT_SQL, [_row(item) for item in items])
+
+    def remove(self, cursor, item_id):
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [item_id])
+
+    def clear_category(self, cursor, category_id):
+        cursor.execute(f'UPDATE {FTS_TABLE} SET category_id = NULL WHERE category_id = %s', [category_id])
+
+    def clear(self, cursor):
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def search(self, cursor, match, filters, params, limit, offset):
+        where = ' '.join(f'AND {f}' for f in filters)
+        cursor.execute(
+            f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s {where}',
+            [match, *params],
+        )
+        total = cursor.fetchone()[0]
+        weights = ', '.join(str(w) for w in self.WEIGHTS)
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s {where} '
+            f'ORDER BY bm25({FTS_TABLE}, {weights}), rowid DESC LIMIT %s OFFSET %s',
+            [match, *params, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()], total
+
+
+class PostgresBackend:
+    DOCUMENT_SQL = (
+        "setweight(to_tsvector('english', coalesce(%s, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(%s, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(%s, '')), 'C')"
+    )
+
+    def build_match(self, query, prefix):
+        suffix = ':*' if prefix else ''
+        return ' & '.join(token + suffix for token in tokenize(query))
+
+    INSERT_SQL = (
+        f'INSERT INTO {FTS_TABLE} (item_id, document, status, category_id) '
+        f'VALUES (%s, {DOCUMENT_SQL}, %s, %s) '
+        'ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document, '
+        'status = EXCLUDED.status, category_id = EXCLUDED.category_id'
+    )
+
+    def index(self, cursor, item):
+        cursor.execute(self.INSERT_SQL, _row(item))
+
+    def insert_many(self, cursor, items):
+        cursor.executemany(self.INSERT_SQL, [_row(item) for item in items])
+
+    def remove(self, cursor, item_id):
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE item_id = %s', [item_id])
+
+    def clear_category(self, cursor, category_id):
+        cursor.execute(f'UPDATE {FTS_TABLE} SET category_id = NULL WHERE category_id = %s', [category_id])
+
+    def clear(self, cursor):
+        cursor.execute(f'TRUNCATE {FTS_TABLE}')
+
+    def search(self, cursor, match, filters, params, limit, offset):
+        where = ' '.join(f'AND {f}' for f in filters)
+        tsquery = "to_tsquery('english', %s)"
+        cursor.execute(
+            f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE document @@ {tsquery} {where}',
+            [match, *params],
+        )
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f'SELECT item_id FROM {FTS_TABLE} WHERE document @@ {tsquery} {where} '
+            f'ORDER BY ts_rank_cd(document, {tsquery}) DESC, item_id DESC LIMIT %s OFFSET %s',
+            [match, *params, match, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()], total
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def get_backend():
+    """Return the index backend for the default database, or None if it has no full-text support."""
+    backend_class = BACKENDS.get(connection.vendor)
+    return backend_class() if backend_class else None
+
+
+def index_item(item):
+    backend = get_backend()
+    if backend:
+        with connection.cursor() as cursor:
+            backend.index(cursor, item)
+
+
+def index_new_items(items):
+    """Index items just saved with bulk_create(), which skips the signals, in one statement."""
+    backend = get_backend()
+    if backend and items:
+        with connection.cursor() as cursor:
+            backend.insert_many(cursor, items)
+
+
+def remove_item(item_id):
+    backend = get_backend()
+    if backend:
+        with connection.cursor() as cursor:
+            backend.remove(cursor, item_id)
+
+
+def clear_category(category_id):
+    backend = get_backend()
+    if backend:
+        with connection.cursor() as cursor:
+            backend.clear_category(cursor, category_id)
+
+
+def rebuild_index(chunk_size=1000):
+    """
+    Drop every index row and re-index all items, in one transaction so a
+    failure part way leaves the old index in place. Returns the number of
+    items indexed.
+    """
+    backend = get_backend()
+    if not backend:
+        return 0
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        backend.clear(cursor)
+        for item in Item.objects.only(
+            'pk', 'title', 'description', 'location', 'status', 'category_id',
+        ).iterator(chunk_size=chunk_size):
+            backend.index(cursor, item)
+            count += 1
+    return count
+
+
+def search(query, status='', category='', prefix=True, limit=20, offset=0):
+    """
+    Return the ids of items matching ``query`` ordered by relevance, plus the
+    total number of matches. ``prefix`` lets "wal" match "wallet".
+    """
+    backend = get_backend()
+    if not tokenize(query):
+        return SearchResult(ids=[], total=0)
+
+    if backend is None:
+        # No full-text support on this database — fall back to a plain scan.
+        items = Item.objects.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        if status:
+            items = items.filter(status=status)
+        if category:
+            items = items.filter(category__id=category)
+        return SearchResult(
+            ids=list(items.values_list('pk', flat=True)[offset:offset + limit]),
+            total=items.count(),
+        )
+
+    filters, params = [], []
+    if status:
+        filters.append('status = %s')
+        params.append(status)
+    if category:
+        filters.append('category_id = %s')
+        params.append(int(category))
+
+    # Index reads follow the same routing as Item reads (the read alias in read-only views)
+    with connections[router.db_for_read(Item)].cursor() as cursor:
+        ids, total = backend.search(
+            cursor, backend.build_match(query, prefix), filters, params, limit, offset,
+        )
+    return SearchResult(ids=ids, total=total)
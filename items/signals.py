@@ -0,0 +1,55 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import caching, images, matching, search
+from .models import Item, Category
+
+
+@receiver(post_save, sender=Item)
+def index_item_on_save(sender, instance, **kwargs):
+    search.index_item(instance)
+
+
+@receiver(post_delete, sender=Item)
+def remove_item_on_delete(sender, instance, **kwargs):
+    search.remove_item(instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+def clear_category_on_delete(sender, instance, **kwargs):
+    # Item.category is SET_NULL, which Django applies with a bulk UPDATE that
+    # bypasses Item signals, so mirror it in the index here.
+    search.clear_category(instance.pk)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def bump_item_cache_version(sender, instance, **kwargs):
+    caching.bump_item(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_cache_version(sender, instance, **kwargs):
+    # Also covers the SET_NULL above: every cached page and card key
+    # includes the category version.
+    caching.bump_categories()
+
+
+@receiver(post_delete, sender=Item)
+def discard_item_images(sender, instance, **kwargs):
+    if instance.image_path:
+        path = instance.image_path
+        transaction.on_commit(lambda: images.pipeline.discard(path))
+
+
+MATCH_FIELDS = {'title', 'description', 'location', 'status', 'category'}
+
+
+@receiver(post_save, sender=Item)
+def rematch_item(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not MATCH_FIELDS & set(update_fields)):
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: matching.matcher.submit(pk))
@@ -0,0 +1,83 @@
+"""
+Per-user item counts for the dashboard.
+
+count_items() answers "how many items has this user posted, and how many
+are Lost / Found / Returned" with one conditional aggregate. When
+ITEMS_USER_STATS_SUMMARY is on (the default), the answer is also stored in
+a UserItemStats row that post_item, edit_item, mark_returned and
+delete_item keep current with F() updates, so the dashboard reads a single
+row however many items the user has posted.
+
+A missing row is rebuilt from count_items() on the next read, or by the
+next item write, whichever comes first. Writes that bypass the views (the
+admin) call invalidate() for the affected users.
+"""
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from .models import Item, UserItemStats
+
+# Item.status value -> UserItemStats / count_items() field
+STATUS_FIELDS = {'Lost': 'lost', 'Found': 'found', 'Returned': 'returned'}
+
+
+def summary_enabled():
+    return getattr(settings, 'ITEMS_USER_STATS_SUMMARY', True)
+
+
+def count_items(user):
+    """{'total', 'lost', 'found', 'returned'} for ``user``'s items, in one query."""
+    aggregates = {'total': Count('pk')}
+    for status, field in STATUS_FIELDS.items():
+        aggregates[field] = Count('pk', filter=Q(status=status))
+    return Item.objects.filter(posted_by=user).aggregate(**aggregates)
+
+
+def get_stats(user):
+    if not summary_enabled():
+        return count_items(user)
+    row = UserItemStats.objects.filter(user=user).values('total', *STATUS_FIELDS.values()).first()
+    if row is None:
+        row = count_items(user)
+        # One INSERT .. ON CONFLICT DO NOTHING: concurrent first visits don't
+        # need a read-then-write transaction (which SQLite can't upgrade under load).
+        UserItemStats.objects.bulk_create([UserItemStats(user=user, **row)], ignore_conflicts=True)
+    return row
+
+
+def record_change(user_id, old_status=None, new_status=None):
+    """
+    Apply one item's status change to its owner's summary row. ``old_status``
+    is None for a new item, ``new_status`` is None for a deleted one. Call it
+    in the same transaction as the item write.
+    """
+    if not summary_enabled() or old_status == new_status:
+        return
+    changes = {}
+    if old_status is None:
+        changes['total'] = F('total') + 1
+    elif new_status is None:
+        changes['total'] = _decrement('total')
+    if old_status in STATUS_FIELDS:
+        changes[STATUS_FIELDS[old_status]] = _decrement(STATUS_FIELDS[old_status])
+    if new_status in STATUS_FIELDS:
+        changes[STATUS_FIELDS[new_status]] = F(STATUS_FIELDS[new_status]) + 1
+    if not UserItemStats.objects.filter(user_id=user_id).update(**changes):
+        # No row yet, but a first dashboard visit may be about to insert one
+        # from a count taken before this write. Store a count that includes
+        # it, overwriting any such row; a later stale insert is ignored.
+        UserItemStats.objects.bulk_create(
+            [UserItemStats(user_id=user_id, **count_items(user_id))],
+            update_conflicts=True, unique_fields=['user'], update_fields=['total', *STATUS_FIELDS.values()],
+        )
+
+
+def _decrement(field):
+    # A row that has drifted (e.g. admin deletes) must not go below zero: the
+    # CHECK constraint would fail the item write along with it.
+    return Greatest(F(field) - 1, 0)
+
+
+def invalidate(user_ids):
+    UserItemStats.objects.filter(user_id__in=user_ids).delete()
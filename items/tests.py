@@ -0,0 +1,364 @@
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from . import benchmark, images, matching, search, stats, views
+from .forms import ItemForm
+from .models import Item, ItemMatch, UserItemStats
+from .pagination import after_cursor, paginate
+
+# "SCAN items_item" is a full table scan. "SCAN items_item USING INDEX ..." is
+# an ordered walk of an index, which only stays cheap when a LIMIT stops it early.
+SCAN_RE = re.compile(r'\bSCAN (\w+)( USING (COVERING )?INDEX)?')
+
+
+def full_scans(queryset):
+    """The tables ``queryset``'s EXPLAIN QUERY PLAN walks in full, and the plan itself."""
+    plan = queryset.explain()
+    limited = queryset.query.high_mark is not None
+    scans = []
+    for match in map(SCAN_RE.search, plan.splitlines()):
+        if match is None or match.group(1) == 'CONSTANT':
+            continue
+        if match.group(2) and limited:
+            continue
+        scans.append(match.group(1))
+    return scans, plan
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plan checks target SQLite')
+class QueryPlanTestCase(TestCase):
+    """Fails a hot query that falls back to a full table scan."""
+
+    def assertNoFullScans(self, queries):
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                scans, plan = full_scans(queryset)
+                self.assertFalse(scans, f"{name}: full scan of {', '.join(scans)}\n{plan}")
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        Item.objects.bulk_create([
+            Item(title=f'Item {i}', description='d', location='Library', posted_by=owner) for i in range(8)
+        ])
+        # Ties on date_posted, including across page boundaries, are broken by id
+        tied = datetime(2026, 1, 2, tzinfo=timezone.utc)
+        pks = sorted(Item.objects.values_list('pk', flat=True))
+        Item.objects.filter(pk__in=pks[1:6]).update(date_posted=tied)
+        Item.objects.filter(pk=pks[0]).update(date_posted=tied - timedelta(days=1))
+        Item.objects.filter(pk__in=pks[6:]).update(date_posted=tied + timedelta(days=1))
+        self.expected = list(Item.objects.order_by('-date_posted', '-id').values_list('pk', flat=True))
+
+    def page(self, cursor=None):
+        request = RequestFactory().get('/', {'cursor': cursor} if cursor else {})
+        return paginate(Item.objects.all(), request, page_size=3)
+
+    def test_next_and_prev_pages_cover_every_row_once(self):
+        pages = [self.page()]
+        while pages[-1].has_next:
+            pages.append(self.page(pages[-1].next_cursor))
+        self.assertEqual([item.pk for page in pages for item in page], self.expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertFalse(pages[0].has_previous)
+
+        back = [pages[-1]]
+        while back[-1].has_previous:
+            back.append(self.page(back[-1].prev_cursor))
+        self.assertEqual([[item.pk for item in page] for page in reversed(back)],
+                         [[item.pk for item in page] for page in pages])
+
+    def test_bad_cursor_restarts(self):
+        self.assertEqual([item.pk for item in self.page('not-a-cursor')], self.expected[:3])
+
+
+class ItemQueryPlanTests(QueryPlanTestCase):
+    def setUp(self):
+        self.user = User(pk=1)
+        self.feed = Item.objects.select_related('category', 'posted_by').order_by('-date_posted', '-id')
+        self.cursor = after_cursor(datetime(2026, 1, 1, tzinfo=timezone.utc), 100)
+
+    def test_home_feed(self):
+        self.assertNoFullScans({
+            'home': self.feed[:21],
+            'home ?status': self.feed.filter(status='Lost')[:21],
+            'home ?category': self.feed.filter(category__id=1)[:21],
+            'home ?cursor': self.feed.filter(self.cursor)[:21],
+            'home ?status&cursor': self.feed.filter(self.cursor).filter(status='Found')[:21],
+        })
+
+    def test_search_filters(self):
+        self.assertNoFullScans({
+            'search ?status&category': self.feed.filter(status='Lost', category__id=1)[:21],
+            'search count': Item.objects.filter(status='Lost').order_by()[:views.SEARCH_COUNT_LIMIT + 1],
+        })
+
+    def test_dashboard(self):
+        self.assertNoFullScans({
+            'dashboard stats': Item.objects.filter(posted_by=self.user, status='Returned'),
+            'dashboard page': Item.objects.filter(posted_by=self.user).order_by('-date_posted', '-id')[:21],
+        })
+
+
+@skipUnless(search.get_backend() is not None, 'No full-text backend on this database')
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.wallet = Item.objects.create(
+            title='Brown leather wallet', description='Has a library card', location='Cafeteria', posted_by=owner,
+        )
+        self.umbrella = Item.objects.create(
+            title='Blue umbrella', description='Folding', location='Library', posted_by=owner, status='Found',
+        )
+
+    def test_search(self):
+        self.assertEqual(search.search('wal').ids, [self.wallet.pk])
+        self.assertEqual(search.search('library').total, 2)
+        self.assertEqual(search.search('library', status='Found').ids, [self.umbrella.pk])
+
+    def test_failed_rebuild_keeps_the_old_index(self):
+        backend = type(search.get_backend())
+        with mock.patch.object(backend, 'index', side_effect=[None, RuntimeError('disk full')]):
+            with self.assertRaises(RuntimeError):
+                search.rebuild_index()
+        self.assertEqual(search.search('library').total, 2)
+        self.assertEqual(search.rebuild_index(), 2)
+
+
+@override_settings(ITEMS_MATCH_SYNC=True)
+class SearchViewTests(TransactionTestCase):
+    # Served from the read alias, which only sees committed rows
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user('owner')
+        for i in range(3):
+            Item.objects.create(title=f'Umbrella {i}', description='d', location='Library', posted_by=owner)
+
+    def test_unranked_total_is_capped(self):
+        response = self.client.get(reverse('search'), {'status': 'Lost'})
+        self.assertEqual((response.context['total'], response.context['total_capped']), (3, False))
+
+        with mock.patch.object(views, 'SEARCH_COUNT_LIMIT', 2):
+            cache.clear()
+            response = self.client.get(reverse('search'), {'status': 'Lost'})
+        self.assertEqual((response.context['total'], response.context['total_capped']), (2, True))
+        self.assertContains(response, '2+ item(s) found')
+
+
+@override_settings(ITEMS_MATCH_SYNC=True)
+class PageCacheTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        Item.objects.create(title='Blue umbrella', description='d', location='Library', posted_by=self.owner)
+
+    def add_unannounced_item(self):
+        # bulk_create skips the signals that bump the feed version
+        Item.objects.bulk_create([Item(title='Red scarf', description='d', location='Gym', posted_by=self.owner)])
+
+    def test_anonymous_pages_are_cached_until_a_bump(self):
+        self.assertContains(self.client.get(reverse('home')), 'Blue umbrella')
+        self.add_unannounced_item()
+        self.assertNotContains(self.client.get(reverse('home')), 'Red scarf')
+
+        Item.objects.create(title='Green bottle', description='d', location='Gym', posted_by=self.owner)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Red scarf')
+        self.assertContains(response, 'Green bottle')
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_off_with_a_per_process_cache_and_several_workers(self):
+        self.assertContains(self.client.get(reverse('home')), 'Blue umbrella')
+        self.add_unannounced_item()
+        self.assertContains(self.client.get(reverse('home')), 'Red scarf')
+
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+
+    def post(self, status='Lost'):
+        item = Item.objects.create(title='Umbrella', description='d', location='Library', posted_by=self.owner,
+                                   status=status)
+        stats.record_change(self.owner.id, new_status=status)
+        return item
+
+    def test_counts_follow_item_writes(self):
+        self.assertEqual(stats.get_stats(self.owner)['total'], 0)
+        item = self.post()
+        self.post('Found')
+        stats.record_change(self.owner.id, 'Lost', 'Returned')
+        item.delete()
+        stats.record_change(self.owner.id, old_status='Returned')
+        self.assertEqual(stats.get_stats(self.owner), {'total': 1, 'lost': 0, 'found': 1, 'returned': 0})
+
+    def test_write_during_a_first_visit_is_kept(self):
+        # The first visit counts, an item is posted, then the visit inserts its stale count
+        stale = stats.count_items(self.owner)
+        self.post()
+        UserItemStats.objects.bulk_create([UserItemStats(user=self.owner, **stale)], ignore_conflicts=True)
+        self.assertEqual(stats.get_stats(self.owner)['lost'], 1)
+
+    def test_drifted_row_does_not_go_negative(self):
+        UserItemStats.objects.create(user=self.owner)
+        stats.record_change(self.owner.id, old_status='Lost')
+        self.assertEqual(stats.get_stats(self.owner), {'total': 0, 'lost': 0, 'found': 0, 'returned': 0})
+
+
+class ItemImageTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.item = Item.objects.create(title='Blue umbrella', description='d', location='Library',
+                                        posted_by=self.owner, image_path='items/abc', image_status=Item.IMAGE_READY)
+
+    def test_edit_form_offers_to_clear_the_photo(self):
+        self.assertIn('name="image-clear"', str(ItemForm(instance=self.item)['image']))
+        self.assertNotIn('name="image-clear"', str(ItemForm()['image']))
+
+    def test_clearing_and_keeping_the_photo(self):
+        self.client.force_login(self.owner)
+        data = {'title': 'Blue umbrella', 'description': 'd', 'status': 'Lost', 'location': 'Library'}
+        self.client.post(reverse('edit_item', args=[self.item.pk]), data)
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.image_path, self.item.image_status), ('items/abc', Item.IMAGE_READY))
+
+        self.client.post(reverse('edit_item', args=[self.item.pk]), {**data, 'image-clear': 'on'})
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.image_path, self.item.image_status), ('', ''))
+
+    def test_pending_upload_is_claimed_once(self):
+        Item.objects.filter(pk=self.item.pk).update(image_status=Item.IMAGE_PENDING)
+        self.assertTrue(images.claim(self.item.pk, 'items/abc'))
+        self.assertFalse(images.claim(self.item.pk, 'items/abc'))
+        self.assertIsNone(images.process(self.item.pk, 'items/abc'))
+
+        stale = Item.objects.get(pk=self.item.pk).image_claimed_at - timedelta(seconds=images.claim_timeout() + 1)
+        Item.objects.filter(pk=self.item.pk).update(image_claimed_at=stale)
+        self.assertTrue(images.claim(self.item.pk, 'items/abc'))
+        self.assertFalse(images.claim(self.item.pk, 'items/other'))
+
+    def test_leftover_upload_deletes_the_photo_it_replaced(self):
+        staging = FileSystemStorage(location=self.enterContext(tempfile.TemporaryDirectory()))
+        with mock.patch.object(images, 'get_staging', return_value=staging), \
+                mock.patch.object(images.pipeline, 'submit'):
+            with self.captureOnCommitCallbacks(execute=True):
+                images.accept_upload(self.item, ContentFile(b'first', name='first.jpg'))
+            # Replaced again before the first upload was processed
+            with self.captureOnCommitCallbacks(execute=True):
+                images.accept_upload(self.item, ContentFile(b'second', name='second.jpg'))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.image_old_path, 'items/abc')
+
+        with mock.patch.object(images, 'get_staging', return_value=staging), \
+                mock.patch.object(images, 'render_variants', return_value={}), \
+                mock.patch.object(images, 'delete_variants') as delete_variants:
+            call_command('process_pending_images', stdout=StringIO())
+        delete_variants.assert_called_once_with('items/abc')
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.image_status, self.item.image_old_path), (Item.IMAGE_READY, ''))
+
+
+class MatchingTests(TestCase):
+    def setUp(self):
+        finder = User.objects.create_user('finder')
+        found = Item.objects.bulk_create([
+            Item(title='Blue folding umbrella', description=extra, location='Library', posted_by=finder, status='Found')
+            for extra in ['blue folding umbrella', 'wooden handle', 'wooden handle black strap scratched']
+        ])
+        matching.index_new_items(found)
+        self.best = found[0]
+        self.lost = Item.objects.create(title='Blue folding umbrella', description='blue folding umbrella',
+                                        location='Library', posted_by=User.objects.create_user('owner'))
+
+    def test_pairs_are_capped_at_top_k_after_rescoring(self):
+        with override_settings(ITEMS_MATCH_TOP_K=3):
+            self.assertEqual(len(matching.update_matches(self.lost.pk)), 3)
+        with override_settings(ITEMS_MATCH_TOP_K=2):
+            self.assertEqual(matching.update_matches(self.lost.pk), [])
+            self.assertEqual(ItemMatch.objects.filter(lost=self.lost).count(), 2)
+            self.assertEqual(matching.matches_for(self.lost)[0], self.best)
+
+
+class ImportItemsCommandTests(TestCase):
+    HEADER = b'title,description,status,location\n'
+
+    def setUp(self):
+        User.objects.create_user('owner')
+
+    def import_file(self, content):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as f:
+            f.write(content)
+            f.flush()
+            call_command('import_items', f.name, user='owner', chunk_size=2, stdout=StringIO(), stderr=StringIO())
+
+    def test_rows_are_imported(self):
+        self.import_file(self.HEADER + b'Umbrella,Blue,Lost,Library\nScarf,Red,Found,Gym\n,,Lost,Gym\n')
+        self.assertEqual(Item.objects.count(), 2)
+
+    def test_bytes_that_are_not_utf8_name_their_line(self):
+        content = self.HEADER + b'Umbrella,Blue,Lost,Library\nCaf\xe9 mug,White,Found,Cafeteria\n'
+        with self.assertRaisesMessage(CommandError, 'Line 3: not valid UTF-8'):
+            self.import_file(content)
+        self.assertEqual(list(Item.objects.values_list('title', flat=True)), ['Umbrella'])
+
+    def test_malformed_csv_names_its_line(self):
+        content = self.HEADER + b'Umbrella,Blue,Lost,Library\nScarf,' + b'x' * 200_000 + b',Found,Gym\n'
+        with self.assertRaisesMessage(CommandError, 'Line 3: malformed CSV'):
+            self.import_file(content)
+        self.assertEqual(Item.objects.count(), 1)
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def result(self, name='home', p95=100.0, queries=3.0, errors=0):
+        return benchmark.Result(name=name, requests=200, errors=errors, p50=50.0, p95=p95, p99=150.0,
+                                throughput=80.0, queries=queries)
+
+    def compare(self, *results, threshold=0.2):
+        return benchmark.compare(results, {'results': [self.result().as_dict()]}, threshold)
+
+    def test_percentile(self):
+        samples = [5, 1, 4, 2, 3]
+        self.assertEqual(benchmark.percentile(samples, 50), 3)
+        self.assertEqual(benchmark.percentile(samples, 95), 5)
+        self.assertEqual(benchmark.percentile(samples, 1), 1)
+        self.assertEqual(benchmark.percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(benchmark.percentile(list(range(1, 101)), 7), 7)
+        self.assertEqual(benchmark.percentile([], 95), 0.0)
+
+    def test_within_the_thresholds(self):
+        self.assertEqual(self.compare(self.result(p95=120.0, queries=3.5)), [])
+
+    def test_p95_regression(self):
+        problems = self.compare(self.result(p95=120.1))
+        self.assertEqual(len(problems), 1)
+        self.assertIn('p95', problems[0])
+
+    def test_query_regression(self):
+        problems = self.compare(self.result(queries=3.51))
+        self.assertEqual(len(problems), 1)
+        self.assertIn('queries', problems[0])
+
+    def test_error_regression(self):
+        problems = self.compare(self.result(errors=1))
+        self.assertEqual(len(problems), 1)
+        self.assertIn('errors', problems[0])
+
+    def test_scenario_missing_from_the_baseline(self):
+        self.assertEqual(self.compare(self.result(name='new scenario', p95=1000.0, errors=5)), [])
+        self.assertEqual(benchmark.compare([self.result()], {}, 0.2), [])
@@ -2,11 +2,25 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib import messages
-from django.db.models import Q
-from .models import Item, Category
+from django.db import transaction
+from lostfound.database import read_from_replica
+from .models import Item
 from .forms import RegisterForm, ItemForm
+from . import images, matching, search, stats
+from .caching import (
+    attach_versions, cache_anonymous, cached_categories, card_timeout, category_version, feed_versions,
+    item_versions,
+)
+from .pagination import paginate
 
+SEARCH_PAGE_SIZE = 20
+# Unranked search counts at most this many matches and shows "N+" beyond it,
+# so the count stays a bounded index range however many items match.
+SEARCH_COUNT_LIMIT = 1000
 
+
+@cache_anonymous(feed_versions)
+@read_from_replica
 def home(request):
     items = Item.objects.select_related('category', 'posted_by').all()
 
@@ -20,9 +34,13 @@ def home(request):
     if category_filter:
         items = items.filter(category__id=category_filter)
 
-    categories = Category.objects.all()
+    page = paginate(items, request)
+    categories = cached_categories()
     context = {
-        'items': items[:20],
+        'items': attach_versions(page.object_list),
+        'category_version': category_version(),
+        'card_timeout': card_timeout(),
+        'page': page,
         'categories': categories,
         'status_filter': status_filter,
         'category_filter': category_filter,
@@ -46,16 +64,15 @@ def register_view(request):
 @login_required
 def dashboard(request):
     user_items = Item.objects.filter(posted_by=request.user)
-    total_posts = user_items.count()
-    returned_count = user_items.filter(status='Returned').count()
-    lost_count = user_items.filter(status='Lost').count()
-    found_count = user_items.filter(status='Found').count()
+    counts = stats.get_stats(request.user)
+    page = paginate(user_items.select_related('category'), request)
     context = {
-        'user_items': user_items,
-        'total_posts': total_posts,
-        'returned_count': returned_count,
-        'lost_count': lost_count,
-        'found_count': found_count,
+        'user_items': page.object_list,
+        'page': page,
+        'total_posts': counts['total'],
+        'returned_count': counts['returned'],
+        'lost_count': counts['lost'],
+        'found_count': counts['found'],
     }
     return render(request, 'dashboard.html', context)
 
@@ -67,7 +84,11 @@ def post_item(request):
         if form.is_valid():
             item = form.save(commit=False)
             item.posted_by = request.user
-            item.save()
+            with transaction.atomic():
+                item.save()
+                stats.record_change(request.user.id, new_status=item.status)
+                if form.cleaned_data['image']:
+                    images.accept_upload(item, form.cleaned_data['image'])
             messages.success(request, 'Item posted successfully!')
             return redirect('item_detail', pk=item.pk)
     else:
@@ -75,9 +96,12 @@ def post_item(request):
     return render(request, 'items/post_item.html', {'form': form, 'title': 'Post Item'})
 
 
+@cache_anonymous(item_versions)
+@read_from_replica
 def item_detail(request, pk):
     item = get_object_or_404(Item, pk=pk)
-    return render(request, 'items/item_detail.html', {'item': item})
+    matches = matching.matches_for(item) if item.posted_by_id == request.user.id else []
+    return render(request, 'items/item_detail.html', {'item': item, 'matches': matches})
 
 
 @login_required
@@ -88,9 +112,16 @@ def edit_item(request, pk):
         return redirect('item_detail', pk=pk)
 
     if request.method == 'POST':
+        old_status = item.status
         form = ItemForm(request.POST, request.FILES, instance=item)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+                stats.record_change(item.posted_by_id, old_status, item.status)
+                if form.cleaned_data['image']:
+                    images.accept_upload(item, form.cleaned_data['image'])
+                elif form.cleaned_data['image'] is False:
+                    images.clear_image(item)
             messages.success(request, 'Item updated successfully!')
             return redirect('item_detail', pk=pk)
     else:
@@ -106,7 +137,9 @@ def delete_item(request, pk):
         return redirect('item_detail', pk=pk)
 
     if request.method == 'POST':
-        item.delete()
+        with transaction.atomic():
+            item.delete()
+            stats.record_change(item.posted_by_id, old_status=item.status)
         messages.success(request, 'Item deleted.')
         return redirect('dashboard')
     return render(request, 'items/confirm_delete.html', {'item': item})
@@ -119,12 +152,17 @@ def mark_returned(request, pk):
         messages.error(request, 'Only the owner can mark an item as returned.')
         return redirect('item_detail', pk=pk)
 
+    old_status = item.status
     item.status = 'Returned'
-    item.save()
+    with transaction.atomic():
+        item.save()
+        stats.record_change(item.posted_by_id, old_status, item.status)
     messages.success(request, f'"{item.title}" has been marked as Returned!')
     return redirect('item_detail', pk=pk)
 
 
+@cache_anonymous(feed_versions)
+@read_from_replica
 def search_items(request):
     query = request.GET.get('q', '')
     status_filter = request.GET.get('status', '')
@@ -133,15 +171,43 @@ def search_items(request):
     items = Item.objects.select_related('category', 'posted_by').all()
 
     if query:
-        items = items.filter(Q(title__icontains=query) | Q(description__icontains=query))
-    if status_filter:
-        items = items.filter(status=status_filter)
-    if category_filter:
-        items = items.filter(category__id=category_filter)
-
-    categories = Category.objects.all()
+        # Ranked full-text lookup; only the current page of items is loaded.
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        result = search.search(
+            query, status=status_filter, category=category_filter,
+            limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE,
+        )
+        by_id = items.in_bulk(result.ids)
+        items = [by_id[pk] for pk in result.ids if pk in by_id]
+        total, total_capped = result.total, False
+        has_next = page * SEARCH_PAGE_SIZE < total
+        cursor_page = None
+    else:
+        # Unranked browsing by filter only: keyset pages like the home feed.
+        page, has_next = 1, False
+        if status_filter:
+            items = items.filter(status=status_filter)
+        if category_filter:
+            items = items.filter(category__id=category_filter)
+        total = items.order_by()[:SEARCH_COUNT_LIMIT + 1].count()
+        total_capped = total > SEARCH_COUNT_LIMIT
+        total = min(total, SEARCH_COUNT_LIMIT)
+        cursor_page = paginate(items, request, page_size=SEARCH_PAGE_SIZE)
+        items = cursor_page.object_list
+
+    categories = cached_categories()
     context = {
-        'items': items,
+        'items': attach_versions(items),
+        'category_version': category_version(),
+        'card_timeout': card_timeout(),
+        'total': total,
+        'total_capped': total_capped,
+        'page': page,
+        'has_next': has_next,
+        'cursor_page': cursor_page,
         'query': query,
         'categories': categories,
         'status_filter': status_filter,
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class LostFoundConfig(AppConfig):
+    name = 'lostfound'
+
+    def ready(self):
+        from . import database  # noqa: F401
+        from . import websocket
+        websocket.install()
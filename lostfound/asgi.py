@@ -10,12 +10,16 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lostfound.settings')
 django.setup()   # 🔥 VERY IMPORTANT
 
 import messaging.routing  # Import AFTER setup
+from lostfound.metrics import WebSocketMetrics
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            messaging.routing.websocket_urlpatterns
-        )
+    "websocket": WebSocketMetrics(
+        AuthMiddlewareStack(
+            URLRouter(
+                messaging.routing.websocket_urlpatterns
+            )
+        ),
+        messaging.routing.websocket_urlpatterns,
     ),
 })
\ No newline at end of file
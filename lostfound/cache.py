@@ -0,0 +1,18 @@
+"""
+Whether the default cache is shared by every worker process.
+
+LocMemCache lives inside one process. With one worker that is all there is,
+but with WEB_CONCURRENCY > 1 an update or invalidation made in one worker
+is invisible to the others. State that the workers must agree on (the
+unread badge totals, the item page versions) is only kept in the cache when
+it is shared; otherwise callers go to the database.
+"""
+from django.conf import settings
+
+PROCESS_LOCAL_BACKENDS = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+def cache_is_shared(alias='default'):
+    if getattr(settings, 'WEB_CONCURRENCY', 1) <= 1:
+        return True
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_BACKENDS
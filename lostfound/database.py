@@ -0,0 +1,138 @@
+"""
+Database tuning and read routing.
+
+* Every new SQLite connection gets SQLITE_PRAGMAS: WAL journaling (readers
+  no longer block the chat writers), synchronous=NORMAL, a memory-mapped
+  file, a bigger page cache and a busy timeout. Read-only connections skip
+  the writer's settings and leave switching the file to WAL to ``default``,
+  which is opened first.
+* PrimaryReplicaRouter sends the reads of views wrapped in
+  @read_from_replica to one of DATABASE_READ_ALIASES, and everything else
+  to ``default``. On SQLite the read alias is a second, read-only
+  connection to the same file; with PostgreSQL it is a streaming replica.
+  Either way the router only sees aliases.
+* Auth, session and admin models are always read from ``default``, and a
+  browser that has just written (any POST, PUT, PATCH or DELETE) reads from
+  ``default`` for DATABASE_REPLICA_PIN_SECONDS, so a lagging replica can't
+  hide what it just posted.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+PIN_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_ONLY_APPS = {'admin', 'auth', 'contenttypes', 'sessions'}
+
+# Pragmas a read-only connection can't or needn't set: journal_mode=WAL
+# rewrites the file header, and synchronous only affects writes.
+WRITER_PRAGMAS = {'journal_mode', 'synchronous'}
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def is_read_only(connection):
+    return connection.alias in read_aliases() or 'mode=ro' in str(connection.settings_dict['NAME'])
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    read_only = is_read_only(connection)
+    if read_only:
+        # Only a writer can switch the file to WAL, and it can't while this
+        # connection holds a rollback-journal read lock: let it go first.
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor == 'sqlite':
+            primary.ensure_connection()
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        if read_only and name in WRITER_PRAGMAS:
+            continue
+        # On the raw connection, so the metrics query counter doesn't see them
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+connection_created.connect(apply_pragmas)
+
+
+# ── Read routing ──────────────────────────────────────────────────────────
+
+def read_aliases():
+    """The configured read aliases that exist in DATABASES."""
+    return [alias for alias in getattr(settings, 'DATABASE_READ_ALIASES', []) if alias in settings.DATABASES]
+
+
+@contextmanager
+def replica_reads():
+    """Route ORM reads in this block to a read alias, if any is configured."""
+    aliases = read_aliases()
+    token = _read_alias.set(random.choice(aliases) if aliases else None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def read_from_replica(view):
+    """Serve a read-only view from a read alias, unless the browser has just written."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES:
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is not None and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        pool = {DEFAULT_DB_ALIAS, *read_aliases()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in read_aliases():
+            return False
+        return None
+
+
+class ReplicaPinMiddleware:
+    """Sets the pin cookie on responses to writes while read aliases are configured."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and self.pin_seconds and read_aliases():
+            response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
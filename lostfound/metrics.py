@@ -0,0 +1,323 @@
+"""
+Process-local metrics in the Prometheus text exposition format.
+
+* MetricsMiddleware times every request per route and counts its queries.
+* WebSocketMetrics (wrapped around the socket router in asgi.py) tracks open
+  connections and frames per consumer.
+* group_send() times channel-layer fan-out.
+* cache_lookup() counts hits and misses for the named caches.
+
+Queries are counted by one execute wrapper installed on every database
+connection. It charges each query to whatever request or socket is active
+in the current context, so queries run on the chat DB executor land on the
+right route too. Everything is served at /metrics. Each Daphne worker keeps
+its own numbers, so scrape every worker.
+
+With METRICS_QUERY_BUDGET set, requests that run more queries than that
+are logged as warnings.
+"""
+import hmac
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return '{%s}' % pairs
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total, count = self._values.get(labels, ((0,) * len(self.buckets), 0.0, 0))
+            counts = tuple(n + (value <= bound) for n, bound in zip(counts, self.buckets))
+            self._values[labels] = (counts, total + value, count + 1)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        for bound, n in zip(self.buckets, counts):
+            labels = _format_labels(self.labels + ('le',), key + (bound,))
+            lines.append(f'{self.name}_bucket{labels} {n}')
+        labels = _format_labels(self.labels + ('le',), key + ('+Inf',))
+        lines.append(f'{self.name}_bucket{labels} {count}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+        lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route.', ('route', 'method'),
+)
+REQUESTS = Counter('http_requests_total', 'HTTP responses by route and status.', ('route', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries per HTTP request.', ('route',), buckets=QUERY_BUCKETS,
+)
+DB_QUERIES = Counter('db_queries_total', 'Database queries by route or consumer.', ('route',))
+DB_SECONDS = Counter('db_query_seconds_total', 'Time spent in database queries.', ('route',))
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+WS_CONNECTIONS = Gauge('websocket_connections', 'Open WebSocket connections by consumer.', ('consumer',))
+WS_MESSAGES = Counter('websocket_messages_total', 'WebSocket frames by consumer.', ('consumer', 'direction'))
+GROUP_SEND_SECONDS = Histogram(
+    'channel_layer_group_send_seconds', 'Channel layer group_send() latency by group kind.', ('group',),
+)
+
+REGISTRY = [
+    REQUEST_SECONDS, REQUESTS, REQUEST_QUERIES, DB_QUERIES, DB_SECONDS,
+    CACHE_LOOKUPS, WS_CONNECTIONS, WS_MESSAGES, GROUP_SEND_SECONDS,
+]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ── Database queries ──────────────────────────────────────────────────────
+
+class Scope:
+    """
+    Queries charged to one request or socket. A request's route is only known
+    once its URL resolves, so request scopes are added to the per-route totals
+    when they finish; socket scopes (``live``) are added query by query.
+    """
+    __slots__ = ('route', 'live', 'queries', 'seconds')
+
+    def __init__(self, route=None, live=False):
+        self.route = route
+        self.live = live
+        self.queries = 0
+        self.seconds = 0.0
+
+
+_scope = ContextVar('metrics_scope', default=None)
+
+
+def _track_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        scope = _scope.get()
+        if scope is not None:
+            scope.queries += 1
+            scope.seconds += elapsed
+        if scope is None or scope.live:
+            route = scope.route if scope is not None else 'background'
+            DB_QUERIES.inc(route)
+            DB_SECONDS.inc(route, amount=elapsed)
+
+
+def _install(connection, **kwargs):
+    if _track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_query)
+
+
+connection_created.connect(_install)
+for _connection in connections.all(initialized_only=True):
+    _install(_connection)
+
+
+# ── Caches and channel layer ──────────────────────────────────────────────
+
+def cache_lookup(cache_name, hit):
+    CACHE_LOOKUPS.inc(cache_name, 'hit' if hit else 'miss')
+
+
+async def group_send(group, message):
+    """channel_layer.group_send(), timed under the group's kind (``chat``, ``user``, ...)."""
+    started = time.perf_counter()
+    try:
+        await get_channel_layer().group_send(group, message)
+    finally:
+        GROUP_SEND_SECONDS.observe(time.perf_counter() - started, group.split('_', 1)[0])
+
+
+# ── HTTP ──────────────────────────────────────────────────────────────────
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.route or '/'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_budget = getattr(settings, 'METRICS_QUERY_BUDGET', None)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        scope, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _scope.reset(token)
+        self._finish(request, response, scope, started)
+        return response
+
+    async def __acall__(self, request):
+        scope, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _scope.reset(token)
+        self._finish(request, response, scope, started)
+        return response
+
+    @staticmethod
+    def _start():
+        scope = Scope()
+        return scope, _scope.set(scope), time.perf_counter()
+
+    def _finish(self, request, response, scope, started):
+        elapsed = time.perf_counter() - started
+        route = _route(request)
+        REQUEST_SECONDS.observe(elapsed, route, request.method)
+        REQUESTS.inc(route, request.method, response.status_code)
+        REQUEST_QUERIES.observe(scope.queries, route)
+        DB_QUERIES.inc(route, amount=scope.queries)
+        DB_SECONDS.inc(route, amount=scope.seconds)
+        if self.query_budget is not None and scope.queries > self.query_budget:
+            logger.warning(
+                '%s %s ran %d queries (%.1f ms), over the budget of %d',
+                request.method, request.path, scope.queries, scope.seconds * 1000, self.query_budget,
+            )
+
+
+def metrics_view(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        # Route and query counts are not for the public: without a token the
+        # endpoint only exists on a DEBUG run.
+        if not settings.DEBUG:
+            raise Http404
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ── WebSocket ─────────────────────────────────────────────────────────────
+
+class WebSocketMetrics:
+    """
+    ASGI wrapper for the socket router: counts open connections and frames
+    per consumer, and charges the consumer's queries to ``ws:<Consumer>``.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def consumer_name(self, path):
+        for route in self.routes:
+            if route.pattern.match(path.lstrip('/')):
+                consumer = getattr(route.callback, 'consumer_class', route.callback)
+                return getattr(consumer, '__name__', 'unknown')
+        return 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.app(scope, receive, send)
+
+        name = self.consumer_name(scope['path'])
+        token = _scope.set(Scope(f'ws:{name}', live=True))
+        is_open = False
+
+        async def counting_receive():
+            message = await receive()
+            if message['type'] == 'websocket.receive':
+                WS_MESSAGES.inc(name, 'in')
+            return message
+
+        async def counting_send(message):
+            nonlocal is_open
+            if message['type'] == 'websocket.accept' and not is_open:
+                is_open = True
+                WS_CONNECTIONS.inc(name)
+            elif message['type'] == 'websocket.send':
+                WS_MESSAGES.inc(name, 'out')
+            await send(message)
+
+        try:
+            return await self.app(scope, counting_receive, counting_send)
+        finally:
+            if is_open:
+                WS_CONNECTIONS.dec(name)
+            _scope.reset(token)
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import django
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
@@ -21,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'channels',
+    'lostfound',
     'items',
     'messaging',
     'cloudinary',
@@ -38,6 +40,9 @@ cloudinary.config(
 )
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 MIDDLEWARE = [
+    # First, so its latency and query counts cover every other middleware
+    'lostfound.metrics.MetricsMiddleware',
+    'lostfound.database.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,12 +73,60 @@ TEMPLATES = [
 # Django Channels ASGI configuration
 ASGI_APPLICATION = 'lostfound.asgi.application'
 
-# Channel Layers — In-Memory (no Redis needed for development)
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+# Channel Layers — shared by every Daphne worker so group_send() reaches all of them.
+# With REDIS_URL set, use channels_redis (pip install channels-redis) for multi-host
+# deployments; otherwise workers on one host share a local SQLite broker file.
+CHANNEL_LAYER_CAPACITY = int(os.environ.get('CHANNEL_LAYER_CAPACITY', 100))
+CHANNEL_LAYER_EXPIRY = int(os.environ.get('CHANNEL_LAYER_EXPIRY', 60))
+
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.environ['REDIS_URL']],
+                'capacity': CHANNEL_LAYER_CAPACITY,
+                'expiry': CHANNEL_LAYER_EXPIRY,
+            },
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'messaging.layers.SQLiteChannelLayer',
+            'CONFIG': {
+                'path': os.environ.get('CHANNEL_LAYER_PATH', BASE_DIR / 'channels.sqlite3'),
+                'capacity': CHANNEL_LAYER_CAPACITY,
+                'expiry': CHANNEL_LAYER_EXPIRY,
+            },
+        }
+    }
+
+# ChatConsumer write coalescing (messaging/ingest.py): flush after this many
+# queued messages or this many seconds, whichever comes first.
+CHAT_INGEST_MAX_BATCH = 50
+CHAT_INGEST_MAX_DELAY = 0.005
+
+# Read receipts (messaging/receipts.py): how long socket read reports are
+# held before the highest per participant is written, in seconds.
+CHAT_READ_FLUSH_DELAY = 0.5
+
+# Multiplexed socket (messaging.consumers.MultiplexConsumer): conversation
+# streams per socket, the most events a stream may have in flight, and how
+# many more are queued for it before it is told to refetch instead.
+CHAT_MUX_MAX_STREAMS = 32
+CHAT_MUX_WINDOW = 64
+CHAT_MUX_BACKLOG = 256
+# Batched mode (the "lf.batch" subprotocol): events are gathered for this many
+# seconds and sent as one frame. A subscription resuming from an ``after`` id
+# is sent up to this many missed messages before live events.
+CHAT_MUX_TICK = 0.025
+CHAT_MUX_CATCHUP_LIMIT = 200
+
+# permessage-deflate on Daphne's sockets (lostfound/websocket.py) for clients
+# that offer it; None turns it off. Smaller windows/memory levels cost some
+# ratio but keep each connection's zlib state small.
+WEBSOCKET_DEFLATE = {'window_bits': 12, 'mem_level': 5}
 
 WSGI_APPLICATION = 'lostfound.wsgi.application'
 
@@ -81,8 +134,93 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests / chat DB executor calls
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {},
+        # A file rather than SQLite's shared in-memory database, whose table
+        # locks fail the chat DB executor's threads instead of waiting
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
+if django.VERSION >= (5, 1):
+    # Take the write lock when a transaction starts, so a transaction that
+    # reads then writes waits on busy_timeout instead of failing "locked".
+    DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+# Read alias for home, search and item detail (lostfound/database.py): here a
+# read-only connection to the same SQLite file. With PostgreSQL, point
+# 'default' at the primary and list the replica aliases instead.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+    'OPTIONS': {},
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['lostfound.database.PrimaryReplicaRouter']
+DATABASE_READ_ALIASES = ['replica']
+# After a write, that browser reads from 'default' for this many seconds
+DATABASE_REPLICA_PIN_SECONDS = 5
+
+# Applied to every new SQLite connection (lostfound/database.py)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -65536,      # KiB, i.e. 64 MiB per connection
+    'mmap_size': 268435456,    # 256 MiB
+    'temp_store': 'MEMORY',
+}
+
+# Chat DB executor (messaging/db.py): worker threads, each holding a persistent
+# connection, and how many calls may queue before sockets get a "busy" reply.
+CHAT_DB_WORKERS = 8
+CHAT_DB_MAX_PENDING = 100
+
+# Worker processes serving the site (most hosts set WEB_CONCURRENCY).
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Shared cache for the item pages (items/caching.py) and the unread badge.
+# LocMem is per-process; point CACHE_BACKEND/CACHE_LOCATION at Redis or
+# Memcached when running several workers. Until then, with WEB_CONCURRENCY
+# above 1 those features read the database instead (lostfound/cache.py).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'unifound'),
+    }
+}
+
+# /metrics (lostfound/metrics.py): the bearer token scrapers must send (the
+# endpoint is a 404 without one unless DEBUG is on), and a per-request query
+# count above which requests are logged as warnings.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_QUERY_BUDGET = int(os.environ['METRICS_QUERY_BUDGET']) if os.environ.get('METRICS_QUERY_BUDGET') else None
+
+# Anonymous whole-page cache lifetime for home, search and item detail.
+ITEMS_VIEW_CACHE_TIMEOUT = 300
+
+# Item photo pipeline (items/images.py): uploads are staged under
+# MEDIA_ROOT/staging and resized/transcoded on a background thread pool,
+# then saved to this storage class (FileSystemStorage works for local runs).
+# The staging directory (ITEMS_IMAGE_STAGING_DIR to move it) must be shared by
+# all web workers. A worker's claim on a pending upload is trusted for
+# ITEMS_IMAGE_CLAIM_TIMEOUT seconds, after which process_pending_images may
+# take it over.
+ITEMS_IMAGE_STORAGE = os.environ.get('ITEMS_IMAGE_STORAGE', DEFAULT_FILE_STORAGE)
+ITEMS_IMAGE_WORKERS = 2
+ITEMS_IMAGE_CLAIM_TIMEOUT = 600
+
+# Lost <-> Found matching (items/matching.py): pairs kept per item, and how
+# many LSH bucket candidates are re-scored to pick them. ITEMS_MATCH_SYNC runs
+# the matcher in the saving thread instead of its background thread; tests
+# that commit turn it on so no match is still running when their data is flushed.
+ITEMS_MATCH_TOP_K = 5
+ITEMS_MATCH_CANDIDATES = 50
+ITEMS_MATCH_SYNC = False
+
+# Chat archival (messaging/archive.py): days after an item is marked Returned
+# before `manage.py archive_messages` moves its chat history to the archive.
+MESSAGING_ARCHIVE_AFTER_DAYS = 30
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from items.models import Item
+from . import database, websocket
+
+
+class MetricsViewTests(SimpleTestCase):
+    @override_settings(METRICS_TOKEN='', DEBUG=False)
+    def test_hidden_without_a_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    @override_settings(METRICS_TOKEN='', DEBUG=True)
+    def test_open_on_a_debug_run(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer nope').status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertContains(response, '# TYPE')
+
+
+class SQLitePragmaTests(SimpleTestCase):
+    # Both connections are to a scratch file, not the test database
+    databases = {'default', 'replica'}
+
+    def test_read_only_alias_on_a_rollback_journal_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'db.sqlite3')
+            with closing(sqlite3.connect(path)) as setup:
+                setup.execute('CREATE TABLE t (x)')
+            base = connections['default'].settings_dict
+            primary = DatabaseWrapper({**base, 'NAME': path}, alias='default')
+            replica = DatabaseWrapper({**base, 'NAME': f'file:{path}?mode=ro'}, alias='replica')
+            try:
+                with mock.patch.object(database, 'connections', {'default': primary}):
+                    with replica.cursor() as cursor:
+                        cursor.execute('SELECT count(*) FROM t')
+                        self.assertEqual(cursor.fetchone(), (0,))
+                with primary.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone(), ('wal',))
+            finally:
+                replica.close()
+                primary.close()
+
+
+
+class ReadRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = database.PrimaryReplicaRouter()
+
+    @staticmethod
+    @database.read_from_replica
+    def view(request):
+        # Which alias an item read would go to
+        return HttpResponse(Item.objects.all().db)
+
+    def test_router(self):
+        self.assertEqual(self.router.db_for_read(Item), 'default')
+        with database.replica_reads():
+            self.assertEqual(self.router.db_for_read(Item), 'replica')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Item), 'default')
+        self.assertEqual(self.router.db_for_read(Item), 'default')
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.view(self.factory.get('/')).content, b'replica')
+        self.assertEqual(self.view(self.factory.post('/')).content, b'default')
+
+    def test_pinned_after_a_write(self):
+        middleware = database.ReplicaPinMiddleware(lambda request: HttpResponse())
+        self.assertNotIn(database.PIN_COOKIE, middleware(self.factory.get('/')).cookies)
+        cookie = middleware(self.factory.post('/')).cookies[database.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+
+        request = self.factory.get('/')
+        request.COOKIES[database.PIN_COOKIE] = cookie.value
+        self.assertEqual(self.view(request).content, b'default')
+
+    @override_settings(DATABASE_READ_ALIASES=[])
+    def test_no_read_aliases(self):
+        middleware = database.ReplicaPinMiddleware(lambda request: HttpResponse())
+        self.assertNotIn(database.PIN_COOKIE, middleware(self.factory.post('/')).cookies)
+        self.assertEqual(self.view(self.factory.get('/')).content, b'default')
+
+
+class WebSocketDeflateTests(SimpleTestCase):
+    def install(self, version):
+        try:
+            import daphne
+            from daphne import server, ws_protocol
+        except ImportError:
+            self.skipTest('Daphne is not installed')
+        with mock.patch.object(server, 'WebSocketFactory', ws_protocol.WebSocketFactory), \
+                mock.patch.object(daphne, '__version__', version):
+            websocket.install()
+            return server.WebSocketFactory is not ws_protocol.WebSocketFactory
+
+    def test_patched_on_a_known_daphne(self):
+        self.assertTrue(self.install('4.2.3'))
+
+    def test_left_alone_on_an_unknown_daphne(self):
+        with self.assertLogs('lostfound.websocket', 'WARNING'):
+            self.assertFalse(self.install('5.0.0'))
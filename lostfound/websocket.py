@@ -0,0 +1,72 @@
+"""
+permessage-deflate for Daphne's WebSocket server.
+
+Daphne runs autobahn, which implements permessage-deflate (RFC 7692) but
+only uses it when the server factory is given an accept policy, and Daphne
+never passes one. With WEBSOCKET_DEFLATE set, the factory Daphne builds is
+swapped for one that accepts the client's deflate offer, so browsers that
+offer it get compressed frames and the rest are served as before. The
+window and memory level bound each connection's zlib state.
+
+Daphne has no hook for this, so the swap relies on how daphne.server builds
+its factory. It is only made on the Daphne releases in DAPHNE_VERSIONS
+(requirements.txt pins the same range); on any other the server runs
+without compression and a warning is logged.
+"""
+import logging
+import re
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# [from, to) Daphne releases whose Server builds ws_protocol.WebSocketFactory
+# and then calls setProtocolOptions() on it
+DAPHNE_VERSIONS = ((4, 0), (5, 0))
+
+
+def accept_deflate(offers, window_bits=None, mem_level=None):
+    from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            if window_bits is not None and offer.request_max_window_bits:
+                window_bits = min(window_bits, offer.request_max_window_bits)
+            return PerMessageDeflateOfferAccept(
+                offer,
+                # Ask the client to compress with the same window, bounding our inflate state too
+                request_max_window_bits=window_bits if window_bits and offer.accept_max_window_bits else 0,
+                window_bits=window_bits,
+                mem_level=mem_level,
+            )
+    return None
+
+
+def install():
+    """Make the Daphne server in this process negotiate permessage-deflate."""
+    options = getattr(settings, 'WEBSOCKET_DEFLATE', None)
+    if options is None:
+        return
+    try:
+        import daphne
+        from daphne import server, ws_protocol
+    except ImportError:
+        return
+    if getattr(server.WebSocketFactory, 'deflate_options', None) is not None:
+        return
+    match = re.match(r'(\d+)\.(\d+)', getattr(daphne, '__version__', ''))
+    version = tuple(map(int, match.groups())) if match else None
+    supported = version is not None and DAPHNE_VERSIONS[0] <= version < DAPHNE_VERSIONS[1]
+    if not supported or server.WebSocketFactory is not ws_protocol.WebSocketFactory:
+        logger.warning('WebSocket compression is off: Daphne %s is not a release it was written for.',
+                       getattr(daphne, '__version__', 'unknown'))
+        return
+
+    class DeflateWebSocketFactory(server.WebSocketFactory):
+        deflate_options = options
+
+        def setProtocolOptions(self, **kwargs):
+            kwargs.setdefault('perMessageCompressionAccept', lambda offers: accept_deflate(offers, **options))
+            super().setProtocolOptions(**kwargs)
+
+    server.WebSocketFactory = DeflateWebSocketFactory
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Conversation, Message
+from .models import Conversation, Message, MessageArchive
 
 
 @admin.register(Conversation)
@@ -10,10 +10,16 @@ class ConversationAdmin(admin.ModelAdmin):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ['sender', 'conversation', 'content_preview', 'timestamp', 'is_read']
-    list_filter = ['is_read']
+    list_display = ['sender', 'conversation', 'content_preview', 'timestamp']
     search_fields = ['sender__username', 'content']
 
     def content_preview(self, obj):
         return obj.content[:50]
     content_preview.short_description = 'Message'
+
+
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ['conversation', 'first_id', 'last_id', 'count', 'archived_at']
+    raw_id_fields = ['conversation']
+    exclude = ['data']
@@ -0,0 +1,131 @@
+"""
+Archival of chat history for closed items.
+
+Once an item has been Returned for MESSAGING_ARCHIVE_AFTER_DAYS days, the
+messages of its conversations are moved out of messaging_message into
+MessageArchive segments: zlib-compressed JSON, up to SEGMENT_SIZE messages
+each. Conversations keep their newest message as a live row, so the inbox
+preview and last_message pointer are unchanged, and people can still write
+in an archived conversation; the next run picks those messages up too.
+
+Archived messages are read back as unsaved Message instances, so chat_room
+and the history endpoint render them like any other page. Every archived id
+is lower than the conversation's remaining rows, so the same ``before=<id>``
+cursor pages from live rows into the archive.
+
+Run `python manage.py archive_messages` periodically (cron, a scheduler).
+"""
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Conversation, Message, MessageArchive
+
+SEGMENT_SIZE = 500
+
+# Shown as the sender of archived messages whose account no longer exists
+DELETED_SENDER = 'deleted user'
+
+
+def archive_after_days():
+    return getattr(settings, 'MESSAGING_ARCHIVE_AFTER_DAYS', 30)
+
+
+def encode(messages):
+    rows = [
+        [m.id, m.sender_id, m.content, m.timestamp.isoformat()]
+        for m in messages
+    ]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 9)
+
+
+def decode(data):
+    """
+    The ``[id, sender_id, content, timestamp]`` rows of a segment, oldest first.
+    Segments written before read watermarks carry a trailing is_read, which is ignored.
+    """
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def candidates(days=None):
+    """Ids of conversations whose item was closed ``days`` ago and which have messages to archive."""
+    cutoff = timezone.now() - timedelta(days=archive_after_days() if days is None else days)
+    return (
+        Message.objects.filter(
+            conversation__item__status='Returned',
+            conversation__item__closed_at__lt=cutoff,
+        )
+        .exclude(id=F('conversation__last_message_id'))
+        .values_list('conversation_id', flat=True)
+        .order_by()
+        .distinct()
+    )
+
+
+def archive_conversation(conversation_id):
+    """
+    Move every message older than the conversation's last message into
+    archive segments. Returns how many were moved.
+    """
+    with transaction.atomic():
+        conv = Conversation.objects.select_for_update().filter(pk=conversation_id).first()
+        if conv is None or conv.last_message_id is None:
+            return 0
+        msgs = list(
+            Message.objects.filter(conversation_id=conversation_id, id__lt=conv.last_message_id)
+            .order_by('id')
+        )
+        if not msgs:
+            return 0
+        MessageArchive.objects.bulk_create([
+            MessageArchive(
+                conversation_id=conversation_id,
+                first_id=chunk[0].id,
+                last_id=chunk[-1].id,
+                count=len(chunk),
+                data=encode(chunk),
+            )
+            for chunk in (msgs[i:i + SEGMENT_SIZE] for i in range(0, len(msgs), SEGMENT_SIZE))
+        ])
+        ids = [m.id for m in msgs]
+        for start in range(0, len(ids), SEGMENT_SIZE):
+            Message.objects.filter(pk__in=ids[start:start + SEGMENT_SIZE]).delete()
+    return len(msgs)
+
+
+def history(conversation_id, before_id=None, limit=50):
+    """
+    Up to ``limit`` archived messages older than ``before_id``, oldest first,
+    as unsaved Message instances, plus whether there are more before them.
+    """
+    segments = MessageArchive.objects.filter(conversation_id=conversation_id)
+    if before_id is not None:
+        segments = segments.filter(first_id__lt=before_id)
+    rows = []
+    for segment in segments.order_by('-last_id').only('data').iterator(chunk_size=4):
+        rows.extend(
+            row for row in reversed(decode(segment.data))
+            if before_id is None or row[0] < before_id
+        )
+        if len(rows) > limit:
+            break
+    has_more = len(rows) > limit
+    rows = rows[:limit][::-1]
+    if not rows:
+        return [], has_more
+
+    senders = User.objects.only('id', 'username').in_bulk({row[1] for row in rows})
+    return [
+        Message(
+            id=pk, conversation_id=conversation_id,
+            sender=senders.get(sender_id) or User(id=sender_id, username=DELETED_SENDER),
+            content=content, timestamp=datetime.fromisoformat(timestamp),
+        )
+        for pk, sender_id, content, timestamp, *_ in rows
+    ], has_more
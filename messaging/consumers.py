@@ -1,7 +1,84 @@
+import asyncio
 import json
+import logging
+from collections import deque
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from lostfound import metrics
+from . import membership, notifications
+from .db import Saturated, chat_db
+from .ingest import get_ingest
 from .models import Conversation, Message
+from .receipts import get_tracker, receipt_event
+
+logger = logging.getLogger(__name__)
+
+
+async def post_message(conversation, user, content, client_key=None):
+    """
+    Save a message, then broadcast it to the conversation and notify the
+    recipient. Returns (chat_message event, duplicate): a resend of an
+    already saved client_key gets the earlier message's event and broadcasts
+    nothing, so the caller echoes it to the sender alone. Raises Saturated,
+    having saved nothing, when the chat DB is backed up, and membership.Gone
+    when the conversation has been deleted.
+    """
+    # ✅ ALWAYS save to DB first — recipient gets it even if offline.
+    # The ingest pipeline batches this with other sockets' messages and
+    # returns once the write (including the updated_at bump) has committed.
+    try:
+        msg, notification = await get_ingest().submit(conversation, user, content, client_key)
+    except IntegrityError:
+        if await membership.agone(conversation.pk):
+            raise membership.Gone() from None
+        raise
+    event = chat_message_event(msg, user)
+    if msg.duplicate:
+        return event, True
+
+    # Then broadcast to anyone currently online in the room
+    await metrics.group_send(f'chat_{conversation.pk}', event)
+    # Badge + toast on every page the recipient has open
+    await notifications.apush(*notification)
+    return event, False
+
+
+def chat_message_event(msg, sender):
+    return {
+        'type': 'chat_message',
+        'conversation_id': msg.conversation_id,
+        'message': msg.content,
+        'sender_id': sender.id,
+        'sender_username': sender.username,
+        'timestamp': msg.timestamp.strftime('%H:%M'),
+        'message_id': msg.id,
+        'client_key': msg.client_key,
+    }
+
+
+def chat_message_payload(event, user_id):
+    payload = {
+        'message': event['message'],
+        'sender_id': event['sender_id'],
+        'sender_username': event['sender_username'],
+        'timestamp': event['timestamp'],
+        'message_id': event['message_id'],
+        'is_own': event['sender_id'] == user_id,
+    }
+    if payload['is_own'] and event.get('client_key'):
+        # Lets the sender match the echo to the send it is waiting on
+        payload['client_key'] = event['client_key']
+    return payload
+
+
+def read_position(data):
+    """The last_read_id of a read report, or None if it isn't a valid one."""
+    try:
+        return int(data['last_read_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -14,78 +91,53 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        is_participant = await self.check_participant()
-        if not is_participant:
+        # Served from the process-local membership cache after the first connect.
+        # The stub is all post_message() needs; the page load has already
+        # advanced the read watermark.
+        self.conversation = await membership.aconversation_stub(self.conversation_id)
+        if self.conversation is None or self.user.id not in (
+            self.conversation.participant1_id, self.conversation.participant2_id,
+        ):
             await self.close()
             return
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
-        await self.mark_messages_read()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if data.get('type') == 'read':
+            # Debounced; written and broadcast as a read_receipt by messaging/receipts.py
+            last_read_id = read_position(data)
+            if last_read_id is not None:
+                get_tracker().report(self.conversation_id, self.user.id, last_read_id)
+            return
+
         content = data.get('message', '').strip()
         if not content:
             return
 
-        # ✅ ALWAYS save to DB first — recipient gets it even if offline
-        message = await self.save_message(content)
-
-        # Then broadcast to anyone currently online in the room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': content,
-                'sender_id': self.user.id,
-                'sender_username': self.user.username,
-                'timestamp': message['timestamp'],
-                'message_id': message['id'],
-            }
-        )
+        key = Message.clean_client_key(data.get('client_key'))
+        try:
+            event, duplicate = await post_message(self.conversation, self.user, content, key)
+        except Saturated:
+            # Not saved: hand it back so the client can retry shortly
+            await self.send(text_data=json.dumps({'error': 'busy', 'message': content, 'client_key': key}))
+            return
+        except membership.Gone:
+            await self.close()
+            return
+        if duplicate:
+            await self.chat_message(event)
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'message': event['message'],
-            'sender_id': event['sender_id'],
-            'sender_username': event['sender_username'],
-            'timestamp': event['timestamp'],
-            'message_id': event['message_id'],
-            'is_own': event['sender_id'] == self.user.id,
-        }))
-
-    @database_sync_to_async
-    def check_participant(self):
-        try:
-            conv = Conversation.objects.get(id=self.conversation_id)
-            return self.user in [conv.participant1, conv.participant2]
-        except Conversation.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def save_message(self, content):
-        conv = Conversation.objects.get(id=self.conversation_id)
-        msg = Message.objects.create(
-            conversation=conv,
-            sender=self.user,
-            content=content,
-            # is_read=False by default — recipient will see it when they open chat
-        )
-        conv.save()  # bump updated_at so inbox sorts correctly
-        return {
-            'id': msg.id,
-            'timestamp': msg.timestamp.strftime('%H:%M'),
-        }
+        await self.send(text_data=json.dumps(chat_message_payload(event, self.user.id)))
 
-    @database_sync_to_async
-    def mark_messages_read(self):
-        Conversation.objects.get(id=self.conversation_id).messages.filter(
-            is_read=False
-        ).exclude(sender=self.user).update(is_read=True)
+    async def read_receipt(self, event):
+        await self.send(text_data=json.dumps(event))
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
@@ -116,4 +168,316 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     async def send_notification(self, event):
         await self.send(text_data=json.dumps({
             "message": event["message"]
-        }))
\ No newline at end of file
+        }))
+
+    async def new_message(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def unread_count(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def item_match(self, event):
+        await self.send(text_data=json.dumps(event))
+
+
+class Stream:
+    """One subscription on a MultiplexConsumer: its send credit and the events waiting for it."""
+
+    def __init__(self, stream_id, conversation, window):
+        self.id = stream_id
+        self.conversation = conversation
+        # Negotiated at "sub": the most credit the stream ever holds
+        self.window = window
+        self.credit = window
+        self.backlog = deque()
+        self.lagging = False
+        # Newest chat message sent on this stream, where a client that lagged resumes from
+        self.last_message_id = 0
+        # Live events held back while a catch-up batch is being sent
+        self.held = None
+
+
+class MultiplexConsumer(AsyncWebsocketConsumer):
+    """
+    One socket per user for every open chat and the notification feed.
+
+    Frames are compact JSON arrays ``[op, stream_id, arg]``. Stream 0 is the
+    user's notifications and is open from the start; the client opens one
+    stream per conversation under an id of its choosing.
+
+    Client → server:
+      ["sub", id, {"conversation": 12, "window": 32, "after": 340}]
+                                                         open a conversation stream; with
+                                                         "after", first send what was missed
+      ["unsub", id]
+      ["msg", id, {"message": "...", "client_key": "..."}]
+                                                         send a message (stored once per key)
+      ["read", id, {"last_read_id": 345}]               report what has been displayed
+      ["credit", id, 16]                                 allow 16 more events on a stream
+    Server → client:
+      ["ok", id]                  subscribed
+      ["ev", id, {...}]           an event, shaped as ChatConsumer / NotificationConsumer send it
+      ["err", id, {"error": ...}]
+      ["lag", id, {"after": 345}] events were dropped; refetch messages after this id
+
+    Flow control: each stream may be sent as many events as it has credit
+    (its window, at most CHAT_MUX_WINDOW, then whatever the client grants,
+    never holding more than that window).
+    Events beyond that queue per stream; past CHAT_MUX_BACKLOG the queue is
+    dropped and the stream is marked lagging, so one stalled chat can't grow
+    the worker's memory or hold up the others.
+
+    A client that offers the ``lf.batch`` subprotocol gets batched mode:
+    frames produced within CHAT_MUX_TICK seconds of each other are sent as
+    one JSON array of frames, so a busy room or a catch-up costs one
+    WebSocket frame per tick rather than one per event.
+    """
+    NOTIFICATIONS = 0
+    BATCH_SUBPROTOCOL = 'lf.batch'
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.window = getattr(settings, 'CHAT_MUX_WINDOW', 64)
+        self.backlog_limit = getattr(settings, 'CHAT_MUX_BACKLOG', 256)
+        self.max_streams = getattr(settings, 'CHAT_MUX_MAX_STREAMS', 32)
+        self.catchup_limit = getattr(settings, 'CHAT_MUX_CATCHUP_LIMIT', 200)
+        self.tick = getattr(settings, 'CHAT_MUX_TICK', 0.025)
+        self.batching = self.BATCH_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        self.outbox = []
+        self.flush_task = None
+        self.streams = {self.NOTIFICATIONS: Stream(self.NOTIFICATIONS, None, self.window)}
+        # conversation id -> stream, for routing the chat groups' events
+        self.conversations = {}
+
+        self.user_group = notifications.user_group(self.user.id)
+        await self.channel_layer.group_add(self.user_group, self.channel_name)
+        await self.accept(self.BATCH_SUBPROTOCOL if self.batching else None)
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'user_group'):
+            return
+        if self.flush_task is not None:
+            # The socket is gone: drop the unsent frames, but don't leave the task behind
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+        await self.channel_layer.group_discard(self.user_group, self.channel_name)
+        for conversation_id in self.conversations:
+            await self.channel_layer.group_discard(f'chat_{conversation_id}', self.channel_name)
+
+    async def send_frame(self, *frame):
+        if not self.batching:
+            await self.send(text_data=json.dumps(frame, separators=(',', ':')))
+            return
+        self.outbox.append(frame)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_outbox())
+            self.flush_task.add_done_callback(self.flush_done)
+
+    async def flush_outbox(self):
+        """Send the frames queued within each tick as one message, until none are left."""
+        try:
+            while self.outbox:
+                await asyncio.sleep(self.tick)
+                frames, self.outbox = self.outbox, []
+                await self.send(text_data=json.dumps(frames, separators=(',', ':')))
+        finally:
+            self.flush_task = None
+
+    def flush_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Could not send batched frames to %s', self.channel_name, exc_info=task.exception())
+
+    async def receive(self, text_data):
+        try:
+            op, stream_id, *rest = json.loads(text_data)
+        except (TypeError, ValueError):
+            return
+        handler = getattr(self, f'op_{op}', None) if isinstance(op, str) else None
+        if handler is None or not isinstance(stream_id, int):
+            await self.send_frame('err', stream_id, {'error': 'bad frame'})
+            return
+        await handler(stream_id, rest[0] if rest else None)
+
+    # ── Client ops ───────────────────────────────────────────────────────
+
+    async def op_sub(self, stream_id, arg):
+        if stream_id in self.streams:
+            await self.send_frame('err', stream_id, {'error': 'stream in use'})
+            return
+        if len(self.streams) > self.max_streams:
+            await self.send_frame('err', stream_id, {'error': 'too many streams'})
+            return
+        try:
+            conversation_id = int(arg['conversation'])
+            window = max(1, min(int(arg.get('window', self.window)), self.window))
+            after = int(arg['after']) if arg.get('after') is not None else None
+        except (KeyError, TypeError, ValueError):
+            await self.send_frame('err', stream_id, {'error': 'bad frame'})
+            return
+        if conversation_id in self.conversations:
+            await self.send_frame('err', stream_id, {'error': 'already subscribed'})
+            return
+
+        # The same membership check as ChatConsumer.connect, without a new socket
+        conversation = await membership.aconversation_stub(conversation_id)
+        if conversation is None or self.user.id not in (conversation.participant1_id, conversation.participant2_id):
+            await self.send_frame('err', stream_id, {'error': 'forbidden'})
+            return
+
+        stream = self.streams[stream_id] = Stream(stream_id, conversation, window)
+        self.conversations[conversation_id] = stream
+        if after is not None:
+            stream.held = []
+        await self.channel_layer.group_add(f'chat_{conversation_id}', self.channel_name)
+        await self.send_frame('ok', stream_id)
+        if after is not None:
+            await self.catch_up(stream, after)
+
+    async def op_unsub(self, stream_id, arg):
+        stream = self.streams.get(stream_id)
+        if stream is None or stream.conversation is None:
+            return
+        del self.streams[stream_id]
+        del self.conversations[stream.conversation.pk]
+        await self.channel_layer.group_discard(f'chat_{stream.conversation.pk}', self.channel_name)
+
+    async def op_msg(self, stream_id, arg):
+        stream = self.streams.get(stream_id)
+        if stream is None or stream.conversation is None or not isinstance(arg, dict):
+            return
+        content = str(arg.get('message', '')).strip()
+        if not content:
+            return
+        key = Message.clean_client_key(arg.get('client_key'))
+        try:
+            event, duplicate = await post_message(stream.conversation, self.user, content, key)
+        except Saturated:
+            # Not saved: hand it back so the client can retry shortly
+            await self.send_frame('err', stream_id, {'error': 'busy', 'message': content, 'client_key': key})
+            return
+        except membership.Gone:
+            await self.op_unsub(stream_id, None)
+            await self.send_frame('err', stream_id, {'error': 'not found'})
+            return
+        if duplicate:
+            await self.chat_message(event)
+
+    async def op_read(self, stream_id, arg):
+        stream = self.streams.get(stream_id)
+        last_read_id = read_position(arg) if isinstance(arg, dict) else None
+        if stream is None or stream.conversation is None or last_read_id is None:
+            return
+        get_tracker().report(stream.conversation.pk, self.user.id, last_read_id)
+
+    async def op_credit(self, stream_id, arg):
+        stream = self.streams.get(stream_id)
+        if stream is None or not isinstance(arg, int) or arg <= 0:
+            return
+        stream.credit = min(stream.credit + arg, stream.window)
+        if stream.lagging:
+            stream.lagging = False
+            await self.send_frame('lag', stream.id, {'after': stream.last_message_id})
+            if stream.id == self.NOTIFICATIONS:
+                # The dropped events may have moved the badge; there's nothing to refetch
+                count = await chat_db.run(notifications.unread_total_for, self.user)
+                await self.deliver(stream, {'type': 'unread_count', 'count': count})
+        while stream.credit and stream.backlog:
+            await self.emit(stream, stream.backlog.popleft())
+
+    # ── Delivery ─────────────────────────────────────────────────────────
+
+    async def catch_up(self, stream, after):
+        """
+        Send what the client missed in ``stream``'s conversation since message
+        ``after``, then the live events that arrived meanwhile. Subscribing
+        first and holding live events means nothing falls in between. Stops
+        as soon as the stream is unsubscribed.
+        """
+        try:
+            chat_db.ensure_capacity()
+            missed, receipts = await chat_db.run(self.load_missed, stream.conversation, after, self.catchup_limit)
+        except Saturated:
+            missed, receipts = None, []
+        held, stream.held = stream.held, None
+        if not self.subscribed(stream):
+            return
+
+        if missed is None or len(missed) > self.catchup_limit:
+            # Too much (or no DB capacity) for a socket catch-up; the client refetches over HTTP
+            await self.send_frame('lag', stream.id, {'after': after})
+            missed = []
+        last_id = missed[-1]['message_id'] if missed else after
+        held = [payload for payload in held if payload.get('message_id', last_id + 1) > last_id]
+        for payload in missed + receipts + held:
+            # Each send may let an unsub (or a new sub under the same id) in
+            if not self.subscribed(stream):
+                return
+            await self.deliver(stream, payload)
+
+    def subscribed(self, stream):
+        return self.streams.get(stream.id) is stream
+
+    def load_missed(self, conversation, after, limit):
+        msgs = Message.objects.filter(conversation_id=conversation.pk, id__gt=after).select_related(
+            'sender',
+        ).order_by('id')[:limit + 1]
+        payloads = [
+            {'type': 'chat_message', **chat_message_payload(chat_message_event(m, m.sender), self.user.id)}
+            for m in msgs
+        ]
+        # Where each participant has read up to, for the "Seen" marker
+        watermarks = Conversation.objects.filter(pk=conversation.pk).values_list(
+            'p1_last_read_id', 'p2_last_read_id',
+        ).first() or (0, 0)
+        receipts = [
+            receipt_event(conversation.pk, user_id, last_read_id)
+            for user_id, last_read_id in zip((conversation.participant1_id, conversation.participant2_id), watermarks)
+        ]
+        return payloads, receipts
+
+    async def deliver(self, stream, payload):
+        if stream.held is not None:
+            stream.held.append(payload)
+            return
+        if stream.lagging:
+            return
+        if stream.credit and not stream.backlog:
+            await self.emit(stream, payload)
+        elif len(stream.backlog) < self.backlog_limit:
+            stream.backlog.append(payload)
+        else:
+            stream.backlog.clear()
+            stream.lagging = True
+
+    async def emit(self, stream, payload):
+        stream.credit -= 1
+        stream.last_message_id = payload.get('message_id', stream.last_message_id)
+        await self.send_frame('ev', stream.id, payload)
+
+    # ── Channel layer events ─────────────────────────────────────────────
+
+    async def chat_message(self, event):
+        stream = self.conversations.get(event.get('conversation_id'))
+        if stream is not None:
+            await self.deliver(stream, {'type': 'chat_message', **chat_message_payload(event, self.user.id)})
+
+    async def read_receipt(self, event):
+        stream = self.conversations.get(event.get('conversation_id'))
+        if stream is not None:
+            await self.deliver(stream, event)
+
+    async def send_notification(self, event):
+        await self.deliver(self.streams[self.NOTIFICATIONS], {'message': event['message']})
+
+    async def new_message(self, event):
+        await self.deliver(self.streams[self.NOTIFICATIONS], event)
+
+    async def unread_count(self, event):
+        await self.deliver(self.streams[self.NOTIFICATIONS], event)
+
+    async def item_match(self, event):
+        await self.deliver(self.streams[self.NOTIFICATIONS], event)
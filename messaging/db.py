@@ -0,0 +1,71 @@
+"""
+Dedicated database executor for the chat's async code paths.
+
+channels' database_sync_to_async, and Django's own async ORM methods
+(aget, acreate, ...), run their queries through sync_to_async with
+thread_sensitive=True. Every socket in a Daphne process therefore queues
+behind one thread. ChatConsumer, the ingest pipeline, the membership cache
+and wait_messages run their ORM work here instead. This is a bounded pool
+of CHAT_DB_WORKERS threads; each keeps its own persistent connection for
+up to CONN_MAX_AGE seconds, so throughput grows with concurrent rooms.
+
+When more than CHAT_DB_MAX_PENDING calls are already waiting for a
+thread, ensure_capacity() raises Saturated. Entry points use it to push
+back on clients instead of letting the queue grow without bound.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class Saturated(Exception):
+    """The chat DB executor has more queued work than CHAT_DB_MAX_PENDING allows."""
+
+
+class DBExecutor:
+    def __init__(self, workers=8, max_pending=100):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-db')
+        self._in_flight = 0
+
+    @property
+    def saturated(self):
+        return self._in_flight >= self.workers + self.max_pending
+
+    def ensure_capacity(self):
+        if self.saturated:
+            raise Saturated()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a sync ORM callable on the pool and return its result."""
+        self._in_flight += 1
+        # Carry the caller's context over (like sync_to_async) so the query
+        # metrics charge this work to the request or socket that asked for it.
+        context = contextvars.copy_context()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(context.run, self._call, fn, *args, **kwargs),
+            )
+        finally:
+            self._in_flight -= 1
+
+    @staticmethod
+    def _call(fn, *args, **kwargs):
+        # Same bookkeeping as database_sync_to_async: drop connections that are
+        # past CONN_MAX_AGE or broken, keep healthy ones for the next call.
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+
+chat_db = DBExecutor(
+    workers=getattr(settings, 'CHAT_DB_WORKERS', 8),
+    max_pending=getattr(settings, 'CHAT_DB_MAX_PENDING', 100),
+)
@@ -0,0 +1,107 @@
+"""
+Write-coalescing message persistence for ChatConsumer.
+
+Every socket in a Daphne process submits its messages here instead of
+writing them one by one. Submissions are buffered for up to ``max_delay``
+seconds (or until ``max_batch`` are waiting) and flushed with a single
+ConversationQuerySet.add_messages() call: one bulk INSERT plus one UPDATE
+per conversation. Each submit() resolves only after that transaction has
+committed, so the caller's broadcast doubles as a durable-write ack
+carrying the real message id.
+"""
+import asyncio
+import logging
+import weakref
+
+from django.conf import settings
+
+from .db import chat_db
+from .models import Conversation
+from . import notifications
+
+logger = logging.getLogger(__name__)
+
+
+class MessageIngest:
+    def __init__(self, max_batch=50, max_delay=0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._timer = None
+        # Flushes in flight, kept so they are not garbage collected mid-write
+        self._tasks = set()
+
+    async def submit(self, conversation, sender, content, client_key=None):
+        """
+        Queue a message and wait for it to be committed. Returns (message, notification);
+        for a resend of an already saved client_key that is the earlier message and None.
+        Raises db.Saturated, without queuing anything, when the DB executor is backed up.
+        """
+        chat_db.ensure_capacity()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((conversation, sender, content, client_key, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Message flush failed', exc_info=task.exception())
+
+    async def close(self):
+        """Write whatever is still buffered and wait for every flush in flight, e.g. at shutdown."""
+        self._flush_now()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _flush(self, batch):
+        try:
+            results = await chat_db.run(self._write, [entry[:4] for entry in batch])
+        except Exception as exc:
+            if len(batch) > 1:
+                # Don't let one bad entry (e.g. a deleted conversation) fail its neighbours.
+                for entry in batch:
+                    await self._flush([entry])
+                return
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (*_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _write(entries):
+        msgs = Conversation.objects.add_messages(entries)
+        events = iter(notifications.new_message_events([
+            (conv, msg, sender) for msg, (conv, sender, *_) in zip(msgs, entries) if not msg.duplicate
+        ]))
+        return [(msg, None if msg.duplicate else next(events)) for msg in msgs]
+
+
+_ingests = weakref.WeakKeyDictionary()
+
+
+def get_ingest():
+    """The ingest pipeline for the running event loop (futures cannot cross loops)."""
+    loop = asyncio.get_running_loop()
+    ingest = _ingests.get(loop)
+    if ingest is None:
+        ingest = _ingests[loop] = MessageIngest(
+            max_batch=getattr(settings, 'CHAT_INGEST_MAX_BATCH', 50),
+            max_delay=getattr(settings, 'CHAT_INGEST_MAX_DELAY', 0.005),
+        )
+    return ingest
@@ -0,0 +1,272 @@
+"""
+A channel layer backed by a shared SQLite file.
+
+InMemoryChannelLayer only reaches sockets inside one process, so chat and
+notifications break as soon as there is more than one Daphne worker. This
+layer keeps channel messages and group membership in a small SQLite
+database that every worker on the host opens, so group_send() from one
+worker reaches consumers in all of them without running Redis.
+
+Each process runs a single poller task that fetches pending messages for
+all of its local channels in one query and hands them to the waiting
+receive() calls. group_send() fans out to every member with one batched
+INSERT. Deployments spanning several hosts should use channels_redis
+instead (see CHANNEL_LAYERS in settings.py).
+"""
+import asyncio
+import json
+import random
+import sqlite3
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS channel_message (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        expires REAL NOT NULL,
+        body TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS channel_message_channel_idx ON channel_message (channel, id)',
+    '''CREATE TABLE IF NOT EXISTS channel_group (
+        grp TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        joined REAL NOT NULL,
+        PRIMARY KEY (grp, channel)
+    ) WITHOUT ROWID''',
+]
+
+# SQLite's default limit on host parameters is 999; stay well under it.
+MAX_PARAMS = 500
+
+
+def chunked(seq, size=MAX_PARAMS):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.01,
+        max_poll_interval=0.1,
+        cleanup_interval=30,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.cleanup_interval = cleanup_interval
+
+        # One worker thread owns the connection, so writes from this process are serialized here
+        # and across processes by SQLite's own locking.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+        self._local = threading.local()
+        self._last_cleanup = 0.0
+        self._loop = None
+        self._buffers = {}
+        self._poller = None
+        self._wakeup = None
+
+    # Database access (always on the executor thread)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connection(), *args))
+
+    def _cleanup(self, conn, now):
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        conn.execute('DELETE FROM channel_message WHERE expires < ?', [now])
+        conn.execute('DELETE FROM channel_group WHERE joined < ?', [now - self.group_expiry])
+
+    def _insert(self, conn, channels, body):
+        """Insert ``body`` for every channel still under capacity; returns the channels that were full."""
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._cleanup(conn, now)
+            depth = {}
+            for chunk in chunked(channels):
+                placeholders = ','.join('?' * len(chunk))
+                depth.update(conn.execute(
+                    f'SELECT channel, COUNT(*) FROM channel_message '
+                    f'WHERE channel IN ({placeholders}) AND expires >= ? GROUP BY channel',
+                    [*chunk, now],
+                ).fetchall())
+            full = [c for c in channels if depth.get(c, 0) >= self.get_capacity(c)]
+            conn.executemany(
+                'INSERT INTO channel_message (channel, expires, body) VALUES (?, ?, ?)',
+                [(c, now + self.expiry, body) for c in channels if c not in full],
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return full
+
+    def _fetch(self, conn, channels):
+        # Channel names are unique to this process, so nobody else reads these rows
+        # and the select-then-delete needs no write lock while the channel is idle.
+        now = time.time()
+        rows = []
+        for chunk in chunked(channels):
+            placeholders = ','.join('?' * len(chunk))
+            rows.extend(conn.execute(
+                f'SELECT id, channel, body FROM channel_message '
+                f'WHERE channel IN ({placeholders}) AND expires >= ? ORDER BY id',
+                [*chunk, now],
+            ).fetchall())
+        for chunk in chunked([row[0] for row in rows]):
+            conn.execute(
+                f"DELETE FROM channel_message WHERE id IN ({','.join('?' * len(chunk))})", chunk,
+            )
+        return rows
+
+    def _group_members(self, conn, group):
+        return [row[0] for row in conn.execute(
+            'SELECT channel FROM channel_group WHERE grp = ? AND joined >= ?',
+            [group, time.time() - self.group_expiry],
+        )]
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+
+        full = await self._run(self._insert, [channel], json.dumps(message))
+        if full:
+            raise ChannelFull(channel)
+        self._wake()
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        self._bind_loop()
+
+        queue = self._buffers.setdefault(channel, asyncio.Queue())
+        self._ensure_poller()
+        try:
+            return await queue.get()
+        finally:
+            if queue.empty() and self._buffers.get(channel) is queue:
+                del self._buffers[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        return '%s.sqlite!%s' % (
+            prefix,
+            ''.join(random.choice(string.ascii_letters) for _ in range(12)),
+        )
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO channel_group (grp, channel, joined) VALUES (?, ?, ?)',
+            [group, channel, time.time()],
+        ))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        await self._run(lambda conn: conn.execute(
+            'DELETE FROM channel_group WHERE grp = ? AND channel = ?', [group, channel],
+        ))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+
+        def fan_out(conn):
+            members = self._group_members(conn, group)
+            if members:
+                # Full channels are skipped, as with the in-memory layer.
+                self._insert(conn, members, json.dumps(message))
+            return members
+
+        if await self._run(fan_out):
+            self._wake()
+
+    # Flush extension
+
+    async def flush(self):
+        def clear(conn):
+            conn.execute('DELETE FROM channel_message')
+            conn.execute('DELETE FROM channel_group')
+
+        await self._run(clear)
+        self._buffers = {}
+
+    async def close(self):
+        if self._poller:
+            self._poller.cancel()
+            self._poller = None
+
+    # Local receive loop
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Queues and tasks are bound to one event loop; start fresh on a new one.
+            self._loop = loop
+            self._buffers = {}
+            self._poller = None
+            self._wakeup = asyncio.Event()
+
+    def _wake(self):
+        if self._wakeup is not None and self._loop is asyncio.get_running_loop():
+            self._wakeup.set()
+
+    def _ensure_poller(self):
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+
+    async def _poll(self):
+        interval = self.poll_interval
+        while self._buffers:
+            self._wakeup.clear()
+            rows = await self._run(self._fetch, list(self._buffers))
+            for _, channel, body in rows:
+                queue = self._buffers.get(channel)
+                # None: its receive() was cancelled during the fetch (a long-poll
+                # timing out, say). Recreating the buffer would leak it and keep
+                # this loop polling for a reader that is gone.
+                if queue is not None:
+                    queue.put_nowait(json.loads(body))
+            if rows:
+                interval = self.poll_interval
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+                interval = self.poll_interval
+            except asyncio.TimeoutError:
+                interval = min(interval * 2, self.max_poll_interval)
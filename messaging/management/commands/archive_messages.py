@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from messaging import archive
+
+
+class Command(BaseCommand):
+    help = 'Move messages of conversations about long-returned items into compressed archive segments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Days since the item was returned (default: MESSAGING_ARCHIVE_AFTER_DAYS).',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived.')
+
+    def handle(self, *args, **options):
+        conversation_ids = list(archive.candidates(options['days']))
+        if options['dry_run']:
+            self.stdout.write(f'{len(conversation_ids)} conversation(s) would be archived.')
+            return
+        moved = 0
+        for conversation_id in conversation_ids:
+            moved += archive.archive_conversation(conversation_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} message(s) from {len(conversation_ids)} conversation(s).'
+        ))
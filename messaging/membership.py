@@ -0,0 +1,128 @@
+"""
+Process-local cache of conversation participants for authorization checks.
+
+A conversation's participants never change, so once a conversation's
+(participant1_id, participant2_id) pair is known, every "is this user in
+this chat?" check on the socket connect, poll and long-poll paths can be
+answered from memory. Entries expire after MEMBERSHIP_CACHE_TTL seconds, the
+least recently used are evicted past MEMBERSHIP_CACHE_SIZE, and a
+Conversation post_delete signal drops its entry (see messaging/signals.py).
+That signal only reaches the worker process that deleted the row, so a
+write that fails on the conversation's foreign key asks gone() whether the
+row was deleted elsewhere.
+
+The cache is keyed by conversation rather than by (conversation, user): one
+entry answers the check for both participants, and it also carries the ids
+that the POST path needs to save a message without loading the row.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from lostfound import metrics
+
+from .db import chat_db
+from .models import Conversation
+
+_MISSING = object()
+
+
+class ParticipantCache:
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        """The cached (participant1_id, participant2_id) pair, or _MISSING."""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return _MISSING
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[conversation_id]
+                return _MISSING
+            self._entries.move_to_end(conversation_id)
+            return value
+
+    def set(self, conversation_id, value):
+        with self._lock:
+            self._entries[conversation_id] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = ParticipantCache(
+    maxsize=getattr(settings, 'MEMBERSHIP_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'MEMBERSHIP_CACHE_TTL', 300),
+)
+
+
+def participants(conversation_id):
+    """(participant1_id, participant2_id) for a conversation, or None if it does not exist."""
+    conversation_id = int(conversation_id)
+    value = cache.get(conversation_id)
+    metrics.cache_lookup('membership', value is not _MISSING)
+    if value is _MISSING:
+        value = Conversation.objects.filter(pk=conversation_id).values_list(
+            'participant1_id', 'participant2_id',
+        ).first()
+        if value is not None:
+            # Misses aren't cached, so a conversation created a moment later is still found.
+            cache.set(conversation_id, value)
+    return value
+
+
+async def aparticipants(conversation_id):
+    """participants() without a thread hop when the entry is cached."""
+    value = cache.get(int(conversation_id))
+    if value is _MISSING:
+        # participants() records the miss
+        value = await chat_db.run(participants, conversation_id)
+    else:
+        metrics.cache_lookup('membership', True)
+    return value
+
+
+class Gone(Exception):
+    """The conversation was deleted (by another worker) after its participants were cached."""
+
+
+def gone(conversation_id):
+    """Drop the cached entry and report whether the conversation no longer exists."""
+    cache.invalidate(int(conversation_id))
+    return participants(conversation_id) is None
+
+
+async def agone(conversation_id):
+    return await chat_db.run(gone, conversation_id)
+
+
+def conversation_stub(conversation_id):
+    """
+    An unsaved Conversation carrying only the pk and participant ids — enough
+    for add_messages() and notification routing without a SELECT.
+    """
+    return _stub(conversation_id, participants(conversation_id))
+
+
+async def aconversation_stub(conversation_id):
+    return _stub(conversation_id, await aparticipants(conversation_id))
+
+
+def _stub(conversation_id, pair):
+    if pair is None:
+        return None
+    return Conversation(pk=int(conversation_id), participant1_id=pair[0], participant2_id=pair[1])
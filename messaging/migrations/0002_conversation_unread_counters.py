@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_read_state(apps, schema_editor):
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Message = apps.get_model('messaging', 'Message')
+    for conv in Conversation.objects.all():
+        unread = Message.objects.filter(conversation=conv, is_read=False)
+        conv.p1_unread = unread.exclude(sender_id=conv.participant1_id).count()
+        conv.p2_unread = unread.exclude(sender_id=conv.participant2_id).count()
+        conv.last_message = Message.objects.filter(conversation=conv).order_by('-timestamp', '-id').first()
+        Conversation.objects.filter(pk=conv.pk).update(
+            p1_unread=conv.p1_unread, p2_unread=conv.p2_unread, last_message=conv.last_message,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messaging.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='p1_unread',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='p2_unread',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_read_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def merge_duplicate_threads(apps, schema_editor):
+    """
+    Fill user_low/user_high, then fold every thread that duplicates an older
+    one (same item, same two users in either order) into the oldest: its
+    messages and archive segments move over, and the survivor's unread
+    counters and last message are recomputed.
+    """
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Message = apps.get_model('messaging', 'Message')
+    MessageArchive = apps.get_model('messaging', 'MessageArchive')
+
+    threads = {}
+    for conv in Conversation.objects.order_by('pk').only('pk', 'item_id', 'participant1_id', 'participant2_id'):
+        low, high = sorted((conv.participant1_id, conv.participant2_id))
+        Conversation.objects.filter(pk=conv.pk).update(user_low_id=low, user_high_id=high)
+        threads.setdefault((conv.item_id, low, high), []).append(conv.pk)
+
+    for survivor_pk, *duplicates in threads.values():
+        if not duplicates:
+            continue
+        Message.objects.filter(conversation_id__in=duplicates).update(conversation_id=survivor_pk)
+        MessageArchive.objects.filter(conversation_id__in=duplicates).update(conversation_id=survivor_pk)
+        updated_at = Conversation.objects.filter(pk__in=[survivor_pk, *duplicates]).aggregate(
+            latest=Max('updated_at'),
+        )['latest']
+        Conversation.objects.filter(pk__in=duplicates).delete()
+
+        survivor = Conversation.objects.get(pk=survivor_pk)
+        unread = Message.objects.filter(conversation_id=survivor_pk, is_read=False)
+        Conversation.objects.filter(pk=survivor_pk).update(
+            p1_unread=unread.exclude(sender_id=survivor.participant1_id).count(),
+            p2_unread=unread.exclude(sender_id=survivor.participant2_id).count(),
+            last_message=Message.objects.filter(conversation_id=survivor_pk).order_by('-id').first(),
+            updated_at=updated_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_message_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='user_low',
+            field=models.ForeignKey(
+                db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                related_name='+', to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user_high',
+            field=models.ForeignKey(
+                db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                related_name='+', to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(merge_duplicate_threads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_watermarks(apps, schema_editor):
+    """
+    Each participant's watermark is just below the oldest message from the
+    other participant that is still unread, or the newest message if none is.
+    """
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Message = apps.get_model('messaging', 'Message')
+
+    for conv in Conversation.objects.only('pk', 'participant1_id', 'participant2_id').iterator():
+        messages = Message.objects.filter(conversation_id=conv.pk)
+        newest = messages.aggregate(newest=Max('id'))['newest'] or 0
+        watermarks = {}
+        for field, user_id in (('p1_last_read_id', conv.participant1_id), ('p2_last_read_id', conv.participant2_id)):
+            first_unread = messages.filter(is_read=False).exclude(sender_id=user_id).order_by('id').values_list(
+                'id', flat=True,
+            ).first()
+            watermarks[field] = first_unread - 1 if first_unread else newest
+        Conversation.objects.filter(pk=conv.pk).update(**watermarks)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0006_conversation_pair_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='p1_last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='p2_last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Separate from 0007 so PostgreSQL doesn't alter the table in the same
+# transaction as the data migration's updates.
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0007_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
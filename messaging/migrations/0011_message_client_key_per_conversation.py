@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0010_conversation_user_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='message',
+            name='message_client_key_uniq',
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_key__isnull', False)), fields=('conversation', 'sender', 'client_key'), name='message_client_key_uniq'),
+        ),
+    ]
@@ -1,31 +1,224 @@
-from django.db import models
+import copy
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Sum, Case, When, Value
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
+from django.utils import timezone
 from items.models import Item
 
 
+class ConversationQuerySet(models.QuerySet):
+    def for_user(self, user):
+        # On the canonical columns, each side backed by an index leading with it
+        return self.filter(Q(user_low=user) | Q(user_high=user))
+
+    def get_or_create_between(self, item, user, other):
+        """
+        The conversation about ``item`` between two users, created with ``user``
+        as participant1 if there is none. A point lookup on the canonical
+        (item, user_low, user_high) key; the unique constraint on it settles
+        concurrent creates, and the loser gets the winner's row.
+        """
+        low, high = sorted((user.pk, other.pk))
+        return self.get_or_create(
+            item=item, user_low_id=low, user_high_id=high,
+            defaults={'participant1': user, 'participant2': other},
+        )
+
+    def total_unread_for(self, user):
+        """Sum the stored unread counters across all of ``user``'s conversations in one query."""
+        total = self.for_user(user).aggregate(total=Sum(Case(
+            When(participant1=user, then='p1_unread'),
+            default='p2_unread',
+        )))['total']
+        return total or 0
+
+    def add_messages(self, entries):
+        """
+        Persist ``(conversation, sender, content[, client_key])`` entries with one
+        bulk INSERT and one counter/last-message/updated_at UPDATE per
+        conversation, all in a single transaction. Returns the messages in input
+        order. An entry whose client_key its sender has already used in that
+        conversation is not saved again: the earlier message is returned in
+        its place, marked ``duplicate``.
+        """
+        entries = [(*entry, None)[:4] for entry in entries]
+        try:
+            return self._add_messages(entries)
+        except IntegrityError:
+            if not any(key for *_, key in entries):
+                raise
+            # A concurrent send with the same key committed first; now it's found as a duplicate
+            return self._add_messages(entries)
+
+    def _add_messages(self, entries):
+        keys = {(conv.pk, sender.pk, key) for conv, sender, _, key in entries if key}
+        seen = {}
+        if keys:
+            found = Message.objects.filter(
+                conversation_id__in={conv_id for conv_id, _, _ in keys},
+                sender_id__in={sender_id for _, sender_id, _ in keys},
+                client_key__in={key for _, _, key in keys},
+            )
+            seen = {
+                (m.conversation_id, m.sender_id, m.client_key): m
+                for m in found if (m.conversation_id, m.sender_id, m.client_key) in keys
+            }
+
+        results, msgs = [], []
+        for conv, sender, content, key in entries:
+            if key and (conv.pk, sender.pk, key) in seen:
+                results.append(seen[(conv.pk, sender.pk, key)])
+                continue
+            msg = Message(conversation=conv, sender=sender, content=content, client_key=key)
+            if key:
+                seen[(conv.pk, sender.pk, key)] = msg
+            results.append(msg)
+            msgs.append(msg)
+
+        bumps = {}
+        with transaction.atomic():
+            Message.objects.bulk_create(msgs)
+            for msg in msgs:
+                conv = msg.conversation
+                field = 'p2_unread' if conv.participant1_id == msg.sender_id else 'p1_unread'
+                bump = bumps.setdefault(conv.pk, {'p1_unread': 0, 'p2_unread': 0})
+                bump[field] += 1
+                bump['last_message'] = msg
+            now = timezone.now()
+            for pk, bump in bumps.items():
+                self.model.objects.filter(pk=pk).update(
+                    p1_unread=F('p1_unread') + bump['p1_unread'],
+                    p2_unread=F('p2_unread') + bump['p2_unread'],
+                    last_message=bump['last_message'],
+                    updated_at=now,
+                )
+
+        new = {id(msg) for msg in msgs}
+        out = []
+        for msg in results:
+            if id(msg) in new:
+                new.discard(id(msg))
+            else:
+                # An earlier row or an earlier entry of this batch
+                msg = copy.copy(msg)
+                msg.duplicate = True
+            out.append(msg)
+        return out
+
+
 class Conversation(models.Model):
     """A unique conversation thread between two users about a specific item."""
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='conversations')
     participant1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations_as_p1')
     participant2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations_as_p2')
+    # The participants in id order, whoever started the chat; set in save()
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False, editable=False)
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Read watermarks: each participant has read every message up to this id
+    p1_last_read_id = models.BigIntegerField(default=0)
+    p2_last_read_id = models.BigIntegerField(default=0)
+    # When either watermark last moved, for the sync endpoint
+    read_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Denormalized read state, kept in step with Message rows by add_message() / mark_read_up_to()
+    p1_unread = models.PositiveIntegerField(default=0)
+    p2_unread = models.PositiveIntegerField(default=0)
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+    )
+
+    objects = ConversationQuerySet.as_manager()
+
     class Meta:
-        unique_together = ('item', 'participant1', 'participant2')
         ordering = ['-updated_at']
+        constraints = [
+            # One thread per item and pair of users, whichever of them opened it
+            models.UniqueConstraint(fields=['item', 'user_low', 'user_high'], name='conversation_pair_uniq'),
+        ]
+        indexes = [
+            # for_user(): the inbox, the unread badge and sync, newest first
+            models.Index(fields=['user_low', '-updated_at'], name='conversation_low_recent_idx'),
+            models.Index(fields=['user_high', '-updated_at'], name='conversation_high_recent_idx'),
+        ]
 
     def __str__(self):
         return f"Chat: {self.participant1} & {self.participant2} about '{self.item.title}'"
 
+    def save(self, *args, **kwargs):
+        self.set_canonical_pair()
+        super().save(*args, **kwargs)
+
+    def set_canonical_pair(self):
+        """Fill user_low/user_high from the participants (bulk_create callers must call this)."""
+        self.user_low_id, self.user_high_id = sorted((self.participant1_id, self.participant2_id))
+
     def get_other_user(self, user):
         """Return the other participant in the conversation."""
-        if self.participant1 == user:
+        if self.participant1_id == user.id:
             return self.participant2
         return self.participant1
 
+    def other_participant_id(self, user_id):
+        return self.participant2_id if self.participant1_id == user_id else self.participant1_id
+
+    def _unread_field_for(self, user_id):
+        return 'p1_unread' if self.participant1_id == user_id else 'p2_unread'
+
     def unread_count_for(self, user):
-        return self.messages.filter(is_read=False).exclude(sender=user).count()
+        return getattr(self, self._unread_field_for(user.id))
+
+    def add_message(self, sender, content, client_key=None):
+        """
+        Create a message and, in the same transaction, bump the recipient's
+        unread counter, the last-message pointer and updated_at.
+        """
+        return Conversation.objects.add_messages([(self, sender, content, client_key)])[0]
+
+    def _last_read_field_for(self, user_id):
+        return 'p1_last_read_id' if self.participant1_id == user_id else 'p2_last_read_id'
+
+    def last_read_id_for(self, user_id):
+        return getattr(self, self._last_read_field_for(user_id))
+
+    def mark_read_up_to(self, user_id, message_id):
+        """
+        Advance ``user_id``'s read watermark to ``message_id`` (capped at the
+        last message) and take the messages it passes off their unread counter,
+        in one compare-and-set UPDATE of this row. Returns how many unread
+        messages that cleared, or None if the watermark didn't move.
+        """
+        read_field = self._last_read_field_for(user_id)
+        unread_field = self._unread_field_for(user_id)
+        old = getattr(self, read_field)
+        message_id = min(message_id, self.last_message_id or 0)
+        if message_id <= old:
+            return None
+        if message_id == self.last_message_id:
+            # Caught up: everything the counter holds is cleared
+            cleared = getattr(self, unread_field)
+        else:
+            cleared = self.messages.filter(id__gt=old, id__lte=message_id).exclude(sender_id=user_id).count()
+        now = timezone.now()
+        moved = Conversation.objects.filter(pk=self.pk, **{read_field: old}).update(**{
+            read_field: message_id,
+            'read_changed_at': now,
+            # Reaching the newest message zeroes the counter outright, which also
+            # settles any drift (e.g. unread messages that were archived).
+            unread_field: Case(
+                When(last_message_id=message_id, then=Value(0)),
+                default=Greatest(F(unread_field) - cleared, 0),
+            ),
+        })
+        if not moved:
+            return None
+        setattr(self, read_field, message_id)
+        self.read_changed_at = now
+        setattr(self, unread_field, max(getattr(self, unread_field) - cleared, 0))
+        return cleared
 
 
 class Message(models.Model):
@@ -33,10 +226,58 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    # Chosen by the sending client so a resent message is stored once
+    client_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    # Set on the message add_messages() returns for a resend
+    duplicate = False
 
     class Meta:
         ordering = ['timestamp']
+        constraints = [
+            # A key only names a message within its conversation
+            models.UniqueConstraint(
+                fields=['conversation', 'sender', 'client_key'],
+                condition=Q(client_key__isnull=False),
+                name='message_client_key_uniq',
+            ),
+        ]
+        indexes = [
+            # poll_messages: conversation_id = X AND id > after
+            models.Index(fields=['conversation', 'id'], name='message_conv_id_idx'),
+            # Chat history in display order
+            models.Index(fields=['conversation', 'timestamp'], name='message_conv_ts_idx'),
+        ]
 
     def __str__(self):
         return f"[{self.timestamp:%H:%M}] {self.sender}: {self.content[:40]}"
+
+    @classmethod
+    def clean_client_key(cls, value):
+        """``value`` if it is usable as a client_key, otherwise None."""
+        if isinstance(value, str) and 0 < len(value) <= cls._meta.get_field('client_key').max_length:
+            return value
+        return None
+
+
+class MessageArchive(models.Model):
+    """
+    A run of archived messages from one conversation, stored as compressed
+    JSON (see messaging/archive.py). Segments of a conversation never
+    overlap and hold only ids older than its remaining Message rows.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archives')
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Paging back through history: conversation_id = X AND first_id < before
+            models.Index(fields=['conversation', '-last_id'], name='message_archive_conv_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id}: {self.count} message(s)"
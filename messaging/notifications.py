@@ -0,0 +1,103 @@
+"""
+Unread-count push over the per-user notification socket.
+
+Every page's navbar badge is served from a cached per-user total, and the
+server pushes deltas to the `user_{id}` group (NotificationConsumer)
+whenever a message is saved or messages are marked read, so open pages stay
+current without recounting. When the cache isn't shared between worker
+processes, each total is counted from the database instead.
+"""
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from lostfound import metrics
+from lostfound.cache import cache_is_shared
+
+from .models import Conversation
+
+UNREAD_CACHE_TIMEOUT = 300
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+def _cache_key(user_id):
+    return f'messaging:unread_total:{user_id}'
+
+
+def unread_total_for(user):
+    if not cache_is_shared():
+        return Conversation.objects.total_unread_for(user)
+    key = _cache_key(user.id)
+    total = cache.get(key)
+    metrics.cache_lookup('unread_total', total is not None)
+    if total is None:
+        total = Conversation.objects.total_unread_for(user)
+        cache.add(key, total, UNREAD_CACHE_TIMEOUT)
+    return total
+
+
+def adjust_unread_total(user_id, delta):
+    """
+    Apply ``delta`` to the cached total and return the new value. A cache
+    miss, or a total that has drifted below zero, is recounted.
+    """
+    if not cache_is_shared():
+        return Conversation.objects.total_unread_for(user_id)
+    key = _cache_key(user_id)
+    try:
+        total = cache.incr(key, delta) if delta >= 0 else cache.decr(key, -delta)
+    except ValueError:
+        total = None
+    if total is None or total < 0:
+        total = Conversation.objects.total_unread_for(user_id)
+        cache.set(key, total, UNREAD_CACHE_TIMEOUT)
+    return total
+
+
+def new_message_event(conversation, message, sender):
+    """Update the recipient's cached total and build the event for their notification socket."""
+    return new_message_events([(conversation, message, sender)])[0]
+
+
+def new_message_events(entries):
+    """
+    new_message_event() for a batch of already-committed ``(conversation, message, sender)``
+    entries. Each recipient's cached total is adjusted once for the whole batch (a cache
+    miss recount already includes every message in it) and each event carries the running
+    total as of its own message.
+    """
+    recipients = [conv.other_participant_id(sender.id) for conv, _, sender in entries]
+    remaining = {}
+    for recipient_id in recipients:
+        remaining[recipient_id] = remaining.get(recipient_id, 0) + 1
+    totals = {r: adjust_unread_total(r, n) for r, n in remaining.items()}
+
+    events = []
+    for recipient_id, (conv, message, sender) in zip(recipients, entries):
+        remaining[recipient_id] -= 1
+        events.append((recipient_id, {
+            'type': 'new_message',
+            'conversation_id': conv.id,
+            'from_username': sender.username,
+            'message_preview': message.content[:80],
+            'unread_count': totals[recipient_id] - remaining[recipient_id],
+            'delta': 1,
+        }))
+    return events
+
+
+def read_event(user_id, cleared):
+    return {
+        'type': 'unread_count',
+        'count': adjust_unread_total(user_id, -cleared),
+        'delta': -cleared,
+    }
+
+
+async def apush(user_id, event):
+    await metrics.group_send(user_group(user_id), event)
+
+
+def push(user_id, event):
+    async_to_sync(metrics.group_send)(user_group(user_id), event)
@@ -0,0 +1,135 @@
+"""
+Read receipts on per-participant watermarks.
+
+A participant's read state in a conversation is one message id
+(Conversation.p1_last_read_id / p2_last_read_id): everything up to it has
+been read. Moving it is a single conditional UPDATE of the conversation row,
+however many messages it passes, instead of flipping a flag on each message.
+
+Sockets report what they have displayed: ``{"type": "read", "last_read_id": N}``
+on ChatConsumer, a ``read`` frame on MultiplexConsumer. Those reports are
+debounced: per event loop, the highest id per (conversation, user) is held
+for CHAT_READ_FLUSH_DELAY seconds and then written as one batch on the chat
+DB executor, so a burst of reports costs one small write per participant.
+Page loads and HTTP polls advance the watermark directly. Either way every
+move is broadcast to the conversation's group as a ``read_receipt`` event
+(the other side shows "Seen") and, when it cleared anything, to the
+reader's notification socket as an ``unread_count`` event.
+"""
+import asyncio
+import logging
+import weakref
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from lostfound import metrics
+
+from .db import chat_db
+from .models import Conversation
+from . import notifications
+
+logger = logging.getLogger(__name__)
+
+
+def receipt_event(conversation_id, user_id, last_read_id):
+    return {
+        'type': 'read_receipt',
+        'conversation_id': conversation_id,
+        'user_id': user_id,
+        'last_read_id': last_read_id,
+    }
+
+
+def advance(conversation, user_id, message_id):
+    """
+    Move ``user_id``'s watermark in ``conversation`` up to ``message_id``.
+    Returns the ``(group, event)`` pairs to broadcast, empty if it didn't move.
+    """
+    if user_id not in (conversation.participant1_id, conversation.participant2_id):
+        return []
+    cleared = conversation.mark_read_up_to(user_id, message_id)
+    if cleared is None:
+        return []
+    receipt = receipt_event(conversation.pk, user_id, conversation.last_read_id_for(user_id))
+    events = [(f'chat_{conversation.pk}', receipt)]
+    if cleared:
+        events.append((notifications.user_group(user_id), notifications.read_event(user_id, cleared)))
+    return events
+
+
+def read_up_to(conversation, user_id, message_id):
+    """advance() for sync callers (views), broadcasting straight away."""
+    for group, event in advance(conversation, user_id, message_id):
+        async_to_sync(metrics.group_send)(group, event)
+
+
+def write_batch(marks):
+    """advance() every ``{(conversation_id, user_id): message_id}`` entry, loading the rows in one query."""
+    conversations = Conversation.objects.only(
+        'participant1_id', 'participant2_id', 'p1_last_read_id', 'p2_last_read_id',
+        'p1_unread', 'p2_unread', 'last_message_id',
+    ).in_bulk({conversation_id for conversation_id, _ in marks})
+    events = []
+    for (conversation_id, user_id), message_id in marks.items():
+        conversation = conversations.get(conversation_id)
+        if conversation is not None:
+            events.extend(advance(conversation, user_id, message_id))
+    return events
+
+
+class ReadTracker:
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        self._pending = {}
+        self._timer = None
+        # Flushes in flight, kept so they are not garbage collected mid-write
+        self._tasks = set()
+
+    def report(self, conversation_id, user_id, message_id):
+        """Note that ``user_id`` has displayed ``conversation_id`` up to ``message_id``."""
+        key = (int(conversation_id), user_id)
+        if message_id > self._pending.get(key, 0):
+            self._pending[key] = message_id
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._flush_now)
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        marks, self._pending = self._pending, {}
+        if marks:
+            task = asyncio.ensure_future(self._flush(marks))
+            self._tasks.add(task)
+            task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Broadcasting read receipts failed', exc_info=task.exception())
+
+    async def close(self):
+        """Write the reports still held back and wait for every flush in flight, e.g. at shutdown."""
+        self._flush_now()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _flush(self, marks):
+        try:
+            events = await chat_db.run(write_batch, marks)
+        except Exception:
+            logger.exception('Writing %d read watermark(s) failed', len(marks))
+            return
+        for group, event in events:
+            await metrics.group_send(group, event)
+
+
+_trackers = weakref.WeakKeyDictionary()
+
+
+def get_tracker():
+    """The read tracker for the running event loop."""
+    loop = asyncio.get_running_loop()
+    tracker = _trackers.get(loop)
+    if tracker is None:
+        tracker = _trackers[loop] = ReadTracker(delay=getattr(settings, 'CHAT_READ_FLUSH_DELAY', 0.5))
+    return tracker
@@ -6,4 +6,6 @@ websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<conversation_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
     # Per-user persistent notification socket (open on every page)
     re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
+    # Per-user multiplexed socket: notifications plus any number of conversations
+    re_path(r'ws/mux/$', consumers.MultiplexConsumer.as_asgi()),
 ]
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from . import membership
+from .models import Conversation
+
+
+@receiver(post_delete, sender=Conversation)
+def drop_cached_membership(sender, instance, **kwargs):
+    membership.cache.invalidate(instance.pk)
@@ -1,6 +1,5 @@
 from django import template
-from django.db.models import Q
-from messaging.models import Conversation
+from messaging.notifications import unread_total_for
 
 register = template.Library()
 
@@ -8,10 +7,5 @@ register = template.Library()
 def unread_count(user):
     if not user.is_authenticated:
         return 0
-    convs = Conversation.objects.filter(
-        Q(participant1=user) | Q(participant2=user)
-    )
-    total = 0
-    for conv in convs:
-        total += conv.unread_count_for(user)
-    return total
+    # Cached total; kept current by the deltas pushed in messaging.notifications
+    return unread_total_for(user)
@@ -0,0 +1,921 @@
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F, Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from items.models import Item
+from items.tests import QueryPlanTestCase
+from . import archive, consumers, membership, notifications, receipts, routing, views
+from .ingest import MessageIngest
+from .layers import SQLiteChannelLayer
+from .models import Conversation, ConversationQuerySet, Message, MessageArchive
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def make_conversation(owner, asker, title='Blue umbrella'):
+    item = Item.objects.create(title=title, description='Left after class', location='Library', posted_by=owner)
+    conversation, _ = Conversation.objects.get_or_create_between(item, asker, owner)
+    return conversation
+
+
+class MessagingQueryPlanTests(QueryPlanTestCase):
+    def setUp(self):
+        self.user = User(pk=1)
+        self.conv = Conversation(pk=1, participant1_id=1, participant2_id=2)
+
+    def test_inbox_and_badge(self):
+        self.assertNoFullScans({
+            'inbox': Conversation.objects.for_user(self.user).select_related(
+                'item', 'participant1', 'participant2', 'last_message',
+            ).order_by('-updated_at'),
+            # total_unread_for() aggregates over exactly this row set
+            'unread badge': Conversation.objects.for_user(self.user).order_by(),
+            'start_chat lookup': Conversation.objects.filter(item_id=1, user_low_id=1, user_high_id=2),
+        })
+
+    def test_for_user_reads_both_canonical_indexes(self):
+        plan = Conversation.objects.for_user(self.user).explain()
+        self.assertIn('conversation_low_recent_idx', plan)
+        self.assertIn('conversation_high_recent_idx', plan)
+
+    def test_chat_room(self):
+        messages = self.conv.messages
+        self.assertNoFullScans({
+            'chat_room history': messages.select_related('sender').order_by('-id')[:51],
+            'chat_history page': messages.filter(id__lt=1000).select_related('sender').order_by('-id')[:51],
+            # The count mark_read_up_to() takes when the watermark stops short of the newest message
+            'mark_read_up_to': messages.filter(id__gt=10, id__lte=50).exclude(sender=self.user).order_by(),
+            'poll_messages': messages.filter(id__gt=10).select_related('sender').order_by('timestamp'),
+        })
+
+    def test_sync(self):
+        since = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.assertNoFullScans({
+            'sync': Message.objects.filter(
+                Q(conversation__user_low=self.user) | Q(conversation__user_high=self.user),
+            ).filter(
+                Q(id__gt=1000) | Q(id=F('conversation__last_message_id'), conversation__read_changed_at__gt=since),
+            ).select_related('sender', 'conversation').order_by('id')[:501],
+            'sync without a last message': Conversation.objects.for_user(self.user).filter(
+                last_message__isnull=True, read_changed_at__gt=since,
+            ),
+        })
+
+
+class UnreadTotalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+        self.conv.add_message(self.asker, 'hello')
+
+    def test_deltas_apply_to_the_cached_total(self):
+        self.assertEqual(notifications.unread_total_for(self.owner), 1)
+        self.assertEqual(notifications.adjust_unread_total(self.owner.id, 2), 3)
+        self.assertEqual(notifications.adjust_unread_total(self.owner.id, -1), 2)
+
+    def test_negative_total_is_recounted(self):
+        cache.set(notifications._cache_key(self.owner.id), 1)
+        self.assertEqual(notifications.adjust_unread_total(self.owner.id, -3), 1)
+        self.assertEqual(cache.get(notifications._cache_key(self.owner.id)), 1)
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_process_local_cache_is_bypassed_with_several_workers(self):
+        self.assertEqual(notifications.unread_total_for(self.owner), 1)
+        self.assertEqual(notifications.adjust_unread_total(self.owner.id, 5), 1)
+        self.assertIsNone(cache.get(notifications._cache_key(self.owner.id)))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, ITEMS_MATCH_SYNC=True)
+class DeletedConversationTests(TransactionTestCase):
+    """A conversation deleted in another worker, whose cached participants this one still holds."""
+
+    def setUp(self):
+        cache.clear()
+        membership.cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+        self.conv_id = self.conv.pk
+        self.pair = membership.participants(self.conv_id)
+
+    def delete_elsewhere(self):
+        self.conv.delete()
+        membership.cache.set(self.conv_id, self.pair)
+
+    def test_http_post(self):
+        self.delete_elsewhere()
+        self.client.force_login(self.asker)
+        response = self.client.post(
+            reverse('poll_messages', args=[self.conv_id]), json.dumps({'message': 'hello'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertIs(membership.cache.get(self.conv_id), membership._MISSING)
+
+    def test_http_get(self):
+        self.delete_elsewhere()
+        self.client.force_login(self.asker)
+        response = self.client.get(reverse('poll_messages', args=[self.conv_id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertIs(membership.cache.get(self.conv_id), membership._MISSING)
+
+    async def test_wait(self):
+        await sync_to_async(self.conv.add_message)(self.owner, 'Found it')
+        messages_after = views._messages_after
+
+        def deleted_meanwhile(*args):
+            self.delete_elsewhere()
+            return messages_after(*args)
+
+        await self.async_client.aforce_login(self.asker)
+        with mock.patch.object(views, '_messages_after', deleted_meanwhile):
+            response = await self.async_client.get(reverse('wait_messages', args=[self.conv_id]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_mux_msg(self):
+        socket = WebsocketCommunicator(URLRouter(routing.websocket_urlpatterns), '/ws/mux/')
+        socket.scope['user'] = self.asker
+        await socket.connect()
+        await socket.send_to(text_data=json.dumps(['sub', 1, {'conversation': self.conv_id}]))
+        self.assertEqual(json.loads(await socket.receive_from(timeout=5)), ['ok', 1])
+
+        await sync_to_async(self.delete_elsewhere)()
+        await socket.send_to(text_data=json.dumps(['msg', 1, {'message': 'hello'}]))
+        self.assertEqual(json.loads(await socket.receive_from(timeout=5)), ['err', 1, {'error': 'not found'}])
+        await socket.send_to(text_data=json.dumps(['msg', 1, {'message': 'hello'}]))
+        self.assertTrue(await socket.receive_nothing(timeout=0.3))
+        await socket.disconnect()
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.client.force_login(self.owner)
+
+    def add_conversation(self, n):
+        asker = User.objects.create_user(f'asker{n}')
+        conv = make_conversation(self.owner, asker, title=f'Item {n}')
+        conv.add_message(asker, 'Is it still there?')
+
+    def test_query_count_does_not_grow_with_conversations(self):
+        self.add_conversation(0)
+        # Warm the per-user caches the page shares with every other view
+        self.client.get(reverse('inbox'))
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(self.client.get(reverse('inbox')).context['total_unread'], 1)
+        for n in range(1, 4):
+            self.add_conversation(n)
+        with self.assertNumQueries(len(one)):
+            response = self.client.get(reverse('inbox'))
+        self.assertEqual(response.context['total_unread'], 4)
+        self.assertEqual(len(response.context['conv_list']), 4)
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sqlite3')
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), timeout=5)
+
+    async def test_send_and_receive(self):
+        layer = SQLiteChannelLayer(self.path)
+        channel = await layer.new_channel()
+        await layer.send(channel, {'type': 'chat.message', 'n': 1})
+        await layer.send(channel, {'type': 'chat.message', 'n': 2})
+        self.assertEqual((await self.receive(layer, channel))['n'], 1)
+        self.assertEqual((await self.receive(layer, channel))['n'], 2)
+        await layer.close()
+
+    async def test_group_send_reaches_another_process(self):
+        # Two layers on one file stand in for two Daphne workers
+        sender, receiver = SQLiteChannelLayer(self.path), SQLiteChannelLayer(self.path)
+        first, second = await receiver.new_channel(), await receiver.new_channel()
+        await receiver.group_add('chat_1', first)
+        await receiver.group_add('chat_1', second)
+        await sender.group_send('chat_1', {'type': 'chat.message', 'n': 1})
+        self.assertEqual((await self.receive(receiver, first))['n'], 1)
+        self.assertEqual((await self.receive(receiver, second))['n'], 1)
+
+        await receiver.group_discard('chat_1', first)
+        await sender.group_send('chat_1', {'type': 'chat.message', 'n': 2})
+        await sender.send(first, {'type': 'chat.message', 'n': 3})
+        self.assertEqual((await self.receive(receiver, first))['n'], 3)
+        self.assertEqual((await self.receive(receiver, second))['n'], 2)
+        await sender.close()
+        await receiver.close()
+
+    async def test_capacity(self):
+        layer = SQLiteChannelLayer(self.path, capacity=2)
+        channel = await layer.new_channel()
+        await layer.send(channel, {'type': 'chat.message'})
+        await layer.send(channel, {'type': 'chat.message'})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {'type': 'chat.message'})
+        await layer.close()
+
+    async def test_receive_cancelled_during_a_fetch(self):
+        layer = SQLiteChannelLayer(self.path)
+        channel = await layer.new_channel()
+        await layer.send(channel, {'type': 'chat.message'})
+        run = layer._run
+
+        async def cancel_receive_first(fn, *args):
+            if fn == layer._fetch:
+                receiving.cancel()
+                await asyncio.sleep(0)
+            return await run(fn, *args)
+
+        with mock.patch.object(layer, '_run', cancel_receive_first):
+            receiving = asyncio.ensure_future(layer.receive(channel))
+            with self.assertRaises(asyncio.CancelledError):
+                await receiving
+            await asyncio.wait_for(layer._poller, timeout=5)
+        self.assertEqual(layer._buffers, {})
+        await layer.close()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, ITEMS_MATCH_SYNC=True)
+class WaitMessagesTests(TransactionTestCase):
+    def setUp(self):
+        membership.cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+        self.first = self.conv.add_message(self.owner, 'Found it')
+        self.group = f'chat_{self.conv.pk}'
+
+    async def wait(self, conversation_id=None, **params):
+        url = reverse('wait_messages', args=[conversation_id or self.conv.pk])
+        return await self.async_client.get(url, {'after': self.first.id, 'timeout': 5, **params})
+
+    async def parked(self, request):
+        layer = get_channel_layer()
+        for _ in range(500):
+            if layer.groups.get(self.group):
+                return
+            self.assertFalse(request.done())
+            await asyncio.sleep(0.01)
+        self.fail('wait_messages never subscribed')
+
+    async def post_message(self):
+        msg = await sync_to_async(self.conv.add_message)(self.owner, 'Still want it?')
+        await get_channel_layer().group_send(self.group, {'type': 'chat_message', 'message_id': msg.id})
+        return msg
+
+    async def test_returns_at_once_when_there_is_something_newer(self):
+        await self.async_client.aforce_login(self.asker)
+        response = await self.wait(after=0)
+        self.assertEqual([m['id'] for m in response.json()['messages']], [self.first.id])
+        self.assertFalse(get_channel_layer().groups.get(self.group))
+
+    async def test_wakes_on_chat_message(self):
+        await self.async_client.aforce_login(self.asker)
+        request = asyncio.ensure_future(self.wait())
+        await self.parked(request)
+        msg = await self.post_message()
+        response = await asyncio.wait_for(request, timeout=5)
+        self.assertEqual([m['id'] for m in response.json()['messages']], [msg.id])
+        self.assertFalse(get_channel_layer().groups.get(self.group))
+
+    async def test_read_receipts_do_not_end_the_wait(self):
+        await self.async_client.aforce_login(self.asker)
+        request = asyncio.ensure_future(self.wait())
+        await self.parked(request)
+        await get_channel_layer().group_send(self.group, {'type': 'read_receipt', 'reader_id': self.owner.id})
+        await asyncio.sleep(0.2)
+        self.assertFalse(request.done())
+        msg = await self.post_message()
+        response = await asyncio.wait_for(request, timeout=5)
+        self.assertEqual([m['id'] for m in response.json()['messages']], [msg.id])
+
+    async def test_timeout(self):
+        await self.async_client.aforce_login(self.asker)
+        response = await self.wait(timeout=0.1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'messages': []})
+        self.assertFalse(get_channel_layer().groups.get(self.group))
+
+    async def test_access(self):
+        self.assertEqual((await self.wait()).status_code, 401)
+        outsider = await sync_to_async(User.objects.create_user)('outsider')
+        await self.async_client.aforce_login(outsider)
+        self.assertEqual((await self.wait()).status_code, 403)
+        self.assertEqual((await self.wait(conversation_id=self.conv.pk + 100)).status_code, 404)
+
+
+@override_settings(ITEMS_MATCH_SYNC=True)
+class IngestTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership.cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+
+    async def test_concurrent_submits_share_one_write(self):
+        ingest = MessageIngest(max_batch=50, max_delay=0.01)
+        with mock.patch.object(
+            Conversation.objects, 'add_messages', wraps=Conversation.objects.add_messages,
+        ) as add_messages:
+            results = await asyncio.gather(*(
+                ingest.submit(self.conv, self.asker, f'message {i}') for i in range(3)
+            ))
+        self.assertEqual(add_messages.call_count, 1)
+        ids = [msg.pk for msg, _ in results]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual([event['unread_count'] for _, (_, event) in results], [1, 2, 3])
+
+        self.conv = await sync_to_async(Conversation.objects.get)(pk=self.conv.pk)
+        self.assertEqual(self.conv.last_message_id, max(ids))
+        self.assertEqual(self.conv.unread_count_for(self.owner), 3)
+
+    async def test_full_batch_flushes_without_waiting(self):
+        ingest = MessageIngest(max_batch=2, max_delay=60)
+        results = await asyncio.wait_for(asyncio.gather(
+            ingest.submit(self.conv, self.asker, 'one'),
+            ingest.submit(self.conv, self.asker, 'two'),
+        ), timeout=10)
+        self.assertEqual(len(results), 2)
+
+    async def test_failed_entry_does_not_fail_its_neighbours(self):
+        ingest = MessageIngest(max_batch=50, max_delay=0.01)
+        gone = Conversation(pk=10 ** 9, participant1_id=self.asker.pk, participant2_id=self.owner.pk)
+        good, bad = await asyncio.gather(
+            ingest.submit(self.conv, self.asker, 'kept'),
+            ingest.submit(gone, self.asker, 'lost'),
+            return_exceptions=True,
+        )
+        self.assertEqual(good[0].content, 'kept')
+        self.assertIsInstance(bad, IntegrityError)
+        self.assertEqual(await sync_to_async(Message.objects.count)(), 1)
+
+    async def test_close_waits_for_the_flush_in_flight(self):
+        ingest = MessageIngest(max_batch=50, max_delay=60)
+        submitting = asyncio.ensure_future(ingest.submit(self.conv, self.asker, 'bye'))
+        await asyncio.sleep(0)
+        await ingest.close()
+        self.assertEqual(ingest._tasks, set())
+        self.assertEqual(await sync_to_async(Message.objects.count)(), 1)
+        self.assertEqual((await submitting)[0].content, 'bye')
+
+    async def test_failed_flush_is_logged(self):
+        ingest = MessageIngest(max_batch=50, max_delay=60)
+        submitting = asyncio.ensure_future(ingest.submit(self.conv, self.asker, 'lost'))
+        await asyncio.sleep(0)
+        with mock.patch.object(ingest, '_flush', side_effect=RuntimeError('boom')), \
+                self.assertLogs('messaging.ingest', 'ERROR'):
+            await ingest.close()
+            await asyncio.sleep(0)
+        self.assertEqual(ingest._tasks, set())
+        submitting.cancel()
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        membership.cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+        self.client.force_login(self.asker)
+
+    def add_messages(self, count):
+        return [m.id for m in Message.objects.bulk_create(
+            Message(conversation=self.conv, sender=self.owner, content=f'message {n}') for n in range(count)
+        )]
+
+    def history(self, **params):
+        return self.client.get(reverse('chat_history', args=[self.conv.pk]), params)
+
+    def test_before_cursor(self):
+        ids = self.add_messages(12)
+        page = self.history(before=ids[10]).json()
+        self.assertEqual([m['id'] for m in page['messages']], ids[:10])
+        self.assertFalse(page['has_more'])
+
+    def test_has_more_at_exactly_a_page(self):
+        ids = self.add_messages(views.CHAT_HISTORY_PAGE_SIZE)
+        page = self.history().json()
+        self.assertEqual([m['id'] for m in page['messages']], ids)
+        self.assertFalse(page['has_more'])
+
+        ids += self.add_messages(1)
+        page = self.history().json()
+        self.assertEqual([m['id'] for m in page['messages']], ids[1:])
+        self.assertTrue(page['has_more'])
+        page = self.history(before=ids[1]).json()
+        self.assertEqual([m['id'] for m in page['messages']], ids[:1])
+        self.assertFalse(page['has_more'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.history(before='abc').status_code, 400)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        membership.cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+        self.ids = [self.conv.add_message(self.asker, f'message {n}').id for n in range(6)]
+        self.conv.item.status = 'Returned'
+        self.conv.item.save()
+        Item.objects.filter(pk=self.conv.item_id).update(closed_at=datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+    def test_archive_conversation(self):
+        self.assertEqual(list(archive.candidates()), [self.conv.pk])
+        with mock.patch.object(archive, 'SEGMENT_SIZE', 2):
+            self.assertEqual(archive.archive_conversation(self.conv.pk), 5)
+        self.assertEqual(MessageArchive.objects.filter(conversation=self.conv).count(), 3)
+        self.assertEqual(list(self.conv.messages.values_list('id', flat=True)), self.ids[-1:])
+        self.assertEqual(list(archive.candidates()), [])
+        self.assertEqual(archive.archive_conversation(self.conv.pk), 0)
+
+        msgs, has_more = archive.history(self.conv.pk)
+        self.assertEqual([(m.id, m.content, m.sender) for m in msgs],
+                         [(pk, f'message {n}', self.asker) for n, pk in enumerate(self.ids[:5])])
+        self.assertFalse(has_more)
+
+    def test_history_pages_from_live_rows_into_the_archive(self):
+        archive.archive_conversation(self.conv.pk)
+        self.ids += [self.conv.add_message(self.owner, 'Still there?').id for _ in range(2)]
+
+        pages, before_id, has_more = [], None, True
+        while has_more:
+            msgs, has_more = views._history_page(self.conv.pk, before_id, limit=3)
+            pages.append([m.id for m in msgs])
+            before_id = msgs[0].id
+        self.assertEqual(pages, [self.ids[5:], self.ids[2:5], self.ids[:2]])
+
+    def test_sender_whose_account_is_gone(self):
+        gone = Message(id=self.ids[0] - 1, sender_id=10 ** 9, content='hello',
+                       timestamp=datetime(2026, 1, 1, tzinfo=timezone.utc))
+        MessageArchive.objects.create(conversation=self.conv, first_id=gone.id, last_id=gone.id, count=1,
+                                      data=archive.encode([gone]))
+        self.client.force_login(self.asker)
+        response = self.client.get(reverse('chat_history', args=[self.conv.pk]), {'before': self.ids[0]})
+        self.assertEqual(response.json()['messages'][0]['sender_username'], archive.DELETED_SENDER)
+
+
+@override_settings(ITEMS_MATCH_SYNC=True)
+class PairMigrationTests(TransactionTestCase):
+    before = [('messaging', '0004_message_archive')]
+    after = [('messaging', '0006_conversation_pair_uniq')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_duplicate_threads_are_merged(self):
+        owner = User.objects.create_user('owner')
+        asker = User.objects.create_user('asker')
+        item = Item.objects.create(title='Blue umbrella', description='d', location='Library', posted_by=owner)
+
+        apps = self.migrate(self.before)
+        OldConversation = apps.get_model('messaging', 'Conversation')
+        OldMessage = apps.get_model('messaging', 'Message')
+        first = OldConversation.objects.create(item_id=item.pk, participant1_id=asker.pk, participant2_id=owner.pk)
+        second = OldConversation.objects.create(item_id=item.pk, participant1_id=owner.pk, participant2_id=asker.pk)
+        sent = [
+            OldMessage.objects.create(conversation_id=first.pk, sender_id=asker.pk, content='one', is_read=False),
+            OldMessage.objects.create(conversation_id=second.pk, sender_id=asker.pk, content='two', is_read=False),
+            OldMessage.objects.create(conversation_id=second.pk, sender_id=owner.pk, content='reply', is_read=True),
+        ]
+
+        apps = self.migrate(self.after)
+        NewConversation = apps.get_model('messaging', 'Conversation')
+        survivor = NewConversation.objects.get()
+        self.assertEqual(survivor.pk, first.pk)
+        self.assertEqual((survivor.user_low_id, survivor.user_high_id), tuple(sorted((owner.pk, asker.pk))))
+        self.assertEqual(
+            set(apps.get_model('messaging', 'Message').objects.values_list('conversation_id', flat=True)),
+            {first.pk},
+        )
+        # participant1 is the asker: nothing unread from the owner, two from the asker for the owner
+        self.assertEqual((survivor.p1_unread, survivor.p2_unread), (0, 2))
+        self.assertEqual(survivor.last_message_id, sent[-1].pk)
+
+
+class ReadWatermarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+        self.msgs = [self.conv.add_message(self.asker, f'message {i}') for i in range(3)]
+        self.conv.refresh_from_db()
+
+    def test_watermark_only_moves_forward(self):
+        self.assertEqual(self.conv.mark_read_up_to(self.owner.id, self.msgs[1].pk), 2)
+        self.assertEqual(self.conv.unread_count_for(self.owner), 1)
+        self.assertIsNone(self.conv.mark_read_up_to(self.owner.id, self.msgs[0].pk))
+        self.conv.refresh_from_db()
+        self.assertEqual(self.conv.last_read_id_for(self.owner.id), self.msgs[1].pk)
+        self.assertEqual(self.conv.unread_count_for(self.owner), 1)
+
+    def test_watermark_is_clamped_to_the_newest_message(self):
+        self.assertEqual(self.conv.mark_read_up_to(self.owner.id, 10 ** 9), 3)
+        self.conv.refresh_from_db()
+        self.assertEqual(self.conv.last_read_id_for(self.owner.id), self.msgs[-1].pk)
+        self.assertEqual(self.conv.unread_count_for(self.owner), 0)
+        self.assertIsNotNone(self.conv.read_changed_at)
+
+    def test_own_messages_are_not_counted(self):
+        self.assertEqual(self.conv.mark_read_up_to(self.asker.id, self.msgs[-1].pk), 0)
+        self.conv.refresh_from_db()
+        self.assertEqual(self.conv.unread_count_for(self.owner), 3)
+
+    def test_advance_events(self):
+        events = receipts.advance(self.conv, self.owner.id, self.msgs[-1].pk)
+        self.assertEqual([group for group, _ in events], [f'chat_{self.conv.pk}', f'user_{self.owner.id}'])
+        self.assertEqual(events[0][1], receipts.receipt_event(self.conv.pk, self.owner.id, self.msgs[-1].pk))
+        self.assertEqual(events[1][1]['delta'], -3)
+        self.assertEqual(receipts.advance(self.conv, self.owner.id, self.msgs[-1].pk), [])
+
+        stranger = User.objects.create_user('stranger')
+        self.assertEqual(receipts.advance(self.conv, stranger.id, self.msgs[-1].pk), [])
+
+    def test_write_batch(self):
+        events = receipts.write_batch({
+            (self.conv.pk, self.owner.id): self.msgs[-1].pk,
+            (self.conv.pk, self.asker.id): self.msgs[-1].pk,
+            (10 ** 9, self.owner.id): 1,
+        })
+        self.assertEqual(len([e for _, e in events if e['type'] == 'read_receipt']), 2)
+        self.conv.refresh_from_db()
+        self.assertEqual(self.conv.last_read_id_for(self.owner.id), self.msgs[-1].pk)
+        self.assertEqual(self.conv.last_read_id_for(self.asker.id), self.msgs[-1].pk)
+
+
+class ReadTrackerTests(SimpleTestCase):
+    async def test_close_writes_what_is_held_back(self):
+        tracker = receipts.ReadTracker(delay=60)
+        with mock.patch.object(receipts, 'write_batch', return_value=[]) as write_batch:
+            tracker.report(1, 2, 10)
+            tracker.report(1, 2, 12)
+            await tracker.close()
+        write_batch.assert_called_once_with({(1, 2): 12})
+        self.assertEqual(tracker._tasks, set())
+        self.assertIsNone(tracker._timer)
+
+    async def test_failed_broadcast_is_logged(self):
+        tracker = receipts.ReadTracker(delay=60)
+        event = receipts.receipt_event(1, 2, 12)
+        with mock.patch.object(receipts, 'write_batch', return_value=[('chat_1', event)]), \
+                mock.patch.object(receipts.metrics, 'group_send', side_effect=RuntimeError('boom')), \
+                self.assertLogs('messaging.receipts', 'ERROR'):
+            tracker.report(1, 2, 12)
+            await tracker.close()
+            await asyncio.sleep(0)
+        self.assertEqual(tracker._tasks, set())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, CHAT_READ_FLUSH_DELAY=0.01, ITEMS_MATCH_SYNC=True)
+class MultiplexConsumerTests(TransactionTestCase):
+    application = URLRouter(routing.websocket_urlpatterns)
+
+    def setUp(self):
+        cache.clear()
+        membership.cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.stranger = User.objects.create_user('stranger')
+        self.conv = make_conversation(self.owner, self.asker)
+
+    async def connect(self, user):
+        socket = WebsocketCommunicator(self.application, '/ws/mux/')
+        socket.scope['user'] = user
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    async def send(self, socket, *frame):
+        await socket.send_to(text_data=json.dumps(frame))
+
+    async def receive(self, socket):
+        return json.loads(await socket.receive_from(timeout=5))
+
+    async def drain(self, socket, stream_id=None):
+        """Every frame the socket has been sent so far, optionally only one stream's."""
+        frames = []
+        while not await socket.receive_nothing(timeout=0.3):
+            frames.append(await self.receive(socket))
+        return [f for f in frames if stream_id is None or f[1] == stream_id]
+
+    async def subscribe(self, socket, stream_id, **arg):
+        await self.send(socket, 'sub', stream_id, {'conversation': self.conv.pk, **arg})
+        self.assertEqual(await self.receive(socket), ['ok', stream_id])
+
+    async def test_messages_reach_both_streams(self):
+        owner, asker = await self.connect(self.owner), await self.connect(self.asker)
+        await self.subscribe(owner, 1)
+        await self.subscribe(asker, 7)
+
+        await self.send(asker, 'msg', 7, {'message': 'hello', 'client_key': 'k1'})
+        received = await self.drain(owner)
+        chat = [f for f in received if f[1] == 1]
+        self.assertEqual(len(chat), 1)
+        self.assertEqual(chat[0][2]['message'], 'hello')
+        self.assertFalse(chat[0][2]['is_own'])
+        self.assertNotIn('client_key', chat[0][2])
+        self.assertEqual([f[2]['type'] for f in received if f[1] == 0], ['new_message'])
+
+        echo = await self.drain(asker, 7)
+        self.assertEqual(echo[0][2]['client_key'], 'k1')
+
+        # A resend is echoed to the sender only
+        await self.send(asker, 'msg', 7, {'message': 'hello', 'client_key': 'k1'})
+        self.assertEqual((await self.drain(asker, 7))[0][2]['message_id'], echo[0][2]['message_id'])
+        self.assertEqual(await self.drain(owner), [])
+        await owner.disconnect()
+        await asker.disconnect()
+
+    async def test_forbidden_and_bad_frames(self):
+        stranger = await self.connect(self.stranger)
+        await self.send(stranger, 'sub', 3, {'conversation': self.conv.pk})
+        self.assertEqual(await self.receive(stranger), ['err', 3, {'error': 'forbidden'}])
+        await self.send(stranger, 'zap', 3)
+        self.assertEqual(await self.receive(stranger), ['err', 3, {'error': 'bad frame'}])
+        await stranger.disconnect()
+
+    async def test_unsub(self):
+        owner, asker = await self.connect(self.owner), await self.connect(self.asker)
+        await self.subscribe(owner, 1)
+        await self.subscribe(asker, 7)
+        await self.send(owner, 'unsub', 1)
+        await self.send(asker, 'msg', 7, {'message': 'hello'})
+        self.assertEqual([f[1] for f in await self.drain(owner)], [0])
+        await owner.disconnect()
+        await asker.disconnect()
+
+    async def test_read_reports_send_receipts(self):
+        msg = await sync_to_async(self.conv.add_message)(self.asker, 'hello')
+        owner, asker = await self.connect(self.owner), await self.connect(self.asker)
+        await self.subscribe(owner, 1)
+        await self.subscribe(asker, 7)
+
+        await self.send(owner, 'read', 1, {'last_read_id': msg.pk})
+        receipt = receipts.receipt_event(self.conv.pk, self.owner.id, msg.pk)
+        self.assertEqual(await self.drain(asker, 7), [['ev', 7, receipt]])
+        self.conv = await sync_to_async(Conversation.objects.get)(pk=self.conv.pk)
+        self.assertEqual(self.conv.last_read_id_for(self.owner.id), msg.pk)
+        await owner.disconnect()
+        await asker.disconnect()
+
+    async def test_credit_releases_the_backlog(self):
+        owner, asker = await self.connect(self.owner), await self.connect(self.asker)
+        await self.subscribe(owner, 1, window=1)
+        await self.subscribe(asker, 7)
+        for i in range(2):
+            await self.send(asker, 'msg', 7, {'message': f'message {i}'})
+        self.assertEqual([f[2]['message'] for f in await self.drain(owner, 1)], ['message 0'])
+
+        await self.send(owner, 'credit', 1, 1)
+        self.assertEqual([f[2]['message'] for f in await self.drain(owner, 1)], ['message 1'])
+        await owner.disconnect()
+        await asker.disconnect()
+
+    async def test_credit_is_capped_at_the_stream_window(self):
+        owner, asker = await self.connect(self.owner), await self.connect(self.asker)
+        await self.subscribe(owner, 1, window=1)
+        await self.subscribe(asker, 7)
+        await self.send(owner, 'credit', 1, 10)
+        for i in range(3):
+            await self.send(asker, 'msg', 7, {'message': f'message {i}'})
+        self.assertEqual([f[2]['message'] for f in await self.drain(owner, 1)], ['message 0'])
+        await owner.disconnect()
+        await asker.disconnect()
+
+    @override_settings(CHAT_MUX_BACKLOG=2)
+    async def test_overflow_becomes_lag(self):
+        owner, asker = await self.connect(self.owner), await self.connect(self.asker)
+        await self.subscribe(owner, 1, window=1)
+        await self.subscribe(asker, 7)
+        for i in range(4):
+            await self.send(asker, 'msg', 7, {'message': f'message {i}'})
+        delivered = await self.drain(owner, 1)
+        self.assertEqual(len(delivered), 1)
+
+        await self.send(owner, 'credit', 1, 5)
+        self.assertEqual(await self.drain(owner, 1), [['lag', 1, {'after': delivered[0][2]['message_id']}]])
+        await owner.disconnect()
+        await asker.disconnect()
+
+    @override_settings(CHAT_MUX_WINDOW=1, CHAT_MUX_BACKLOG=1)
+    async def test_notifications_recover_from_lag(self):
+        owner = await self.connect(self.owner)
+        layer = get_channel_layer()
+        for count in range(1, 5):
+            await layer.group_send(notifications.user_group(self.owner.id), {'type': 'unread_count', 'count': count})
+        self.assertEqual(await self.drain(owner, 0), [['ev', 0, {'type': 'unread_count', 'count': 1}]])
+
+        await self.send(owner, 'credit', 0, 1)
+        frames = await self.drain(owner, 0)
+        self.assertEqual(frames, [['lag', 0, {'after': 0}], ['ev', 0, {'type': 'unread_count', 'count': 0}]])
+        await owner.disconnect()
+
+    async def test_catch_up_after_reconnect(self):
+        seen = await sync_to_async(self.conv.add_message)(self.asker, 'seen')
+        missed = await sync_to_async(self.conv.add_message)(self.asker, 'missed')
+        owner = await self.connect(self.owner)
+        await self.subscribe(owner, 1, after=seen.pk)
+        frames = await self.drain(owner, 1)
+        self.assertEqual(frames[0][2]['message_id'], missed.pk)
+        self.assertEqual([f[2]['type'] for f in frames[1:]], ['read_receipt', 'read_receipt'])
+        await owner.disconnect()
+
+    async def test_batched_frames(self):
+        socket = WebsocketCommunicator(self.application, '/ws/mux/', subprotocols=['lf.batch'])
+        socket.scope['user'] = self.owner
+        self.assertEqual(await socket.connect(), (True, 'lf.batch'))
+        await self.send(socket, 'sub', 1, {'conversation': self.conv.pk})
+        await self.send(socket, 'unsub', 9)
+        await self.send(socket, 'bogus', 2)
+        self.assertEqual(await self.receive(socket), [['ok', 1], ['err', 2, {'error': 'bad frame'}]])
+
+        # Leaving with frames still queued cancels their flush
+        await self.send(socket, 'bogus', 3)
+        await socket.disconnect()
+
+    async def test_catch_up_stops_at_unsub(self):
+        seen = await sync_to_async(self.conv.add_message)(self.asker, 'seen')
+        await sync_to_async(self.conv.add_message)(self.asker, 'missed')
+        load_missed = consumers.MultiplexConsumer.load_missed
+
+        def unsub_meanwhile(consumer, *args):
+            # As if ["unsub", 1] were handled while the catch-up was loading
+            consumer.streams.pop(1)
+            return load_missed(consumer, *args)
+
+        owner = await self.connect(self.owner)
+        with mock.patch.object(consumers.MultiplexConsumer, 'load_missed', unsub_meanwhile):
+            await self.subscribe(owner, 1, after=seen.pk)
+            self.assertEqual(await self.drain(owner, 1), [])
+        await owner.disconnect()
+
+
+class ClientKeyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+
+    def test_resend_returns_the_first_message(self):
+        first = self.conv.add_message(self.asker, 'Is it still there?', 'k1')
+        again = self.conv.add_message(self.asker, 'Is it still there?', 'k1')
+        self.assertFalse(first.duplicate)
+        self.assertTrue(again.duplicate)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(Message.objects.count(), 1)
+        self.conv.refresh_from_db()
+        self.assertEqual(self.conv.unread_count_for(self.owner), 1)
+
+    def test_duplicates_within_a_batch(self):
+        msgs = Conversation.objects.add_messages([
+            (self.conv, self.asker, 'one', 'k1'),
+            (self.conv, self.asker, 'one', 'k1'),
+            (self.conv, self.asker, 'two'),
+        ])
+        self.assertEqual([m.duplicate for m in msgs], [False, True, False])
+        self.assertEqual(msgs[0].pk, msgs[1].pk)
+        self.assertEqual(Message.objects.count(), 2)
+        self.conv.refresh_from_db()
+        self.assertEqual(self.conv.unread_count_for(self.owner), 2)
+
+    def test_keys_are_per_sender(self):
+        self.conv.add_message(self.asker, 'hello', 'k1')
+        reply = self.conv.add_message(self.owner, 'hi', 'k1')
+        self.assertFalse(reply.duplicate)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_keys_are_per_conversation(self):
+        other = make_conversation(self.owner, self.asker, title='Red scarf')
+        first = self.conv.add_message(self.asker, 'About the umbrella', 'k1')
+        second = other.add_message(self.asker, 'About the scarf', 'k1')
+        self.assertFalse(second.duplicate)
+        self.assertNotEqual(second.pk, first.pk)
+        self.assertEqual(second.conversation_id, other.pk)
+        self.assertEqual(other.add_message(self.asker, 'About the scarf', 'k1').pk, second.pk)
+
+    def test_concurrent_insert_is_found_on_retry(self):
+        first = self.conv.add_message(self.asker, 'hello', 'k1')
+        add = ConversationQuerySet._add_messages
+        calls = []
+
+        def racing(queryset, entries):
+            calls.append(entries)
+            if len(calls) > 1:
+                return add(queryset, entries)
+            # The first attempt doesn't see the committed row, so its INSERT trips the index
+            with mock.patch.object(Message.objects, 'filter', return_value=[]):
+                return add(queryset, entries)
+
+        with mock.patch.object(ConversationQuerySet, '_add_messages', racing):
+            again = self.conv.add_message(self.asker, 'hello', 'k1')
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(again.duplicate)
+        self.assertEqual(again.pk, first.pk)
+
+    def test_http_resend(self):
+        self.client.force_login(self.asker)
+        url = reverse('poll_messages', args=[self.conv.pk])
+        body = json.dumps({'message': 'hello', 'client_key': 'k1'})
+        first = self.client.post(url, body, content_type='application/json').json()['message']
+        again = self.client.post(url, body, content_type='application/json').json()['message']
+        self.assertEqual(again['id'], first['id'])
+        self.assertEqual(first['client_key'], 'k1')
+        self.assertEqual(Message.objects.count(), 1)
+
+        for bad in ('x' * 65, '', 5):
+            response = self.client.post(url, json.dumps({'message': 'hello', 'client_key': bad}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+
+class SyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.asker = User.objects.create_user('asker')
+        self.conv = make_conversation(self.owner, self.asker)
+        self.msgs = [self.conv.add_message(self.asker, f'message {i}') for i in range(3)]
+        self.client.force_login(self.owner)
+
+    def sync(self, since=None):
+        response = self.client.get(reverse('sync'), {'since': since} if since is not None else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_new_messages_then_nothing(self):
+        first = self.sync()
+        self.assertEqual([m['id'] for m in first['messages']], [m.pk for m in self.msgs])
+        self.assertEqual(first['messages'][0]['conversation_id'], self.conv.pk)
+        self.assertEqual(first['conversations'][0]['unread'], 3)
+        self.assertFalse(first['has_more'])
+
+        second = self.sync(first['watermark'])
+        self.assertEqual((second['messages'], second['conversations']), ([], []))
+
+        later = self.conv.add_message(self.asker, 'still there?')
+        third = self.sync(second['watermark'])
+        self.assertEqual([m['id'] for m in third['messages']], [later.pk])
+
+    def test_read_changes(self):
+        watermark = self.sync()['watermark']
+        self.conv.refresh_from_db()
+        self.conv.mark_read_up_to(self.asker.id, self.msgs[-1].pk)
+        changed = self.sync(watermark)
+        self.assertEqual(changed['messages'], [])
+        self.assertEqual(changed['conversations'][0]['other_last_read_id'], self.msgs[-1].pk)
+
+    def test_pages(self):
+        with mock.patch.object(views, 'SYNC_PAGE_SIZE', 2):
+            first = self.sync()
+            self.assertTrue(first['has_more'])
+            second = self.sync(first['watermark'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual([m['id'] for m in first['messages'] + second['messages']], [m.pk for m in self.msgs])
+
+    def test_bad_watermark(self):
+        for since in ('abc', '1.x', '1.99999999999999999999'):
+            response = self.client.get(reverse('sync'), {'since': since})
+            self.assertEqual(response.status_code, 400)
+
+    def test_read_changes_without_a_last_message(self):
+        other = make_conversation(self.owner, self.asker, title='Red scarf')
+        msg = other.add_message(self.owner, 'Found it')
+        watermark = self.sync()['watermark']
+        other.refresh_from_db()
+        other.mark_read_up_to(self.asker.id, msg.pk)
+        msg.delete()
+        changed = self.sync(watermark)
+        self.assertEqual(changed['messages'], [])
+        self.assertEqual([c['id'] for c in changed['conversations']], [other.pk])
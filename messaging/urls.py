@@ -3,7 +3,10 @@ from . import views
 
 urlpatterns = [
     path('', views.inbox, name='inbox'),
+    path('sync/', views.sync, name='sync'),
     path('start/<int:item_pk>/', views.start_or_open_chat, name='start_chat'),
     path('chat/<int:conversation_id>/', views.chat_room, name='chat_room'),
     path('chat/<int:conversation_id>/poll/', views.poll_messages, name='poll_messages'),
+    path('chat/<int:conversation_id>/wait/', views.wait_messages, name='wait_messages'),
+    path('chat/<int:conversation_id>/history/', views.chat_history, name='chat_history'),
 ]
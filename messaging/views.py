@@ -1,18 +1,39 @@
+import asyncio
 import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db import IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+from django.http import JsonResponse, HttpResponseNotAllowed
 from django.views.decorators.http import require_http_methods
+from lostfound import metrics
 from .models import Conversation, Message
+from . import archive, membership, notifications, receipts
+from .db import chat_db
+
+# Longest a wait_messages request is held open, in seconds
+LONG_POLL_TIMEOUT = 25
+
+# Messages per page of chat history, on first render and per "load older" fetch
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# Most messages one sync response carries; the client calls again while has_more
+SYNC_PAGE_SIZE = 500
+# Read-state changes are matched this far before the last sync, so one that
+# committed while that sync was running isn't skipped.
+SYNC_READ_OVERLAP = timedelta(seconds=5)
 
 
 @login_required
 def inbox(request):
-    conversations = Conversation.objects.filter(
-        Q(participant1=request.user) | Q(participant2=request.user)
-    ).select_related('item', 'participant1', 'participant2').order_by('-updated_at')
+    conversations = Conversation.objects.for_user(request.user).select_related(
+        'item', 'participant1', 'participant2', 'last_message',
+    ).order_by('-updated_at')
 
     conv_list = []
     total_unread = 0
@@ -22,7 +43,7 @@ def inbox(request):
         conv_list.append({
             'conv': conv,
             'other_user': conv.get_other_user(request.user),
-            'last_message': conv.messages.last(),
+            'last_message': conv.last_message,
             'unread': unread,
         })
 
@@ -41,52 +62,92 @@ def start_or_open_chat(request, item_pk):
         messages.warning(request, "You can't chat with yourself.")
         return redirect('item_detail', pk=item_pk)
 
-    user1, user2 = request.user, item.posted_by
-    conversation = Conversation.objects.filter(item=item).filter(
-        Q(participant1=user1, participant2=user2) |
-        Q(participant1=user2, participant2=user1)
-    ).first()
-
-    if not conversation:
-        conversation = Conversation.objects.create(
-            item=item, participant1=user1, participant2=user2,
-        )
-
+    conversation, _ = Conversation.objects.get_or_create_between(item, request.user, item.posted_by)
     return redirect('chat_room', conversation_id=conversation.id)
 
 
 @login_required
 def chat_room(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id)
+    conversation = get_object_or_404(
+        Conversation.objects.select_related('item', 'participant1', 'participant2'), id=conversation_id,
+    )
 
-    if request.user not in [conversation.participant1, conversation.participant2]:
+    if request.user.id not in (conversation.participant1_id, conversation.participant2_id):
         messages.error(request, 'You do not have access to this conversation.')
         return redirect('inbox')
 
     other_user = conversation.get_other_user(request.user)
-    chat_messages = conversation.messages.select_related('sender').all()
+    chat_messages, has_older = _history_page(conversation.id)
 
-    # Mark messages as read on open
-    conversation.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
+    # Everything on the page has been seen
+    if chat_messages:
+        receipts.read_up_to(conversation, request.user.id, chat_messages[-1].id)
 
     return render(request, 'messaging/chat_room.html', {
         'conversation': conversation,
         'other_user': other_user,
         'chat_messages': chat_messages,
+        'has_older': has_older,
+        'other_last_read_id': conversation.last_read_id_for(other_user.id),
         'item': conversation.item,
     })
 
 
+@login_required
+def chat_history(request, conversation_id):
+    """
+    GET → One page of older messages, ?before=<id> (exclusive), oldest first.
+    Backs the "load older messages" control in chat_room.
+    """
+    pair = membership.participants(conversation_id)
+    if pair is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    if request.user.id not in pair:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+
+    try:
+        before_id = int(request.GET.get('before', 0)) or None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    msgs, has_more = _history_page(conversation_id, before_id)
+    return JsonResponse({
+        'messages': [_serialize(m, request.user) for m in msgs],
+        'has_more': has_more,
+    })
+
+
+def _history_page(conversation_id, before_id=None, limit=CHAT_HISTORY_PAGE_SIZE):
+    """
+    Up to ``limit`` messages older than ``before_id`` (or the newest ones),
+    oldest first, plus whether there are more before them. A backwards range
+    scan on message_conv_id_idx, so cost doesn't grow with thread length;
+    once the live rows run out the page continues from the archive.
+    """
+    msgs = Message.objects.filter(conversation_id=conversation_id)
+    if before_id is not None:
+        msgs = msgs.filter(id__lt=before_id)
+    page = list(msgs.select_related('sender').order_by('-id')[:limit + 1])
+    if len(page) > limit:
+        return page[:limit][::-1], True
+    older, has_more = archive.history(
+        conversation_id, page[-1].id if page else before_id, limit - len(page),
+    )
+    return older + page[::-1], has_more
+
+
 @login_required
 @require_http_methods(["GET", "POST"])
 def poll_messages(request, conversation_id):
     """
     GET  → Fetch new messages since ?after=<id>  (polling fallback for offline recipient)
     POST → Save a message via HTTP               (fallback send when WebSocket is down)
+           A retried POST with the same client_key returns the first one's message.
     """
-    conversation = get_object_or_404(Conversation, id=conversation_id)
-
-    if request.user not in [conversation.participant1, conversation.participant2]:
+    pair = membership.participants(conversation_id)
+    if pair is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    if request.user.id not in pair:
         return JsonResponse({'error': 'Forbidden'}, status=403)
 
     # ── POST: save message when WebSocket is unavailable ──────────────────
@@ -94,44 +155,202 @@ def poll_messages(request, conversation_id):
         try:
             body = json.loads(request.body)
             content = body.get('message', '').strip()
-        except (json.JSONDecodeError, KeyError):
+            client_key = body.get('client_key')
+        except (json.JSONDecodeError, KeyError, AttributeError):
             return JsonResponse({'error': 'Invalid request'}, status=400)
 
         if not content:
             return JsonResponse({'error': 'Empty message'}, status=400)
+        if client_key is not None and Message.clean_client_key(client_key) is None:
+            return JsonResponse({'error': 'Invalid client_key'}, status=400)
 
-        msg = Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            content=content,
-        )
-        conversation.save()  # bump updated_at
+        conversation = membership.conversation_stub(conversation_id)
+        try:
+            msg = conversation.add_message(request.user, content, client_key)
+        except IntegrityError:
+            if membership.gone(conversation_id):
+                return JsonResponse({'error': 'Not found'}, status=404)
+            raise
+        if not msg.duplicate:
+            # Same broadcast as ChatConsumer.receive, so live sockets and wait_messages see it
+            async_to_sync(metrics.group_send)(f'chat_{conversation.id}', {
+                'type': 'chat_message',
+                'conversation_id': conversation.id,
+                'message': msg.content,
+                'sender_id': request.user.id,
+                'sender_username': request.user.username,
+                'timestamp': msg.timestamp.strftime('%H:%M'),
+                'message_id': msg.id,
+                'client_key': msg.client_key,
+            })
+            notifications.push(*notifications.new_message_event(conversation, msg, request.user))
 
         return JsonResponse({
             'message': {
                 'id': msg.id,
                 'message': msg.content,
-                'sender_id': msg.sender.id,
-                'sender_username': msg.sender.username,
+                'sender_id': request.user.id,
+                'sender_username': request.user.username,
                 'timestamp': msg.timestamp.strftime('%H:%M'),
                 'is_own': True,
+                'client_key': msg.client_key,
             }
         })
 
     # ── GET: return new messages since last seen id ────────────────────────
     after_id = int(request.GET.get('after', 0))
-    msgs = conversation.messages.filter(id__gt=after_id).select_related('sender').order_by('timestamp')
+    messages_ = _messages_after(conversation_id, request.user, after_id)
+    if messages_ is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return JsonResponse({'messages': messages_})
 
-    # Mark fetched messages as read
-    msgs.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
 
+def _messages_after(conversation_id, user, after_id):
+    """
+    Serialize messages newer than ``after_id`` and advance ``user``'s read
+    watermark past them. None if the conversation was deleted after the
+    caller's membership check.
+    """
+    conversation = Conversation.objects.filter(id=conversation_id).first()
+    if conversation is None:
+        membership.gone(conversation_id)  # drops the stale participants entry
+        return None
+    msgs = list(conversation.messages.filter(id__gt=after_id).select_related('sender').order_by('timestamp'))
+    if msgs:
+        receipts.read_up_to(conversation, user.id, max(m.id for m in msgs))
+    return [_serialize(m, user) for m in msgs]
+
+
+@login_required
+def sync(request):
+    """
+    GET → Everything that changed across the user's conversations since
+    ?since=<watermark> (from the previous response; omit it to start from
+    the beginning): new messages, and the read state of every conversation
+    whose watermarks moved. One query for the messages newer than the
+    watermark's message id, plus the last message of each conversation whose
+    read state changed after its time, each joined to its conversation row;
+    a second for the conversations with no last message to join through.
+    """
+    try:
+        since_id, since_time = _parse_watermark(request.GET.get('since', ''))
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({'error': 'Invalid watermark'}, status=400)
+
+    user = request.user
+    started = timezone.now()
+    rows = list(
+        Message.objects.filter(Q(conversation__user_low=user) | Q(conversation__user_high=user))
+        .filter(
+            Q(id__gt=since_id)
+            | Q(id=F('conversation__last_message_id'), conversation__read_changed_at__gt=since_time)
+        )
+        .select_related('sender', 'conversation')
+        .order_by('id')[:SYNC_PAGE_SIZE + 1]
+    )
+    has_more = len(rows) > SYNC_PAGE_SIZE
+    rows = rows[:SYNC_PAGE_SIZE]
+
+    new = [m for m in rows if m.id > since_id]
+    conversations = {m.conversation_id: m.conversation for m in rows}
+    # Read changes in conversations whose last message was deleted (SET_NULL)
+    conversations.update(
+        (conv.id, conv) for conv in Conversation.objects.for_user(user).filter(
+            last_message__isnull=True, read_changed_at__gt=since_time,
+        )
+    )
+    # Until the backlog is drained, keep matching read changes from the old time
+    next_time = since_time if has_more else started - SYNC_READ_OVERLAP
     return JsonResponse({
-        'messages': [{
-            'id': m.id,
-            'message': m.content,
-            'sender_id': m.sender.id,
-            'sender_username': m.sender.username,
-            'timestamp': m.timestamp.strftime('%H:%M'),
-            'is_own': m.sender == request.user,
-        } for m in msgs]
+        'messages': [{**_serialize(m, user), 'conversation_id': m.conversation_id} for m in new],
+        'conversations': [
+            {
+                'id': conv.id,
+                'unread': conv.unread_count_for(user),
+                'last_read_id': conv.last_read_id_for(user.id),
+                'other_last_read_id': conv.last_read_id_for(conv.other_participant_id(user.id)),
+            }
+            for conv in conversations.values()
+        ],
+        'watermark': _format_watermark(new[-1].id if new else since_id, next_time),
+        'has_more': has_more,
     })
+
+
+def _parse_watermark(value):
+    """``"<message id>.<epoch ms>"`` → (message id, aware datetime). Empty means the beginning."""
+    if not value:
+        return 0, datetime.fromtimestamp(0, dt_timezone.utc)
+    message_id, _, millis = value.partition('.')
+    return int(message_id), datetime.fromtimestamp(int(millis) / 1000, dt_timezone.utc)
+
+
+def _format_watermark(message_id, when):
+    return f'{message_id}.{int(when.timestamp() * 1000)}'
+
+
+def _serialize(m, user):
+    data = {
+        'id': m.id,
+        'message': m.content,
+        'sender_id': m.sender_id,
+        'sender_username': m.sender.username,
+        'timestamp': m.timestamp.strftime('%H:%M'),
+        'is_own': m.sender_id == user.id,
+    }
+    if data['is_own'] and m.client_key:
+        data['client_key'] = m.client_key
+    return data
+
+
+async def wait_messages(request, conversation_id):
+    """
+    GET → Long-poll for messages since ?after=<id>.
+
+    Returns at once if there is anything newer, otherwise parks on the
+    conversation's channel group until ChatConsumer or poll_messages
+    broadcasts a message, or ?timeout= seconds pass. A parked request holds
+    no database connection or thread, unlike the 3-second poll_messages loop.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    user = await chat_db.run(lambda: request.user if request.user.is_authenticated else None)
+    if user is None:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+
+    pair = await membership.aparticipants(conversation_id)
+    if pair is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    if user.id not in pair:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+
+    try:
+        after_id = int(request.GET.get('after', 0))
+        timeout = min(max(float(request.GET.get('timeout', LONG_POLL_TIMEOUT)), 0), LONG_POLL_TIMEOUT)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    has_new = Message.objects.filter(conversation_id=conversation_id, id__gt=after_id).exists
+    if not await chat_db.run(has_new):
+        layer = get_channel_layer()
+        group = f'chat_{conversation_id}'
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        try:
+            # Re-check after subscribing so a message saved in between is not missed.
+            if not await chat_db.run(has_new):
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + timeout
+                # Read receipts share the group; only a new message ends the wait
+                while (await asyncio.wait_for(layer.receive(channel), deadline - loop.time()))['type'] != 'chat_message':
+                    pass
+        except asyncio.TimeoutError:
+            return JsonResponse({'messages': []})
+        finally:
+            await layer.group_discard(group, channel)
+
+    messages_ = await chat_db.run(_messages_after, conversation_id, user, after_id)
+    if messages_ is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return JsonResponse({'messages': messages_})